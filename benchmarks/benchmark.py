@@ -0,0 +1,350 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import platform
+import tempfile
+import subprocess
+from pyfastaq import tasks
+from pyfastaq import utils as fastaq_utils
+from farm_blast import utils, chunker, offsets
+
+class Error (Exception): pass
+
+
+# Version of the JSON results format. Change this if the format changes, so
+# that results from before and after the change are not compared
+format_version = 1
+
+# Parameters of each benchmark at each scale
+scales = {
+    'small': {
+        'coords_split_seqs': 1000,
+        'blast_lines': 100000,
+        'query_seqs': 1000,
+        'query_seq_length': 1000,
+        'combine_chunks': 10,
+    },
+    'medium': {
+        'coords_split_seqs': 10000,
+        'blast_lines': 1000000,
+        'query_seqs': 10000,
+        'query_seq_length': 2000,
+        'combine_chunks': 50,
+    },
+    'large': {
+        'coords_split_seqs': 100000,
+        'blast_lines': 10000000,
+        'query_seqs': 50000,
+        'query_seq_length': 5000,
+        'combine_chunks': 200,
+    },
+}
+
+# Number of bases in each piece that long query sequences are split into,
+# as in the coords file made by the setup job
+chunk_size = 500000
+
+# Number of bases in each split file when timing chunking
+chunk_split_bases = 500000
+
+# A benchmark is a regression if it is this much slower than before
+regression_tolerance = 0.1
+
+
+def write_random_fasta(filename, number_of_seqs, seq_length, seed=42, name_prefix='seq'):
+    '''Writes a FASTA file of random sequences, all of the same length'''
+    rand = random.Random(seed)
+    f = fastaq_utils.open_file_write(filename)
+    for i in range(number_of_seqs):
+        print('>' + name_prefix + str(i), file=f)
+        seq = ''.join(rand.choices('ACGT', k=seq_length))
+        for j in range(0, seq_length, 60):
+            print(seq[j:j + 60], file=f)
+    fastaq_utils.close(f)
+
+
+def write_coords_file(filename, split_seqs, pieces=3):
+    '''Writes a query.split.coords file, as if split_seqs sequences were each
+       split into the given number of pieces. Returns list of the piece names'''
+    names = []
+    f = fastaq_utils.open_file_write(filename)
+    for i in range(split_seqs):
+        for j in range(pieces):
+            name = 'contig' + str(i) + ':' + str(j * chunk_size + 1) + '-' + str((j + 1) * chunk_size)
+            print(name, 'contig' + str(i), j * chunk_size, sep='\t', file=f)
+            names.append(name)
+    fastaq_utils.close(f)
+    return names
+
+
+def write_blast_files(blast_files, coords_file, lines, split_seqs, seed=42):
+    '''Writes synthetic tabular blast output, and the matching coords file.
+       About half of the query names are in the coords file. blast_files
+       can be one filename or a list of filenames, in which case the lines
+       are shared between the files, with all the hits of each query in
+       the same file'''
+    if type(blast_files) == str:
+        blast_files = [blast_files]
+
+    rand = random.Random(seed)
+    names = write_coords_file(coords_file, split_seqs)
+    names += ['read' + str(i) for i in range(len(names))]
+    names.sort()
+    lines_per_file = lines // len(blast_files)
+    names_per_file = max(1, len(names) // len(blast_files))
+
+    for file_number, filename in enumerate(blast_files):
+        file_names = names[file_number * names_per_file:(file_number + 1) * names_per_file]
+        query_lines = [rand.choice(file_names) for i in range(lines_per_file)]
+        query_lines.sort()
+        f = fastaq_utils.open_file_write(filename)
+        for i, query in enumerate(query_lines):
+            qstart = rand.randint(1, chunk_size - 1000)
+            sstart = rand.randint(1, 10000000)
+            print(query, 'ref' + str(i % 50), '98.50', 1000, 15, 0,
+                  qstart, qstart + 999, sstart, sstart + 999, '0.0', '1781', sep='\t', file=f)
+        fastaq_utils.close(f)
+
+
+def time_call(function, repeats, setup=None):
+    '''Calls function repeats times, returning the list of times taken in
+       seconds. If setup is given, it is called before each call of
+       function, and is not timed'''
+    times = []
+    for i in range(repeats):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def _result(name, scale, parameters, times, items, units):
+    best = min(times)
+    return {
+        'name': name,
+        'scale': scale,
+        'parameters': parameters,
+        'seconds': round(best, 6),
+        'times': [round(x, 6) for x in times],
+        'items': items,
+        'units': units,
+        'per_second': round(items / best, 3) if best > 0 else None,
+    }
+
+
+def _clean_dir(dirname):
+    if os.path.exists(dirname):
+        shutil.rmtree(dirname)
+    os.mkdir(dirname)
+
+
+def benchmark_offset_coords(tmpdir, scale, repeats):
+    split_seqs = scales[scale]['coords_split_seqs']
+    coords_file = os.path.join(tmpdir, 'coords.tsv')
+    write_coords_file(coords_file, split_seqs)
+    times = time_call(lambda: utils.offset_coords_file_to_dict(coords_file), repeats)
+    return _result('offset_coords_file_to_dict', scale, {'split_seqs': split_seqs}, times, 3 * split_seqs, 'coords lines')
+
+
+def benchmark_fix_blast_coords(tmpdir, scale, repeats):
+    parameters = {
+        'lines': scales[scale]['blast_lines'],
+        'split_seqs': scales[scale]['coords_split_seqs'],
+    }
+    blast_file = os.path.join(tmpdir, 'blast.out')
+    coords_file = os.path.join(tmpdir, 'query.split.coords')
+    outfile = os.path.join(tmpdir, 'blast.out.fixed')
+    write_blast_files(blast_file, coords_file, parameters['lines'], parameters['split_seqs'])
+    times = time_call(lambda: utils.fix_blast_coords(blast_file, coords_file, outfile), repeats)
+    return _result('fix_blast_coords', scale, parameters, times, parameters['lines'], 'blast lines')
+
+
+def benchmark_offsets_index(tmpdir, scale, repeats):
+    '''Times making an offsets.OffsetsIndex, and fixing blast coords using it
+       instead of a dict'''
+    parameters = {
+        'lines': scales[scale]['blast_lines'],
+        'split_seqs': scales[scale]['coords_split_seqs'],
+    }
+    blast_file = os.path.join(tmpdir, 'blast.out')
+    coords_file = os.path.join(tmpdir, 'query.split.coords')
+    index_file = os.path.join(tmpdir, 'query.split.coords.index')
+    outfile = os.path.join(tmpdir, 'blast.out.fixed')
+    write_blast_files(blast_file, coords_file, parameters['lines'], parameters['split_seqs'])
+    results = []
+
+    times = time_call(lambda: offsets.make_index(coords_file, index_file), repeats)
+    results.append(_result('offsets_index_make', scale, {'split_seqs': parameters['split_seqs']}, times, 3 * parameters['split_seqs'], 'coords lines'))
+
+    original_min_size = utils.compact_offsets_min_size
+    utils.compact_offsets_min_size = 0
+    try:
+        times = time_call(lambda: utils.fix_blast_coords(blast_file, coords_file, outfile), repeats)
+    finally:
+        utils.compact_offsets_min_size = original_min_size
+    results.append(_result('fix_blast_coords_offsets_index', scale, parameters, times, parameters['lines'], 'blast lines'))
+    return results
+
+
+def benchmark_chunking(tmpdir, scale, repeats):
+    '''Times the two ways the setup job can split the query'''
+    parameters = {
+        'query_seqs': scales[scale]['query_seqs'],
+        'query_seq_length': scales[scale]['query_seq_length'],
+        'split_bases': chunk_split_bases,
+    }
+    query = os.path.join(tmpdir, 'query.fa')
+    reference = os.path.join(tmpdir, 'reference.fa')
+    write_random_fasta(query, parameters['query_seqs'], parameters['query_seq_length'])
+    write_random_fasta(reference, 1, 100000, seed=1, name_prefix='ref')
+    split_dir = os.path.join(tmpdir, 'split')
+    outprefix = os.path.join(split_dir, 'query.split')
+    bases = parameters['query_seqs'] * parameters['query_seq_length']
+    results = []
+
+    times = time_call(
+        lambda: tasks.split_by_fixed_size(query, outprefix, chunk_split_bases, 1000, skip_if_all_Ns=True),
+        repeats,
+        setup=lambda: _clean_dir(split_dir)
+    )
+    results.append(_result('chunk_fastaq', scale, parameters, times, bases, 'query bases'))
+
+    times = time_call(
+        lambda: chunker.chunk_query(query, outprefix, chunk_split_bases, 1000, 'blastn', os.path.getsize(reference)),
+        repeats,
+        setup=lambda: _clean_dir(split_dir)
+    )
+    results.append(_result('chunk_balanced', scale, parameters, times, bases, 'query bases'))
+    return results
+
+
+def benchmark_combine(tmpdir, scale, repeats):
+    '''Times the combine job fixing the coordinates of the output of every
+       array element into one gzipped file'''
+    parameters = {
+        'lines': scales[scale]['blast_lines'],
+        'split_seqs': scales[scale]['coords_split_seqs'],
+        'chunks': scales[scale]['combine_chunks'],
+    }
+    blast_files = [os.path.join(tmpdir, 'tmp.array.out.' + str(i)) for i in range(1, parameters['chunks'] + 1)]
+    coords_file = os.path.join(tmpdir, 'query.split.coords')
+    outfile = os.path.join(tmpdir, 'blast.out.gz')
+    write_blast_files(blast_files, coords_file, parameters['lines'], parameters['split_seqs'])
+    times = time_call(lambda: utils.fix_blast_coords(blast_files, coords_file, outfile), repeats)
+    return _result('combine', scale, parameters, times, parameters['lines'], 'blast lines')
+
+
+benchmarks = {
+    'offset_coords_file_to_dict': benchmark_offset_coords,
+    'fix_blast_coords': benchmark_fix_blast_coords,
+    'chunking': benchmark_chunking,
+    'combine': benchmark_combine,
+    'offsets_index': benchmark_offsets_index,
+}
+
+
+def git_commit():
+    '''Returns the git commit of this code, or None if it is not known'''
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except:
+        return None
+
+
+def run_benchmarks(scale_names, repeats=3, names=None, tmpdir=None):
+    '''Runs the benchmarks at each of the scales. names = list of names of
+       benchmarks in the dict benchmarks (default is all of them).
+       Returns dict of results, in the format written by write_json'''
+    if names is None:
+        names = sorted(benchmarks)
+
+    for scale in scale_names:
+        if scale not in scales:
+            raise Error('Unknown benchmark scale: ' + scale)
+    for name in names:
+        if name not in benchmarks:
+            raise Error('Unknown benchmark: ' + name)
+
+    results = []
+    for scale in scale_names:
+        for name in names:
+            bench_dir = tempfile.mkdtemp(prefix='tmp.benchmark.', dir=tmpdir)
+            try:
+                new_results = benchmarks[name](bench_dir, scale, repeats)
+            finally:
+                shutil.rmtree(bench_dir)
+            if type(new_results) != list:
+                new_results = [new_results]
+            results.extend(new_results)
+
+    results.sort(key=lambda x: (x['name'], list(scales).index(x['scale'])))
+    return {
+        'format_version': format_version,
+        'environment': {
+            'commit': git_commit(),
+            'platform': platform.platform(),
+            'python': platform.python_version(),
+            'cpus': os.cpu_count(),
+        },
+        'repeats': repeats,
+        'results': results,
+    }
+
+
+def write_json(results, filename):
+    '''Writes results to a file, with keys sorted so that files from
+       different runs can be compared with diff'''
+    with open(filename, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+        print(file=f)
+
+
+def load_json(filename):
+    with open(filename) as f:
+        results = json.load(f)
+
+    if results.get('format_version') != format_version:
+        raise Error('Benchmark results file "' + filename + '" has format version ' + str(results.get('format_version')) + '. Expected ' + str(format_version))
+
+    return results
+
+
+def compare_results(old, new, tolerance=regression_tolerance):
+    '''Compares two sets of results, matching benchmarks by name and scale.
+       Returns list of tuples (name, scale, old seconds, new seconds, ratio,
+       is regression), where ratio = new seconds / old seconds'''
+    old_results = {(x['name'], x['scale']): x for x in old['results']}
+    comparison = []
+
+    for result in new['results']:
+        key = (result['name'], result['scale'])
+        if key not in old_results or old_results[key]['parameters'] != result['parameters']:
+            continue
+
+        old_seconds = old_results[key]['seconds']
+        ratio = result['seconds'] / old_seconds if old_seconds > 0 else None
+        regression = ratio is not None and ratio > 1 + tolerance
+        comparison.append((key[0], key[1], old_seconds, result['seconds'], ratio, regression))
+
+    return comparison
+
+
+def print_results(results, f=sys.stdout):
+    print('name', 'scale', 'seconds', 'per_second', 'units', sep='\t', file=f)
+    for result in results['results']:
+        print(result['name'], result['scale'], result['seconds'], result['per_second'], result['units'], sep='\t', file=f)
+
+
+def print_comparison(comparison, f=sys.stdout):
+    print('name', 'scale', 'old_seconds', 'new_seconds', 'ratio', 'regression', sep='\t', file=f)
+    for name, scale, old_seconds, new_seconds, ratio, regression in comparison:
+        print(name, scale, old_seconds, new_seconds, 'NA' if ratio is None else round(ratio, 3), 'yes' if regression else 'no', sep='\t', file=f)
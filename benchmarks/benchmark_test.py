@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+
+import sys
+import os
+import unittest
+
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from pyfastaq import sequences
+from farm_blast import utils
+import benchmark
+
+class TestBenchmark(unittest.TestCase):
+    def test_write_random_fasta(self):
+        '''Test write_random_fasta'''
+        tmp_file = 'tmp.benchmark_test.fa'
+        benchmark.write_random_fasta(tmp_file, 3, 100)
+        seqs = [(x.id, len(x), set(x.seq)) for x in sequences.file_reader(tmp_file)]
+        self.assertEqual(['seq0', 'seq1', 'seq2'], [x[0] for x in seqs])
+        self.assertEqual([100, 100, 100], [x[1] for x in seqs])
+        self.assertTrue(all([x[2].issubset(set('ACGT')) for x in seqs]))
+        os.unlink(tmp_file)
+
+
+    def test_write_blast_files(self):
+        '''Test write_blast_files writes output matching the coords file'''
+        blast_files = ['tmp.benchmark_test.out.1', 'tmp.benchmark_test.out.2']
+        coords_file = 'tmp.benchmark_test.coords'
+        benchmark.write_blast_files(blast_files, coords_file, 100, 5)
+        offsets = utils.offset_coords_file_to_dict(coords_file)
+        self.assertEqual(15, len(offsets))
+
+        queries = []
+        for filename in blast_files:
+            with open(filename) as f:
+                lines = [x.rstrip().split('\t') for x in f]
+            self.assertEqual(50, len(lines))
+            self.assertTrue(all([len(x) == 12 for x in lines]))
+            queries.append(set([x[0] for x in lines]))
+            os.unlink(filename)
+
+        # all the hits of each query are in the same file
+        self.assertEqual(set(), queries[0].intersection(queries[1]))
+        self.assertTrue(len(offsets.keys() & (queries[0] | queries[1])) > 0)
+        os.unlink(coords_file)
+
+
+    def test_run_benchmarks(self):
+        '''Test run_benchmarks and the JSON results'''
+        benchmark.scales['test'] = {
+            'coords_split_seqs': 10,
+            'blast_lines': 100,
+            'query_seqs': 10,
+            'query_seq_length': 100,
+            'combine_chunks': 2,
+        }
+        results = benchmark.run_benchmarks(['test'], repeats=2)
+        del benchmark.scales['test']
+        self.assertEqual(benchmark.format_version, results['format_version'])
+        self.assertEqual(['chunk_balanced', 'chunk_fastaq', 'combine', 'fix_blast_coords', 'fix_blast_coords_offsets_index', 'offset_coords_file_to_dict', 'offsets_index_make'], [x['name'] for x in results['results']])
+        for result in results['results']:
+            self.assertEqual(2, len(result['times']))
+            self.assertEqual(min(result['times']), result['seconds'])
+
+        tmp_json = 'tmp.benchmark_test.json'
+        benchmark.write_json(results, tmp_json)
+        self.assertEqual(results, benchmark.load_json(tmp_json))
+        os.unlink(tmp_json)
+
+        with self.assertRaises(benchmark.Error):
+            benchmark.run_benchmarks(['oops'])
+
+
+    def test_compare_results(self):
+        '''Test compare_results'''
+        def result(name, seconds, parameters=None):
+            return {'name': name, 'scale': 'small', 'seconds': seconds, 'parameters': {} if parameters is None else parameters}
+
+        old = {'results': [result('a', 1), result('b', 1), result('c', 1), result('d', 1)]}
+        new = {'results': [result('a', 1.05), result('b', 2), result('c', 1, {'x': 1}), result('e', 1)]}
+        expected = [
+            ('a', 'small', 1, 1.05, 1.05, False),
+            ('b', 'small', 1, 2, 2, True),
+        ]
+        self.assertEqual(expected, benchmark.compare_results(old, new))
+
+
+if __name__ == '__main__':
+    unittest.main()
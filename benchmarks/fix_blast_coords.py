@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+
+# Compares the throughput of utils.fix_blast_coords with the original
+# line-by-line implementation, using synthetic blast output.
+# Usage: python3 benchmarks/fix_blast_coords.py [--lines N] [--gzip]
+
+import os
+import sys
+import gzip
+import time
+import shutil
+import filecmp
+import argparse
+import tempfile
+
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from pyfastaq import utils as fastaq_utils
+from farm_blast import utils
+import benchmark
+
+
+def fix_blast_coords_line_by_line(blast_file, coords_file, outfile):
+    '''The original implementation of utils.fix_blast_coords, kept here as a baseline'''
+    coords_offset = utils.offset_coords_file_to_dict(coords_file)
+    fin = fastaq_utils.open_file_read(blast_file)
+    fout = fastaq_utils.open_file_write(outfile)
+    for line in fin:
+        if '\t' not in line:
+            continue
+
+        data = line.rstrip().split()
+        if data[0] in coords_offset:
+            data[6] = str(int(data[6]) + coords_offset[data[0]][1])
+            data[7] = str(int(data[7]) + coords_offset[data[0]][1])
+            data[0] = coords_offset[data[0]][0]
+
+        line = '\t'.join(data)
+
+        print(line.rstrip(),file=fout)
+
+    fastaq_utils.close(fin)
+    fastaq_utils.close(fout)
+
+
+def time_function(function, blast_file, coords_file, outfile):
+    start = time.perf_counter()
+    function(blast_file, coords_file, outfile)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark utils.fix_blast_coords against the original implementation')
+    parser.add_argument('--lines', type=int, help='Number of lines of blast output [%(default)s]', default=1000000)
+    parser.add_argument('--gzip', action='store_true', help='Use gzipped input and output files, as the pipeline does')
+    options = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix='tmp.benchmark.fix_blast_coords.')
+    suffix = '.gz' if options.gzip else ''
+    blast_file = os.path.join(tmpdir, 'blast.out' + suffix)
+    coords_file = os.path.join(tmpdir, 'query.split.coords')
+    benchmark.write_blast_files(blast_file, coords_file, options.lines, 1000)
+    megabytes = os.path.getsize(blast_file) / 1000000
+
+    results = {}
+    for name, function in [('line_by_line', fix_blast_coords_line_by_line), ('batched', utils.fix_blast_coords)]:
+        results[name] = time_function(function, blast_file, coords_file, os.path.join(tmpdir, name + '.out' + suffix))
+        print(name, '{:.2f}s'.format(results[name]), '{:.0f} lines/s'.format(options.lines / results[name]), '{:.1f} MB/s (input file size)'.format(megabytes / results[name]), sep='\t')
+
+    outfiles = [os.path.join(tmpdir, name + '.out' + suffix) for name in results]
+    if options.gzip:
+        contents = []
+        for filename in outfiles:
+            with gzip.open(filename, 'rt') as f:
+                contents.append(f.read())
+        same = contents[0] == contents[1]
+    else:
+        same = filecmp.cmp(outfiles[0], outfiles[1], shallow=False)
+
+    print('speedup', '{:.2f}x'.format(results['line_by_line'] / results['batched']), sep='\t')
+    print('outputs identical', same, sep='\t')
+    shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
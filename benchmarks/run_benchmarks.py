@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+
+# Times the parts of the pipeline that run in python, on synthetic data, at
+# one or more scales. Results are written to a JSON file that can be compared
+# with the results from another commit to catch regressions.
+# Usage:
+#   python3 benchmarks/run_benchmarks.py --scales small,medium --outfile new.json
+#   python3 benchmarks/run_benchmarks.py --scales small --compare old.json --outfile new.json
+
+import os
+import sys
+import argparse
+
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import benchmark
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run farm_blast benchmarks on synthetic data')
+    parser.add_argument('--scales', help='Comma-separated list of scales to run, from: ' + ','.join(benchmark.scales) + ' [%(default)s]', default='small')
+    parser.add_argument('--benchmarks', help='Comma-separated list of benchmarks to run, from: ' + ','.join(sorted(benchmark.benchmarks)) + '. Default is all of them', default=None)
+    parser.add_argument('--repeats', type=int, help='Number of times to run each benchmark. The fastest time is reported [%(default)s]', default=3)
+    parser.add_argument('--tmpdir', help='Directory in which to write temporary files. Default is the system default')
+    parser.add_argument('--compare', help='JSON file of results from a previous run, to compare with', metavar='FILENAME')
+    parser.add_argument('--tolerance', type=float, help='When using --compare, report a regression if a benchmark is slower by more than this fraction [%(default)s]', default=benchmark.regression_tolerance)
+    parser.add_argument('--outfile', help='Name of JSON file to write results to [%(default)s]', default='benchmark_results.json')
+    options = parser.parse_args()
+
+    names = None if options.benchmarks is None else options.benchmarks.split(',')
+    results = benchmark.run_benchmarks(options.scales.split(','), repeats=options.repeats, names=names, tmpdir=options.tmpdir)
+    benchmark.write_json(results, options.outfile)
+    benchmark.print_results(results)
+
+    if options.compare is not None:
+        old = benchmark.load_json(options.compare)
+        comparison = benchmark.compare_results(old, results, tolerance=options.tolerance)
+        print()
+        benchmark.print_comparison(comparison)
+        if any([x[-1] for x in comparison]):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,2 +1,2 @@
-__all__ = ['utils', 'blast', 'pipeline']
+__all__ = ['utils', 'api', 'batch', 'blast', 'bgzf', 'calibrate', 'chunker', 'columnar', 'db_cache', 'dedup', 'driver', 'filters', 'follow', 'local_executor', 'memory', 'offsets', 'pipeline', 'planner', 'report', 'shards', 'sorter', 'straggler', 'work_queue']
 from farm_blast import *
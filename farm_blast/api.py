@@ -0,0 +1,137 @@
+import os
+import shutil
+import tempfile
+import threading
+import subprocess
+import collections
+from pyfastaq import sequences, tasks
+from pyfastaq import utils as fastaq_utils
+from farm_blast import blast, chunker, columnar, pipeline, utils
+
+class Error (Exception): pass
+
+
+class Hit(collections.namedtuple('Hit', columnar.column_names)):
+    '''One line of tabulated blast output, with the numbers converted
+       from strings'''
+    __slots__ = ()
+
+    @classmethod
+    def from_line(cls, line):
+        fields = line.rstrip('\n').split('\t')
+        if len(fields) != len(columnar.column_names):
+            raise Error('Expected ' + str(len(columnar.column_names)) + ' columns in blast output. Got this line:\n' + line)
+        values = [fields[0], fields[1]]
+        for name, value in zip(columnar.column_names[2:], fields[2:]):
+            values.append(int(value) if columnar.column_types[name] == 'Q' else float(value))
+        return cls(*values)
+
+
+def read_hits(blast_file):
+    '''Iterates over the hits in a file of tabulated blast output, such as
+       the blast.out.gz made by the pipeline'''
+    f = fastaq_utils.open_file_read(blast_file)
+    for line in f:
+        if '\t' in line:
+            yield Hit.from_line(line)
+    fastaq_utils.close(f)
+
+
+def _write_query_pieces(query, fout, coords_offset, split_bases, split_bases_tolerance, skip_all_Ns, errors):
+    '''Writes the sequences in query to fout, with names cut off at the first
+       whitespace, and split into pieces in the same way as the pipeline
+       splits the query. The original name and offset of each piece are
+       added to coords_offset before the piece is written. fout is always
+       closed, so that blast does not wait for more input. Any error is
+       appended to the list errors, for the main thread to raise'''
+    try:
+        for seq in sequences.file_reader(query):
+            seq.id = seq.id.split()[0]
+            for piece, offset in chunker.sequence_pieces(seq, split_bases, split_bases_tolerance, skip_all_Ns):
+                if offset is not None:
+                    coords_offset[piece.id] = offset
+                print(piece, file=fout)
+    except BrokenPipeError:
+        # blast was stopped, because the caller did not want any more hits
+        pass
+    except Exception as e:
+        errors.append(e)
+    finally:
+        try:
+            fout.close()
+        except BrokenPipeError:
+            pass
+
+
+def local_hits(reference, query, blast_type='blastn', blastall=False, evalue=None, word_size=None, no_filter=False, blast_options='', threads=1, split_bases=500000, split_bases_tolerance=1000, skip_all_Ns=True):
+    '''Runs BLAST on this machine and iterates over the hits as Hit objects,
+       as they are made. The query is split in the same way as the pipeline
+       splits it, and written to BLAST's stdin, and BLAST's stdout is read
+       straight into the coordinate fixer, so there are no intermediate
+       files. If the reference is not already a BLAST database, then one
+       is made in a temporary directory, which is deleted at the end'''
+    blast_obj = blast.Blast(
+        reference,
+        'stdin' if blastall else '-',
+        outfile='stdout' if blastall else '-',
+        blastall=blastall,
+        blast_type=blast_type,
+        evalue=evalue,
+        word_size=word_size,
+        no_filter=no_filter,
+        extra_options=blast_options,
+        threads=threads
+    )
+
+    tmp_dir = None
+    if not blast_obj.blast_db_exists():
+        tmp_dir = tempfile.mkdtemp(prefix='tmp.farm_blast_api.', dir=os.getcwd())
+        blast_obj.reference = os.path.join(tmp_dir, 'reference.fa')
+        tasks.to_fasta(reference, blast_obj.reference, strip_after_first_whitespace=True)
+        if subprocess.call(blast_obj.format_database_command(), shell=True, stdout=subprocess.DEVNULL) != 0:
+            shutil.rmtree(tmp_dir)
+            raise Error('Error making BLAST database from "' + reference + '"')
+
+    coords_offset = {}
+    errors = []
+    proc = subprocess.Popen(blast_obj.get_run_command(), shell=True, stdin=subprocess.PIPE, stdout=subprocess.PIPE, universal_newlines=True)
+    writer = threading.Thread(target=_write_query_pieces, args=(query, proc.stdin, coords_offset, split_bases, split_bases_tolerance, skip_all_Ns, errors))
+    writer.start()
+
+    try:
+        for line in proc.stdout:
+            for fixed in utils.fix_blast_line_list([line], coords_offset):
+                yield Hit.from_line(fixed)
+    finally:
+        # if the caller stopped early, BLAST is still running
+        if proc.poll() is None:
+            proc.kill()
+        writer.join()
+        returncode = proc.wait()
+        proc.stdout.close()
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir)
+
+    if len(errors):
+        raise Error('Error reading query file "' + query + '": ' + str(errors[0]))
+    if returncode != 0:
+        raise Error('Error running BLAST. Command was:\n' + blast_obj.get_run_command())
+
+
+def farm_hits(reference, query, options=None):
+    '''Runs the whole pipeline, waiting until it finishes, then iterates
+       over the hits in the final output as Hit objects. options is a list
+       of command line options for farm_blast, eg ['--outdir', 'out',
+       '--evalue', '0.01']. The jobs are run on the farm, unless
+       '--no_bsub' is one of the options'''
+    args = [] if options is None else list(options)
+    opts = pipeline.get_opts(args=args + ['--async_driver', reference, query])
+    if opts.batch:
+        raise Error('Cannot use --batch with farm_hits')
+    blast_pipeline = pipeline.Pipeline(opts, shutil.which('farm_blast') or 'farm_blast')
+    try:
+        blast_pipeline.run()
+    except pipeline.Error as e:
+        raise Error(str(e))
+
+    yield from read_hits(os.path.join(blast_pipeline.outdir, 'blast.out.gz'))
@@ -0,0 +1,137 @@
+import os
+import collections
+from pyfastaq import sequences, utils
+from farm_blast import bgzf
+
+class Error (Exception): pass
+
+
+# In batch mode, the sequences of query file number N are renamed to have
+# this prefix, followed by N and a dot, so that their hits can be put back
+# into the right output file
+name_prefix = 'batch'
+
+# Most output files that Demultiplexer keeps open at once. Each one also
+# has an index entries file open
+max_open_writers = 100
+
+
+def output_filename(index):
+    return 'batch.' + str(index) + '.blast.out.gz'
+
+
+def read_query_list(filename):
+    '''Returns list of absolute paths of the query files named in filename,
+       one per line. Relative paths are relative to the current directory'''
+    f = utils.open_file_read(filename)
+    query_files = [os.path.abspath(line.strip()) for line in f if line.strip() != '']
+    utils.close(f)
+
+    if len(query_files) == 0:
+        raise Error('No query files found in file "' + filename + '"')
+
+    for query_file in query_files:
+        if not os.path.exists(query_file):
+            raise Error('Query file "' + query_file + '" not found. Cannot continue')
+
+    return query_files
+
+
+def write_batch_file(query_files, batch_file):
+    '''Writes a line "index<TAB>query file<TAB>output file" for each
+       query file to batch_file'''
+    f = utils.open_file_write(batch_file)
+    for i, query_file in enumerate(query_files):
+        print(i + 1, query_file, output_filename(i + 1), sep='\t', file=f)
+    utils.close(f)
+
+
+def load_batch_file(batch_file):
+    '''Returns dict of index -> (query file, output file) from a file made
+       by write_batch_file'''
+    batch = {}
+    f = utils.open_file_read(batch_file)
+    for line in f:
+        index, query_file, output_file = line.rstrip('\n').split('\t')
+        batch[int(index)] = (query_file, output_file)
+    utils.close(f)
+    return batch
+
+
+def make_batch_query(batch_file, outfile):
+    '''Writes all the sequences of the query files listed in batch_file
+       to outfile in FASTA format, renamed with the number of their query
+       file. Names are cut off at the first whitespace. Returns the
+       number of sequences written'''
+    f_out = utils.open_file_write(outfile)
+    count = 0
+    batch = load_batch_file(batch_file)
+
+    for index in sorted(batch):
+        prefix = name_prefix + str(index) + '.'
+        for seq in sequences.file_reader(batch[index][0]):
+            print(sequences.Fasta(prefix + seq.id.split()[0], seq.seq), file=f_out)
+            count += 1
+
+    utils.close(f_out)
+    return count
+
+
+class Demultiplexer:
+    def __init__(self, batch_file):
+        '''Stage for utils.fix_blast_coords that writes the hits of each
+           query file of a batch to its own block gzipped, indexed output
+           file, with the original query names. Lines are not passed on to
+           any later stage. An output file is written for every query file,
+           even if it has no hits. At most max_open_writers output files are
+           open at once: the least recently used one is suspended when
+           another is needed'''
+        self.batch = load_batch_file(batch_file)
+        self.writers = {}
+        self.open_writers = collections.OrderedDict()
+
+
+    def _writer(self, index):
+        writer = self.writers.get(index)
+        if writer is None:
+            try:
+                output_file = self.batch[index][1]
+            except KeyError:
+                raise Error('Query file number ' + str(index) + ' not found in batch')
+            writer = bgzf.Writer(output_file, index_file=bgzf.index_filename(output_file))
+            self.writers[index] = writer
+
+        if index in self.open_writers:
+            self.open_writers.move_to_end(index)
+        else:
+            if len(self.open_writers) >= max_open_writers:
+                self.writers[self.open_writers.popitem(last=False)[0]].suspend()
+            self.open_writers[index] = True
+        return writer
+
+
+    def process(self, lines):
+        groups = {}
+        start = len(name_prefix)
+        for line in lines:
+            dot = line.find('.')
+            try:
+                if not line.startswith(name_prefix):
+                    raise ValueError
+                index = int(line[start:dot])
+            except ValueError:
+                raise Error('Query name does not start with batch number. Cannot continue. Line was:\n' + line)
+            groups.setdefault(index, []).append(line[dot + 1:])
+
+        for index, group in groups.items():
+            self._writer(index).write('\n'.join(group) + '\n')
+
+        return []
+
+
+    def finish(self):
+        for index in self.batch:
+            self._writer(index).close()
+            del self.open_writers[index]
+        self.writers = {}
+        return []
@@ -0,0 +1,339 @@
+import os
+import mmap
+import bisect
+import struct
+import shutil
+import zlib
+import tempfile
+import subprocess
+from array import array
+
+class Error (Exception): pass
+
+
+# Number of uncompressed bytes in each block. This is the largest size that
+# is sure to fit in a BGZF block after compression
+block_size = 65280
+
+# Same as the gzip -9 that was used before blast.out.gz was made in blocks
+compress_level = 9
+
+# Empty block that marks the end of a BGZF file
+eof_block = bytes.fromhex('1f8b08040000000000ff0600424302001b0003000000000000000000')
+
+# Indexes have the uncompressed start of each block, so that files whose
+# blocks are not all full (eg made by concatenate) can be indexed
+index_magic = b'FARMBLAST_BGZF_INDEX_2\n'
+index_header_format = '<QQQ'
+
+# Memory in MB that sort can use when making an index
+sort_memory = 200
+
+
+def _pad(n):
+    return (8 - n % 8) % 8
+
+
+def compress_block(data):
+    '''Returns data compressed as one BGZF block, which is a complete gzip
+       member with the size of the block in an extra field'''
+    compressor = zlib.compressobj(compress_level, zlib.DEFLATED, -15)
+    deflated = compressor.compress(data) + compressor.flush()
+    bsize = 18 + len(deflated) + 8
+    if bsize > 65536:
+        raise Error('Compressed block too big. Cannot continue')
+    header = struct.pack('<BBBBIBBHBBHH', 31, 139, 8, 4, 0, 0, 255, 6, 66, 67, 2, bsize - 1)
+    return header + deflated + struct.pack('<II', zlib.crc32(data), len(data))
+
+
+def index_filename(blast_file):
+    return blast_file + '.qindex'
+
+
+def _sort_entries(unsorted_file, sorted_file, tmp_dir):
+    '''Sorts lines of query name, start and length by name then start'''
+    env = dict(os.environ)
+    env['LC_ALL'] = 'C'
+    cmd = ['sort', '-t', '\t', '-k1,1', '-k2,2n', '-S', str(sort_memory) + 'M', '-T', tmp_dir, '-o', sorted_file, unsorted_file]
+    if subprocess.call(cmd, env=env) != 0:
+        raise Error('Error sorting index entries in file "' + unsorted_file + '"')
+
+
+def _write_index(index_file, block_offsets, block_starts, uncompressed_size, entries_file, tmp_dir):
+    '''Writes an index file: a header, the file offset and uncompressed
+       start of each block (each with an extra value at the end for the end
+       of the file), then lines of query name, start and length of each run
+       of lines of that query, sorted by query name. entries_file has the
+       lines in any order'''
+    sorted_file = os.path.join(tmp_dir, 'sorted')
+    _sort_entries(entries_file, sorted_file, tmp_dir)
+
+    with open(index_file, 'wb') as f_out:
+        f_out.write(index_magic)
+        f_out.write(b'\0' * _pad(len(index_magic)))
+        f_out.write(struct.pack(index_header_format, block_size, len(block_offsets) - 1, uncompressed_size))
+        block_offsets.tofile(f_out)
+        block_starts.tofile(f_out)
+        with open(sorted_file, 'rb') as f_in:
+            shutil.copyfileobj(f_in, f_out)
+
+
+class Writer:
+    def __init__(self, filename, index_file=None, eof=True):
+        '''Writes a block gzipped file, which can be read by zcat or anything
+           else that reads gzip. If index_file is given, also writes an index
+           of where the lines of each query are in the file. Text must be
+           written in whole lines of tabulated blast output. If eof is False,
+           the empty block that marks the end of the file is not written,
+           so the file can be put in front of another one by concatenate'''
+        self.filename = filename
+        self.index_file = index_file
+        self.eof = eof
+        self.f = open(filename, 'wb')
+        self.buffer = b''
+        self.block_offsets = array('Q')
+        self.block_starts = array('Q')
+        self.compressed_size = 0
+        self.uncompressed_size = 0
+
+        if self.index_file is not None:
+            self.tmp_dir = tempfile.mkdtemp(prefix='tmp.bgzf_index.', dir=os.path.dirname(os.path.abspath(index_file)))
+            self.entries_file = open(os.path.join(self.tmp_dir, 'unsorted'), 'wb')
+            self.query = None
+            self.query_start = 0
+
+
+    def _write_block(self, data):
+        block = compress_block(data)
+        self.block_offsets.append(self.compressed_size)
+        self.block_starts.append(len(self.block_starts) * block_size)
+        self.f.write(block)
+        self.compressed_size += len(block)
+
+
+    def _end_query(self, position):
+        if self.query is not None:
+            self.entries_file.write(b'%s\t%d\t%d\n' % (self.query, self.query_start, position - self.query_start))
+
+
+    def _index_lines(self, data):
+        position = self.uncompressed_size
+        query = self.query
+        for line in data.split(b'\n')[:-1]:
+            line_query = line[:line.find(b'\t')]
+            if line_query != query:
+                self._end_query(position)
+                self.query = query = line_query
+                self.query_start = position
+            position += len(line) + 1
+
+
+    def suspend(self):
+        '''Closes the open files, so that many writers can be used at once
+           without running out of file handles. They are opened again by
+           the next call to write or close'''
+        if not self.f.closed:
+            self.f.close()
+            if self.index_file is not None:
+                self.entries_file.close()
+
+
+    def _resume(self):
+        if self.f.closed:
+            self.f = open(self.filename, 'ab')
+            if self.index_file is not None:
+                self.entries_file = open(os.path.join(self.tmp_dir, 'unsorted'), 'ab')
+
+
+    def write(self, text):
+        self._resume()
+        data = text.encode()
+        if self.index_file is not None:
+            self._index_lines(data)
+        self.uncompressed_size += len(data)
+
+        data = self.buffer + data
+        start = 0
+        while len(data) - start >= block_size:
+            self._write_block(data[start:start + block_size])
+            start += block_size
+        self.buffer = data[start:]
+
+
+    def close(self):
+        self._resume()
+        if len(self.buffer):
+            self._write_block(self.buffer)
+            self.buffer = b''
+        self.block_offsets.append(self.compressed_size)
+        self.block_starts.append(self.uncompressed_size)
+        if self.eof:
+            self.f.write(eof_block)
+        self.f.close()
+
+        if self.index_file is not None:
+            self._end_query(self.uncompressed_size)
+            self.entries_file.close()
+            try:
+                _write_index(self.index_file, self.block_offsets, self.block_starts, self.uncompressed_size, os.path.join(self.tmp_dir, 'unsorted'), self.tmp_dir)
+            finally:
+                shutil.rmtree(self.tmp_dir)
+
+
+class Reader:
+    def __init__(self, filename, index_file=None):
+        '''Gets the lines of given queries from a file made by Writer, using
+           its index file. Default index file is index_filename(filename)'''
+        if index_file is None:
+            index_file = index_filename(filename)
+        if not os.path.exists(index_file):
+            raise Error('Index file "' + index_file + '" not found. Cannot look up hits in "' + filename + '"')
+
+        self.filename = filename
+        self.index_file = index_file
+        self.f = open(filename, 'rb')
+        with open(index_file, 'rb') as f:
+            self.index = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self.index[:len(index_magic)] != index_magic:
+            raise Error('File "' + index_file + '" is not a blast output index')
+
+        position = len(index_magic) + _pad(len(index_magic))
+        (self.block_size, blocks, self.uncompressed_size) = struct.unpack_from(index_header_format, self.index, position)
+        position += struct.calcsize(index_header_format)
+        self._view = memoryview(self.index)
+        self.block_offsets = self._view[position:position + 8 * (blocks + 1)].cast('Q')
+        position += 8 * (blocks + 1)
+        self.block_starts = self._view[position:position + 8 * (blocks + 1)].cast('Q')
+        position += 8 * (blocks + 1)
+        self.entries_start = position
+        self.entries_end = len(self.index)
+
+
+    def _entry_fields(self, line_start):
+        line_end = self.index.find(b'\n', line_start)
+        name, start, length = self.index[line_start:line_end].split(b'\t')
+        return name, int(start), int(length), line_end
+
+
+    def _entries(self, name):
+        '''Returns list of (start, length) of the runs of lines of query name'''
+        name = name.encode()
+        lo = self.entries_start
+        hi = self.entries_end
+
+        # binary search for the first line of the index with the name
+        while lo < hi:
+            mid = (lo + hi) // 2
+            line_start = max(self.entries_start, self.index.rfind(b'\n', self.entries_start, mid) + 1)
+            line_name, start, length, line_end = self._entry_fields(line_start)
+            if line_name < name:
+                lo = line_end + 1
+            else:
+                hi = line_start
+
+        entries = []
+        while lo < self.entries_end:
+            line_name, start, length, line_end = self._entry_fields(lo)
+            if line_name != name:
+                break
+            entries.append((start, length))
+            lo = line_end + 1
+
+        return entries
+
+
+    def read(self, start, length):
+        '''Returns the uncompressed bytes from start to start + length'''
+        if length == 0:
+            return b''
+        first_block = bisect.bisect_right(self.block_starts, start) - 1
+        last_block = bisect.bisect_right(self.block_starts, start + length - 1) - 1
+        self.f.seek(self.block_offsets[first_block])
+        compressed = self.f.read(self.block_offsets[last_block + 1] - self.block_offsets[first_block])
+        data = []
+        for i in range(first_block, last_block + 1):
+            block_start = self.block_offsets[i] - self.block_offsets[first_block]
+            block_end = self.block_offsets[i + 1] - self.block_offsets[first_block]
+            data.append(zlib.decompress(compressed[block_start:block_end], 31))
+        offset = start - self.block_starts[first_block]
+        return b''.join(data)[offset:offset + length]
+
+
+    def hits(self, name):
+        '''Returns list of lines (without newlines) of the given query name'''
+        lines = []
+        for start, length in self._entries(name):
+            lines.extend(self.read(start, length).decode().rstrip('\n').split('\n'))
+        return lines
+
+
+    def close(self):
+        self.f.close()
+        self.block_offsets.release()
+        if isinstance(self.block_starts, memoryview):
+            self.block_starts.release()
+        self._view.release()
+        self.index.close()
+
+
+def concatenate(infiles, outfile, index_file=None):
+    '''Writes the files in infiles, which must have been made by
+       Writer(..., eof=False), one after the other to outfile, followed
+       by the end of file block. They are copied without being
+       decompressed. If index_file is given, the indexes of the input files
+       (called index_filename(infile)) are combined into an index of
+       outfile'''
+    compressed_size = 0
+    if index_file is not None:
+        uncompressed_size = 0
+        block_offsets = array('Q')
+        block_starts = array('Q')
+        tmp_dir = tempfile.mkdtemp(prefix='tmp.bgzf_index.', dir=os.path.dirname(os.path.abspath(index_file)))
+        entries_file = os.path.join(tmp_dir, 'unsorted')
+        f_entries = open(entries_file, 'wb')
+
+    try:
+        with open(outfile, 'wb') as f_out:
+            for infile in infiles:
+                with open(infile, 'rb') as f_in:
+                    shutil.copyfileobj(f_in, f_out)
+
+                if index_file is not None:
+                    reader = Reader(infile)
+                    block_offsets.extend([x + compressed_size for x in reader.block_offsets.tolist()[:-1]])
+                    block_starts.extend([x + uncompressed_size for x in reader.block_starts.tolist()[:-1]])
+                    for line in reader.index[reader.entries_start:reader.entries_end].splitlines():
+                        name, start, length = line.split(b'\t')
+                        f_entries.write(b'%s\t%d\t%s\n' % (name, int(start) + uncompressed_size, length))
+                    uncompressed_size += reader.uncompressed_size
+                    reader.close()
+
+                compressed_size += os.path.getsize(infile)
+
+            f_out.write(eof_block)
+
+        if index_file is not None:
+            block_offsets.append(compressed_size)
+            block_starts.append(uncompressed_size)
+            f_entries.close()
+            _write_index(index_file, block_offsets, block_starts, uncompressed_size, entries_file, tmp_dir)
+    finally:
+        if index_file is not None:
+            f_entries.close()
+            shutil.rmtree(tmp_dir)
+
+
+def lookup_hits(blast_file, names, fout, index_file=None):
+    '''Writes the lines of blast_file of each query in names to fout, in the
+       same order as names. Returns the number of names that have no hits'''
+    reader = Reader(blast_file, index_file=index_file)
+    not_found = 0
+    for name in names:
+        lines = reader.hits(name)
+        if len(lines):
+            print(*lines, sep='\n', file=fout)
+        else:
+            not_found += 1
+    reader.close()
+    return not_found
@@ -30,7 +30,9 @@ class Blast:
          evalue=None,
          word_size=None,
          no_filter=False,
-         extra_options=''):
+         extra_options='',
+         db_size=None,
+         threads=1):
 
         self.reference = reference
         self.query = query
@@ -41,6 +43,8 @@ class Blast:
         self.word_size = word_size
         self.no_filter = no_filter
         self.extra_options = extra_options
+        self.db_size = db_size
+        self.threads = threads
 
         if self.blast_type in ref_not_protein_types:
             self.protein_reference = False
@@ -93,6 +97,10 @@ class Blast:
                 opts.extend(['-W', str(self.word_size)])
             if self.no_filter:
                 opts.extend(['-F', 'F'])
+            if self.db_size:
+                opts.extend(['-z', str(self.db_size)])
+            if self.threads > 1:
+                opts.extend(['-a', str(self.threads)])
         else:
             opts.extend(['-outfmt', '6'])
 
@@ -104,6 +112,10 @@ class Blast:
                 opts.extend(['-dust', 'no'])
             if self.protein_reference and not self.no_filter:
                 opts.extend(['-seg', 'yes'])
+            if self.db_size:
+                opts.extend(['-dbsize', str(self.db_size)])
+            if self.threads > 1:
+                opts.extend(['-num_threads', str(self.threads)])
 
         if self.extra_options:
             opts.append(self.extra_options)
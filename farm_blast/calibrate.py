@@ -0,0 +1,125 @@
+import sys
+import copy
+import time
+import random
+import subprocess
+from array import array
+from pyfastaq import sequences, utils
+
+class Error (Exception): pass
+
+
+# Number of query bases blasted in the main calibration run. A much smaller
+# run is also done to measure the time to start blast and load the database
+sample_bases = 50000
+overhead_sample_bases = 1000
+
+# split_bases chosen by calibration is kept within these limits
+min_split_bases = 1000
+max_split_bases = 100000000
+
+# Aim for a little less than the target walltime, because the estimate is
+# made from a small sample
+safety_factor = 0.8
+
+
+def sample_query(infile, outfile, bases, seed=None):
+    '''Writes a random sample of the sequences in infile to outfile, with
+       about the given number of bases in total. Sequences longer than
+       bases are replaced with a random subsequence of that length.
+       Returns a tuple (number of sequences, number of bases) written'''
+    lengths = array('L', [len(seq) for seq in sequences.file_reader(infile)])
+    if len(lengths) == 0:
+        raise Error('No sequences found in file "' + infile + '"')
+
+    rand = random.Random(seed)
+    order = list(range(len(lengths)))
+    rand.shuffle(order)
+    wanted = set()
+    total = 0
+    for i in order:
+        if total >= bases:
+            break
+        wanted.add(i)
+        total += min(lengths[i], bases)
+
+    f = utils.open_file_write(outfile)
+    seqs_written = 0
+    bases_written = 0
+    for i, seq in enumerate(sequences.file_reader(infile)):
+        if i not in wanted:
+            continue
+
+        if len(seq) > bases:
+            start = rand.randint(0, len(seq) - bases)
+            seq = sequences.Fasta(seq.id, seq[start:start + bases])
+
+        print(seq, file=f)
+        seqs_written += 1
+        bases_written += len(seq)
+
+    utils.close(f)
+    return seqs_written, bases_written
+
+
+def time_blast(blast_obj):
+    '''Runs blast, returning the wall clock time taken in seconds.
+       Anything blast writes to stdout goes to stderr instead, so that
+       only the chosen split_bases is written to stdout by farm_blast --calibrate'''
+    cmd = blast_obj.get_run_command()
+    start = time.time()
+    retcode = subprocess.call(cmd, shell=True, stdout=sys.stderr)
+    if retcode != 0:
+        raise Error('Error running calibration blast command:\n' + cmd)
+    return time.time() - start
+
+
+def split_bases_for_walltime(bases_per_second, overhead_seconds, target_walltime):
+    '''Returns the number of bases per chunk that should take target_walltime
+       minutes to blast'''
+    seconds = max(0, target_walltime * 60 * safety_factor - overhead_seconds)
+    return int(max(min_split_bases, min(max_split_bases, bases_per_second * seconds)))
+
+
+def calibrate_split_bases(blast_obj, query, target_walltime, outfile, seed=None):
+    '''Blasts a small random sample of the query, and returns the number
+       of bases per chunk that should take target_walltime minutes.
+       blast_obj should be set up with the options of the real run. Its
+       query and outfile are replaced with temporary files.
+       The measurements and the chosen value are written to outfile'''
+    blast_obj = copy.copy(blast_obj)
+    blast_obj.outfile = 'calibration.tmp.blast.out'
+    measurements = {}
+
+    for name, bases in [('overhead', overhead_sample_bases), ('sample', sample_bases)]:
+        blast_obj.query = 'calibration.tmp.' + name + '.fa'
+        seqs, bases = sample_query(query, blast_obj.query, bases, seed=seed)
+        measurements[name] = (seqs, bases, time_blast(blast_obj))
+
+    overhead_seconds = measurements['overhead'][2]
+    sample_seconds = measurements['sample'][2]
+    extra_bases = measurements['sample'][1] - measurements['overhead'][1]
+    extra_seconds = sample_seconds - overhead_seconds
+
+    # If the sample was not noticeably slower than the tiny run, then
+    # timing noise swamps the difference. Fall back to assuming all the
+    # time was spent blasting
+    if extra_bases > 0 and extra_seconds > 0.1 * sample_seconds:
+        bases_per_second = extra_bases / extra_seconds
+    else:
+        bases_per_second = measurements['sample'][1] / max(sample_seconds, 0.001)
+        overhead_seconds = 0
+
+    split_bases = split_bases_for_walltime(bases_per_second, overhead_seconds, target_walltime)
+
+    f = utils.open_file_write(outfile)
+    print('sample_sequences', measurements['sample'][0], sep='\t', file=f)
+    print('sample_bases', measurements['sample'][1], sep='\t', file=f)
+    print('sample_seconds', round(sample_seconds, 3), sep='\t', file=f)
+    print('overhead_sample_bases', measurements['overhead'][1], sep='\t', file=f)
+    print('overhead_seconds', round(overhead_seconds, 3), sep='\t', file=f)
+    print('bases_per_second', round(bases_per_second, 3), sep='\t', file=f)
+    print('target_walltime_minutes', target_walltime, sep='\t', file=f)
+    print('split_bases', split_bases, sep='\t', file=f)
+    utils.close(f)
+    return split_bases
@@ -0,0 +1,138 @@
+import os
+from array import array
+from pyfastaq import sequences, utils
+from farm_blast import memory
+
+class Error (Exception): pass
+
+
+# Relative cost of blasting one query base, compared with blastn. These are
+# rough figures, but they only need to get the relative cost of sequence
+# length and sequence count about right for each type of blast
+blast_type_base_cost = {
+    'blastn': 1,
+    'blastn-short': 1,
+    'dc-megablast': 2,
+    'megablast': 0.25,
+    'rmblastn': 1,
+    'tblastn': 6,
+    'tblastx': 36,
+    'blastp': 2,
+    'blastp-short': 2,
+    'deltablast': 4,
+    'blastx': 6,
+}
+
+# Fixed cost of each query sequence, whatever its length, in the same units
+# as the cost of one blastn base against a 1Mb reference
+sequence_overhead_cost = 1000
+
+
+class CostModel:
+    def __init__(self, blast_type, reference_size):
+        '''Estimates the cost of blasting a query sequence. reference_size
+           is the size in bytes of the reference file (see reference_size)'''
+        try:
+            type_cost = blast_type_base_cost[blast_type]
+        except KeyError:
+            raise Error('No chunking cost known for blast type: ' + blast_type)
+
+        self.base_cost = type_cost * max(1, reference_size / 1000000)
+        self.sequence_cost = sequence_overhead_cost
+
+
+    def cost(self, length):
+        return self.sequence_cost + self.base_cost * length
+
+
+def reference_size(blast_obj):
+    '''Returns the size in bytes of the reference file of blast_obj. If
+       there is no such file, because the reference is already a formatted
+       database, then the size is estimated from the database'''
+    if os.path.isfile(blast_obj.reference):
+        return os.path.getsize(blast_obj.reference)
+    elif blast_obj.blast_db_exists():
+        size = memory.database_size(blast_obj)
+        # nucleotide databases store 4 bases per byte
+        return size if blast_obj.protein_reference else 4 * size
+    else:
+        raise Error('Reference file or BLAST database not found: "' + blast_obj.reference + '"')
+
+
+def sequence_pieces(seq, chunk_size, tolerance, skip_all_Ns):
+    '''Iterates over the pieces of the sequence seq, yielding tuples
+       (sequence, offset). Sequences longer than (chunk_size + tolerance)
+       are split into pieces in the same way as fastaq chunker. offset is
+       None if the sequence was not split'''
+    if skip_all_Ns and seq.is_all_Ns():
+        return
+
+    if len(seq) <= chunk_size + tolerance:
+        yield seq, None
+        return
+
+    chunks = [(x, min(x + chunk_size, len(seq))) for x in range(0, len(seq), chunk_size)]
+    if len(chunks) > 1 and chunks[-1][1] - chunks[-1][0] <= tolerance:
+        chunks[-2] = (chunks[-2][0], chunks[-1][1])
+        chunks.pop()
+
+    for start, end in chunks:
+        if not (skip_all_Ns and seq.is_all_Ns(start=start, end=end - 1)):
+            chunk_id = seq.id + ':' + str(start + 1) + '-' + str(end)
+            yield sequences.Fasta(chunk_id, seq[start:end]), (seq.id, start)
+
+
+def _query_pieces(infile, chunk_size, tolerance, skip_all_Ns):
+    '''Iterates over the pieces of all the sequences in infile (see sequence_pieces)'''
+    for seq in sequences.file_reader(infile):
+        yield from sequence_pieces(seq, chunk_size, tolerance, skip_all_Ns)
+
+
+def chunk_query(infile, outfiles_prefix, chunk_size, tolerance, blast_type, reference_size, skip_all_Ns=True):
+    '''Splits infile into files outfiles_prefix.1, outfiles_prefix.2, ...
+       so that each file has about the same estimated blast cost, using a
+       CostModel made from blast_type and reference_size.
+       Sequences are split in the same way as fastaq chunker, writing the
+       offsets in outfiles_prefix.coords. The number of files is about the
+       same as if each file had chunk_size bases. Returns the number of files'''
+    model = CostModel(blast_type, reference_size)
+
+    # first pass: get the cost of every sequence, so we know how many
+    # files to make and how to divide the total cost between them
+    costs = array('d')
+    for seq, offset in _query_pieces(infile, chunk_size, tolerance, skip_all_Ns):
+        costs.append(model.cost(len(seq)))
+
+    if len(costs) == 0:
+        raise Error('No sequences to blast found in file "' + infile + '"')
+
+    total_cost = sum(costs)
+    files_needed = max(1, round(total_cost / model.cost(chunk_size)))
+    cost_per_file = total_cost / files_needed
+
+    # second pass: write the files. Each sequence goes in the file that
+    # contains the midpoint of its cost, when all the costs are laid end to end
+    f_coords = utils.open_file_write(outfiles_prefix + '.coords')
+    f_out = None
+    file_count = 0
+    current_bin = None
+    cumulative_cost = 0
+
+    for i, (seq, offset) in enumerate(_query_pieces(infile, chunk_size, tolerance, skip_all_Ns)):
+        seq_bin = min(files_needed - 1, int((cumulative_cost + costs[i] / 2) / cost_per_file))
+        cumulative_cost += costs[i]
+
+        if seq_bin != current_bin:
+            if f_out is not None:
+                utils.close(f_out)
+            file_count += 1
+            f_out = utils.open_file_write(outfiles_prefix + '.' + str(file_count))
+            current_bin = seq_bin
+
+        print(seq, file=f_out)
+        if offset is not None:
+            print(seq.id, offset[0], offset[1], sep='\t', file=f_coords)
+
+    utils.close(f_out)
+    utils.close(f_coords)
+    return file_count
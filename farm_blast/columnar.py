@@ -0,0 +1,251 @@
+import os
+import mmap
+import struct
+import shutil
+from array import array
+
+class Error (Exception): pass
+
+
+magic = b'FARMBLAST_COLUMNS_1\n'
+header_format = '<QQQQQ'
+
+# The columns of tabulated blast output and the type each one is stored
+# as. qseqid and sseqid are stored as numbers that index the query and
+# subject names
+columns = [
+    ('qseqid', 'I'),
+    ('sseqid', 'I'),
+    ('pident', 'd'),
+    ('length', 'Q'),
+    ('mismatch', 'Q'),
+    ('gapopen', 'Q'),
+    ('qstart', 'Q'),
+    ('qend', 'Q'),
+    ('sstart', 'Q'),
+    ('send', 'Q'),
+    ('evalue', 'd'),
+    ('bitscore', 'd'),
+]
+
+column_names = [x[0] for x in columns]
+column_types = dict(columns)
+
+# Number of rows held in memory before they are written to disk
+write_rows = 100000
+
+
+def _pad(n):
+    return (8 - n % 8) % 8
+
+
+class ColumnarWriter:
+    def __init__(self, outfile):
+        '''Stage that writes the lines of blast output that pass through it
+           to outfile in columnar format, which can be read with ColumnarFile.
+           The lines are not changed. outfile is written when finish()
+           is called. For use with utils.fix_blast_coords'''
+        self.outfile = outfile
+        self.tmp_prefix = outfile + '.tmp'
+        self.rows = 0
+        self.values = {x: array(t) for x, t in columns}
+        self.names = {}
+        self.files = {x: open(self.tmp_prefix + '.' + x, 'wb') for x in column_names}
+
+        for name in ['qseqid', 'sseqid']:
+            self.names[name] = {}
+            self.files[name + '.names'] = open(self.tmp_prefix + '.' + name + '.names', 'wb')
+            self.values[name + '.name_starts'] = array('Q', [0])
+            self.values[name + '.names_size'] = 0
+
+
+    def _name_id(self, column, name):
+        ids = self.names[column]
+        i = ids.get(name)
+        if i is None:
+            i = len(ids)
+            ids[name] = i
+            name_bytes = name.encode()
+            self.files[column + '.names'].write(name_bytes)
+            self.values[column + '.names_size'] += len(name_bytes)
+            self.values[column + '.name_starts'].append(self.values[column + '.names_size'])
+        return i
+
+
+    def _flush(self):
+        for name in column_names:
+            self.values[name].tofile(self.files[name])
+            self.values[name] = array(column_types[name])
+
+
+    def process(self, lines):
+        qseqid = self.values['qseqid']
+        sseqid = self.values['sseqid']
+        numbers = [(self.values[name], i + 2, int if column_types[name] == 'Q' else float) for i, name in enumerate(column_names[2:])]
+
+        for line in lines:
+            fields = line.split('\t')
+            if len(fields) != len(columns):
+                raise Error('Expected ' + str(len(columns)) + ' columns in blast output. Cannot write columnar output from this line:\n' + line)
+            qseqid.append(self._name_id('qseqid', fields[0]))
+            sseqid.append(self._name_id('sseqid', fields[1]))
+            try:
+                for values, i, convert in numbers:
+                    values.append(convert(fields[i]))
+            except ValueError:
+                raise Error('Error converting blast output to columnar format at this line:\n' + line)
+
+        self.rows += len(lines)
+        if len(qseqid) >= write_rows:
+            self._flush()
+        return lines
+
+
+    def finish(self):
+        self._flush()
+        for f in self.files.values():
+            f.close()
+
+        with open(self.outfile, 'wb') as f_out:
+            f_out.write(magic)
+            f_out.write(b'\0' * _pad(len(magic)))
+            f_out.write(struct.pack(header_format,
+                self.rows,
+                len(self.names['qseqid']),
+                self.values['qseqid.names_size'],
+                len(self.names['sseqid']),
+                self.values['sseqid.names_size'],
+            ))
+
+            # each section starts on a multiple of 8 bytes
+            for name in column_names:
+                filename = self.tmp_prefix + '.' + name
+                with open(filename, 'rb') as f_in:
+                    shutil.copyfileobj(f_in, f_out)
+                f_out.write(b'\0' * _pad(os.path.getsize(filename)))
+                os.unlink(filename)
+
+            for name in ['qseqid', 'sseqid']:
+                self.values[name + '.name_starts'].tofile(f_out)
+                filename = self.tmp_prefix + '.' + name + '.names'
+                with open(filename, 'rb') as f_in:
+                    shutil.copyfileobj(f_in, f_out)
+                f_out.write(b'\0' * _pad(self.values[name + '.names_size']))
+                os.unlink(filename)
+
+        return []
+
+
+class ColumnarFile:
+    def __init__(self, filename, use_mmap=True):
+        '''Reads a file made by ColumnarWriter. If use_mmap is True, the file
+           is memory mapped instead of read into memory, so only the columns
+           that are used need to be resident'''
+        self.filename = filename
+        with open(filename, 'rb') as f:
+            if use_mmap and os.path.getsize(filename) > 0:
+                self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                self.data = f.read()
+
+        if self.data[:len(magic)] != magic:
+            raise Error('File "' + filename + '" is not a columnar blast output file')
+
+        view = memoryview(self.data)
+        self._view = view
+        position = len(magic) + _pad(len(magic))
+        (self.rows, query_count, query_names_size, subject_count, subject_names_size) = struct.unpack_from(header_format, self.data, position)
+        position += struct.calcsize(header_format)
+
+        def section(length, typecode):
+            nonlocal position
+            size = length * struct.calcsize(typecode)
+            values = view[position:position + size].cast(typecode)
+            position += size + _pad(size)
+            return values
+
+        self._columns = {name: section(self.rows, column_types[name]) for name in column_names}
+        self._name_starts = {}
+        self._names = {}
+        for name, count, size in [('qseqid', query_count, query_names_size), ('sseqid', subject_count, subject_names_size)]:
+            self._name_starts[name] = section(count + 1, 'Q')
+            self._names[name] = section(size, 'B')
+
+
+    def __len__(self):
+        return self.rows
+
+
+    def column(self, name):
+        '''Returns the values of one column, without copying them from the
+           file. For qseqid and sseqid, the values are numbers: use
+           query_name() and subject_name() to get the names'''
+        try:
+            return self._columns[name]
+        except KeyError:
+            raise Error('Unknown column "' + str(name) + '". Must be one of: ' + ' '.join(column_names))
+
+
+    def _name(self, column, i):
+        starts = self._name_starts[column]
+        return bytes(self._names[column][starts[i]:starts[i + 1]]).decode()
+
+
+    def query_name(self, i):
+        '''Returns the name of the query with number i'''
+        return self._name('qseqid', i)
+
+
+    def subject_name(self, i):
+        '''Returns the name of the subject with number i'''
+        return self._name('sseqid', i)
+
+
+    def query_names(self):
+        '''Returns list of all query names, in order of their numbers'''
+        return [self.query_name(i) for i in range(len(self._name_starts['qseqid']) - 1)]
+
+
+    def subject_names(self):
+        '''Returns list of all subject names, in order of their numbers'''
+        return [self.subject_name(i) for i in range(len(self._name_starts['sseqid']) - 1)]
+
+
+    def rows_iter(self, names=None):
+        '''Iterates over the rows, giving a tuple of values of the columns
+           in names (default is all columns) for each row. Query and subject
+           names are returned as strings'''
+        if names is None:
+            names = column_names
+        getters = []
+        for name in names:
+            if name == 'qseqid':
+                getters.append((self.column(name), self.query_name))
+            elif name == 'sseqid':
+                getters.append((self.column(name), self.subject_name))
+            else:
+                getters.append((self.column(name), None))
+
+        for i in range(self.rows):
+            yield tuple([values[i] if convert is None else convert(values[i]) for values, convert in getters])
+
+
+    def close(self):
+        '''Releases the memory map. The file cannot be used after this'''
+        for values in list(self._columns.values()) + list(self._name_starts.values()) + list(self._names.values()):
+            values.release()
+        self._view.release()
+        if type(self.data) == mmap.mmap:
+            self.data.close()
+
+
+def load_columns(filename, names, use_mmap=True):
+    '''Returns dict of column name -> array of values, copied from a file
+       made by ColumnarWriter, for each column in names'''
+    f = ColumnarFile(filename, use_mmap=use_mmap)
+    loaded = {}
+    for name in names:
+        loaded[name] = array(column_types[name])
+        loaded[name].frombytes(f.column(name).cast('B'))
+    f.close()
+    return loaded
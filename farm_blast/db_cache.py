@@ -0,0 +1,244 @@
+import os
+import time
+import fcntl
+import shutil
+import hashlib
+import subprocess
+from pyfastaq import tasks
+
+class Error (Exception): pass
+
+
+# A run that has not released a database after this many seconds is assumed
+# to have died, so it no longer stops the database being evicted
+max_user_age = 30 * 24 * 60 * 60
+
+
+class Lock:
+    '''Exclusive lock on a file, using POSIX locks so that it works on
+       NFS. Use as a context manager. If blocking is False, then
+       self.locked is set to False instead of waiting for the lock'''
+    def __init__(self, filename, blocking=True):
+        self.filename = filename
+        self.blocking = blocking
+        self.locked = False
+        self.f = None
+
+    def __enter__(self):
+        self.f = open(self.filename, 'a')
+        flags = fcntl.LOCK_EX if self.blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+        try:
+            fcntl.lockf(self.f, flags)
+            self.locked = True
+        except OSError:
+            if self.blocking:
+                raise
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.locked:
+            fcntl.lockf(self.f, fcntl.LOCK_UN)
+            self.locked = False
+        self.f.close()
+        self.f = None
+
+
+def file_hash(filename, block_size=1048576):
+    '''Returns the sha256 hex digest of the contents of a file'''
+    h = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            h.update(block)
+    return h.hexdigest()
+
+
+def dir_size(dirname):
+    '''Returns total size in bytes of the files in a directory'''
+    total = 0
+    for root, dirs, files in os.walk(dirname):
+        total += sum([os.path.getsize(os.path.join(root, x)) for x in files])
+    return total
+
+
+class DbCache:
+    def __init__(self, cache_dir, max_size=None):
+        '''Cache of formatted blast databases, shared between runs. Each
+           database is in its own directory, named by the hash of the
+           reference file, the blast tool and molecule type. max_size is
+           the maximum total size of the cache in GB. When it is exceeded,
+           the least recently used databases that are not being used by
+           a run are deleted'''
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_size = max_size
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+        except:
+            raise Error('Error making database cache directory "' + self.cache_dir + '"')
+
+        self.lock_file = os.path.join(self.cache_dir, 'cache.lock')
+
+
+    def key(self, reference, blast_obj, union_for_act=False):
+        '''Returns key of the database for the given reference file and
+           blast.Blast object'''
+        fields = [
+            file_hash(reference),
+            'blastall' if blast_obj.blastall else 'blast_plus',
+            'prot' if blast_obj.protein_reference else 'nucl'
+        ]
+        if union_for_act:
+            fields.append('act')
+        return '.'.join(fields)
+
+
+    def _entry_dir(self, key):
+        return os.path.join(self.cache_dir, key)
+
+
+    def _key_lock_file(self, key):
+        return os.path.join(self.cache_dir, key + '.lock')
+
+
+    def _users_dir(self, key):
+        return os.path.join(self.cache_dir, key + '.users')
+
+
+    def _user_file(self, key, user):
+        return os.path.join(self._users_dir(key), hashlib.sha256(user.encode()).hexdigest())
+
+
+    def _build(self, key, reference, blast_obj, union_for_act):
+        '''Makes the database in a temporary directory, then renames it, so
+           that an entry directory only exists if it is complete'''
+        tmp_dir = self._entry_dir(key) + '.tmp.' + str(os.getpid())
+        os.mkdir(tmp_dir)
+        fasta = os.path.join(tmp_dir, 'reference.fa')
+
+        if union_for_act:
+            merged = os.path.join(tmp_dir, 'merged.fa')
+            tasks.merge_to_one_seq(reference, merged)
+            tasks.to_fasta(merged, fasta, strip_after_first_whitespace=True)
+            os.unlink(merged)
+        else:
+            tasks.to_fasta(reference, fasta, strip_after_first_whitespace=True)
+
+        original_reference = blast_obj.reference
+        blast_obj.reference = 'reference.fa'
+        cmd = blast_obj.format_database_command()
+        blast_obj.reference = original_reference
+        retcode = subprocess.call('cd ' + tmp_dir + ' && ' + cmd, shell=True)
+        if retcode != 0:
+            shutil.rmtree(tmp_dir)
+            raise Error('Error making blast database. Command was:\n' + cmd)
+
+        # blast only needs the database files, not the fasta file or logs
+        for filename in os.listdir(tmp_dir):
+            if not filename.startswith('reference.fa.'):
+                os.unlink(os.path.join(tmp_dir, filename))
+
+        os.rename(tmp_dir, self._entry_dir(key))
+
+
+    def acquire(self, reference, blast_obj, user, outprefix, union_for_act=False):
+        '''Gets the database for the reference, building it if it is not
+           already in the cache. Makes symlinks called outprefix.* to the
+           database files, so outprefix can be used as the blast database.
+           user should be unique to the run (eg its output directory).
+           The database cannot be evicted until release() is called with the
+           same user. Returns the key of the database'''
+        key = self.key(reference, blast_obj, union_for_act=union_for_act)
+        entry_dir = self._entry_dir(key)
+
+        # Each database has its own lock, so that building one database
+        # does not hold up runs that use other databases. Eviction does not
+        # wait for this lock, it skips databases that are locked
+        with Lock(self._key_lock_file(key)):
+            if not os.path.exists(entry_dir):
+                self._build(key, reference, blast_obj, union_for_act)
+
+            with Lock(self.lock_file):
+                os.makedirs(self._users_dir(key), exist_ok=True)
+                with open(self._user_file(key, user), 'w') as f:
+                    print(user, file=f)
+
+                # the modification time of the entry directory is used to
+                # find the least recently used databases
+                os.utime(entry_dir)
+
+        for filename in os.listdir(entry_dir):
+            link = outprefix + filename[len('reference.fa'):]
+            if os.path.lexists(link):
+                os.unlink(link)
+            os.symlink(os.path.join(entry_dir, filename), link)
+
+        self.evict()
+        return key
+
+
+    def release(self, key, user):
+        '''Marks the database as no longer used by user'''
+        with Lock(self.lock_file):
+            try:
+                os.unlink(self._user_file(key, user))
+            except FileNotFoundError:
+                pass
+
+
+    def _in_use(self, key, now):
+        users_dir = self._users_dir(key)
+        if not os.path.exists(users_dir):
+            return False
+
+        for filename in os.listdir(users_dir):
+            if now - os.path.getmtime(os.path.join(users_dir, filename)) < max_user_age:
+                return True
+
+        return False
+
+
+    def entries(self):
+        '''Returns list of keys of complete databases in the cache, least recently used first'''
+        keys = []
+        for filename in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, filename)
+            if os.path.isdir(path) and '.tmp.' not in filename and not filename.endswith('.users'):
+                keys.append((os.path.getmtime(path), filename))
+        return [x[1] for x in sorted(keys)]
+
+
+    def evict(self):
+        '''Deletes least recently used databases that are not in use, until
+           the cache is no bigger than max_size. Returns list of deleted keys'''
+        if self.max_size is None:
+            return []
+
+        deleted = []
+
+        with Lock(self.lock_file):
+            now = time.time()
+            keys = self.entries()
+            sizes = {key: dir_size(self._entry_dir(key)) for key in keys}
+            total = sum(sizes.values())
+
+            for key in keys:
+                if total <= self.max_size * 1000000000:
+                    break
+
+                if self._in_use(key, now):
+                    continue
+
+                with Lock(self._key_lock_file(key), blocking=False) as key_lock:
+                    if not key_lock.locked:
+                        continue
+
+                    shutil.rmtree(self._entry_dir(key))
+                    if os.path.exists(self._users_dir(key)):
+                        shutil.rmtree(self._users_dir(key))
+
+                total -= sizes[key]
+                deleted.append(key)
+
+        return deleted
@@ -0,0 +1,137 @@
+import heapq
+import hashlib
+from pyfastaq import sequences, utils
+
+class Error (Exception): pass
+
+
+def dedup_query(infile, outfile, duplicates_file):
+    '''Writes the sequences in infile to outfile, but only the first copy
+       of each sequence. Sequences are compared case sensitively. For each
+       sequence that is not written, a line
+       "name<TAB>representative name<TAB>position" is written to
+       duplicates_file, where position is the number of sequences written
+       to outfile before it. Returns a tuple
+       (number of sequences written, number of duplicates)'''
+    representatives = {}
+    duplicates = 0
+    f_out = utils.open_file_write(outfile)
+    f_dups = utils.open_file_write(duplicates_file)
+
+    for seq in sequences.file_reader(infile):
+        # store digests instead of the sequences, to save memory
+        digest = hashlib.sha1(seq.seq.encode()).digest()
+        if digest in representatives:
+            print(seq.id, representatives[digest], len(representatives), sep='\t', file=f_dups)
+            duplicates += 1
+        else:
+            representatives[digest] = seq.id
+            print(seq, file=f_out)
+
+    utils.close(f_out)
+    utils.close(f_dups)
+    return len(representatives), duplicates
+
+
+def _read_duplicates(duplicates_file):
+    f = utils.open_file_read(duplicates_file)
+    for line in f:
+        yield line.rstrip('\n').split('\t')
+    utils.close(f)
+
+
+def load_duplicates(duplicates_file):
+    '''Loads file made by dedup_query into a dict of
+       representative name -> list of names of its duplicates'''
+    duplicates = {}
+    for name, representative, position in _read_duplicates(duplicates_file):
+        duplicates.setdefault(representative, []).append(name)
+    return duplicates
+
+
+def _query_names(query_file):
+    f = utils.open_file_read(query_file)
+    for line in f:
+        if line.startswith('>'):
+            yield line[1:].split()[0]
+    utils.close(f)
+
+
+class DuplicateExpander:
+    def __init__(self, duplicates_file, query_file=None):
+        '''Stage for utils.fix_blast_coords that copies the hits of each
+           representative query sequence to all of its duplicates.
+           query_file is the file of representatives made by dedup_query.
+           If it is given, the hits are in the same order as a run without
+           deduplication: the hits of each duplicate are held back until
+           the hits of the query sequences before it in the original query
+           file have been written. Otherwise, the hits of the duplicates
+           are written straight after the hits of their representative,
+           which is quicker when the output is sorted afterwards anyway'''
+        self.duplicates = {}
+        for i, (name, representative, position) in enumerate(_read_duplicates(duplicates_file)):
+            self.duplicates.setdefault(representative, []).append((int(position), i, name))
+        self.names = None if query_file is None else _query_names(query_file)
+        self.rank = -1
+        self.waiting = []
+        self.name = None
+        self.group = []
+
+
+    def _flush(self):
+        lines = list(self.group)
+        if len(lines):
+            start = len(self.name)
+            for position, i, name in self.duplicates[self.name]:
+                copies = [name + line[start:] for line in self.group]
+                if self.names is None:
+                    lines.extend(copies)
+                else:
+                    heapq.heappush(self.waiting, (position, i, copies))
+        self.group = []
+        return lines
+
+
+    def _release(self, rank):
+        lines = []
+        while len(self.waiting) and self.waiting[0][0] <= rank:
+            lines.extend(heapq.heappop(self.waiting)[2])
+        return lines
+
+
+    def _move_to(self, name):
+        '''Moves through query_file to name, and returns the hits of the
+           duplicates that come before it'''
+        for query_name in self.names:
+            self.rank += 1
+            if query_name == name:
+                return self._release(self.rank)
+
+        # name is not in the rest of query_file
+        self.rank = float('inf')
+        return self._release(self.rank)
+
+
+    def process(self, lines):
+        out = []
+        for line in lines:
+            name = line.split('\t', 1)[0]
+            if name != self.name:
+                out.extend(self._flush())
+                self.name = name
+                if self.names is not None:
+                    out.extend(self._move_to(name))
+
+            if name in self.duplicates:
+                self.group.append(line)
+            else:
+                out.append(line)
+
+        return out
+
+
+    def finish(self):
+        out = self._flush()
+        self.name = None
+        out.extend(self._release(float('inf')))
+        return out
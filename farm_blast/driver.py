@@ -0,0 +1,192 @@
+import sys
+import asyncio
+import collections
+from farm_blast import utils
+
+class Error (Exception): pass
+
+
+poll_seconds = 30
+
+# LSF job states that mean the job will not run any more
+finished_states = {'DONE', 'EXIT'}
+
+
+def job_id_from_bsub_output(bsub_output):
+    '''Returns the job id from the output of bsub, which should start with
+       a line like "Job <42> is submitted to queue <normal>."'''
+    first_line = bsub_output.split('\n')[0]
+    if 'is submitted to' not in first_line:
+        raise Error('Error getting job ID from bsub output. I got this:\n' + bsub_output)
+    return first_line.split()[1][1:-1]
+
+
+class LsfScheduler:
+    '''Submits and polls LSF jobs without blocking, by running bsub
+       and bjobs (whichever are first in the PATH) as subprocesses'''
+    async def _run(self, cmd):
+        proc = await asyncio.create_subprocess_shell(cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL)
+        stdout, stderr = await proc.communicate()
+        return proc.returncode, stdout.decode()
+
+
+    async def submit(self, job):
+        '''Submits the farmpy lsf.Job job. Sets and returns its job id'''
+        cmd = str(job)
+        returncode, stdout = await self._run(cmd)
+        if returncode != 0:
+            raise Error('Error in bsub call. I tried to run:\n' + cmd)
+        job.job_id = job_id_from_bsub_output(stdout)
+        return job.job_id
+
+
+    async def states(self, job_id):
+        '''Returns list of the states of the job (one per array element for
+           an array). Returns an empty list if bjobs does not know the job,
+           which can happen just after it is submitted'''
+        returncode, stdout = await self._run('bjobs -a -noheader -o stat ' + str(job_id))
+        if returncode != 0:
+            return []
+        return [x.strip() for x in stdout.split('\n') if x.strip() != '']
+
+
+class Driver:
+    def __init__(self, setup_job, array_job, combine_job, watch_job=None, max_elements=None, follow_job=None, scheduler=None, poll_seconds=poll_seconds, query_prefix='query.split', out=sys.stdout):
+        '''Runs the pipeline jobs from this process, instead of submitting
+           a job that submits the array and changes the dependencies of
+           the combine job. The array is submitted as soon as the setup job
+           has finished, when the number of chunks is known, and the
+           combine job as soon as the array (or the straggler watcher, if
+           watch_job is given) has finished. Progress of the array is written
+           to out. If max_elements is given, the array has at most that
+           many elements, however many chunks there are (for a work queue).
+           If follow_job is given, it is submitted with the array, and the
+           combine job waits for it as well.
+           Must be run from inside the output directory'''
+        self.setup_job = setup_job
+        self.array_job = array_job
+        self.combine_job = combine_job
+        self.watch_job = watch_job
+        self.max_elements = max_elements
+        self.follow_job = follow_job
+        self.scheduler = LsfScheduler() if scheduler is None else scheduler
+        self.poll_seconds = poll_seconds
+        self.query_prefix = query_prefix
+        self.out = out
+
+
+    def _log(self, *args):
+        print(*args, file=self.out, flush=True)
+
+
+    async def wait(self, job_id, progress=None):
+        '''Polls the job until all of its elements have finished. Returns
+           True if they all finished successfully. progress is called with
+           a Counter of the states each time they change'''
+        last_counts = None
+        while True:
+            states = await self.scheduler.states(job_id)
+            counts = collections.Counter(states)
+            if progress is not None and counts != last_counts:
+                progress(counts)
+            last_counts = counts
+            if len(states) and all([x in finished_states for x in states]):
+                return counts['EXIT'] == 0
+            await asyncio.sleep(self.poll_seconds)
+
+
+    def _array_progress(self, counts):
+        self._log('Array elements:',
+                  counts['PEND'], 'pending,',
+                  counts['RUN'], 'running,',
+                  counts['DONE'], 'done,',
+                  counts['EXIT'], 'failed')
+
+
+    async def _run_setup(self):
+        job_id = await self.scheduler.submit(self.setup_job)
+        self._log('Submitted setup job', job_id)
+        if not await self.wait(job_id):
+            raise Error('Setup job ' + str(job_id) + ' failed. See ' + self.setup_job.stderr_file)
+        self._log('Setup job finished')
+
+
+    async def _run_array(self, indices):
+        if indices is None:
+            self.array_job.array_end = len(utils.array_output_files(self.query_prefix))
+            if self.max_elements is not None:
+                self.array_job.array_end = min(self.array_job.array_end, self.max_elements)
+            elements = self.array_job.array_end
+        else:
+            self.array_job.array_indices = indices
+            elements = len(indices)
+
+        if elements == 0:
+            self._log('No array elements to run')
+            return
+
+        array_id = await self.scheduler.submit(self.array_job)
+        with open('02.array.id', 'w') as f:
+            print(array_id, file=f)
+        self._log('Submitted array job', array_id, 'with', elements, 'elements')
+
+        if self.watch_job is None:
+            if not await self.wait(array_id, progress=self._array_progress):
+                raise Error('Array job ' + str(array_id) + ' had failed elements. See tmp.array.e.* and rerun with --resume')
+            return
+
+        # The watcher kills elements whose speculative runs finish first, so
+        # those elements end in state EXIT. The watcher itself only finishes
+        # when every element has output
+        watch_id = await self.scheduler.submit(self.watch_job)
+        with open('02.watch.id', 'w') as f:
+            print(watch_id, file=f)
+        self._log('Submitted straggler watcher job', watch_id)
+        array_task = asyncio.ensure_future(self.wait(array_id, progress=self._array_progress))
+        try:
+            watch_ok = await self.wait(watch_id)
+        finally:
+            array_task.cancel()
+        if not watch_ok:
+            raise Error('Straggler watcher job ' + str(watch_id) + ' failed. See ' + self.watch_job.stderr_file + ' and rerun with --resume')
+
+
+    async def _run_follow(self):
+        job_id = await self.scheduler.submit(self.follow_job)
+        with open('02.follow.id', 'w') as f:
+            print(job_id, file=f)
+        self._log('Submitted job to publish partial results', job_id)
+        if not await self.wait(job_id):
+            raise Error('Job ' + str(job_id) + ' that publishes partial results failed. See ' + self.follow_job.stderr_file)
+
+
+    async def _run_combine(self):
+        job_id = await self.scheduler.submit(self.combine_job)
+        self._log('Submitted combine job', job_id)
+        if not await self.wait(job_id):
+            raise Error('Combine job ' + str(job_id) + ' failed. See ' + self.combine_job.stderr_file)
+        self._log('Combine job finished')
+
+
+    async def run_async(self, run_setup=True, indices=None):
+        '''Runs the jobs. If run_setup is False, the setup job is assumed to
+           have finished already. indices = list of array elements to run
+           (default is all of them)'''
+        if run_setup:
+            await self._run_setup()
+        follow_task = None
+        if self.follow_job is not None:
+            follow_task = asyncio.ensure_future(self._run_follow())
+        try:
+            await self._run_array(indices)
+            if follow_task is not None:
+                await follow_task
+        finally:
+            if follow_task is not None:
+                follow_task.cancel()
+        await self._run_combine()
+
+
+    def run(self, run_setup=True, indices=None):
+        '''Runs the jobs and waits for them to finish. See run_async'''
+        asyncio.run(self.run_async(run_setup=run_setup, indices=indices))
@@ -0,0 +1,141 @@
+from pyfastaq import utils as fastaq_utils
+from farm_blast import utils
+
+class Error (Exception): pass
+
+
+# Columns of tabulated blast output
+pident_column = 2
+length_column = 3
+bitscore_column = 11
+
+
+class ThresholdFilter:
+    def __init__(self, min_bitscore=None, min_pident=None, min_length=None):
+        '''Stage that removes lines with bit score, percent identity or
+           alignment length below the given minimums. For use with
+           utils.fix_blast_coords'''
+        self.min_bitscore = min_bitscore
+        self.min_pident = min_pident
+        self.min_length = min_length
+
+
+    def _keep(self, line):
+        fields = line.split('\t')
+        return (self.min_bitscore is None or float(fields[bitscore_column]) >= self.min_bitscore) \
+               and (self.min_pident is None or float(fields[pident_column]) >= self.min_pident) \
+               and (self.min_length is None or int(fields[length_column]) >= self.min_length)
+
+
+    def process(self, lines):
+        return [x for x in lines if self._keep(x)]
+
+
+    def finish(self):
+        return []
+
+
+class TopHitsFilter:
+    def __init__(self, top_hits=None, top_hsps=None):
+        '''Stage that keeps only the top_hits subject sequences with the
+           highest bit scores for each query, and the top_hsps HSPs with
+           the highest bit scores for each query and subject pair. The
+           lines that are kept stay in the same order. Relies on all the
+           lines of each query being together, as blast writes them'''
+        self.top_hits = top_hits
+        self.top_hsps = top_hsps
+        self.query = None
+        self.group = []
+
+
+    def _select(self):
+        '''Returns the lines to keep from the lines of the current query'''
+        fields = [x.split('\t') for x in self.group]
+        subjects = {}
+        for i, line_fields in enumerate(fields):
+            subjects.setdefault(line_fields[1], []).append((-float(line_fields[bitscore_column]), i))
+
+        if self.top_hsps is not None:
+            for subject in subjects:
+                subjects[subject] = sorted(subjects[subject])[:self.top_hsps]
+
+        if self.top_hits is not None:
+            best = sorted([min(hsps) for hsps in subjects.values()])[:self.top_hits]
+            wanted = set([fields[i][1] for score, i in best])
+            subjects = {x: subjects[x] for x in wanted}
+
+        keep = sorted([i for hsps in subjects.values() for score, i in hsps])
+        lines = [self.group[i] for i in keep]
+        self.group = []
+        return lines
+
+
+    def process(self, lines):
+        kept = []
+        for line in lines:
+            query = line.split('\t', 1)[0]
+            if query != self.query:
+                if len(self.group):
+                    kept.extend(self._select())
+                self.query = query
+            self.group.append(line)
+        return kept
+
+
+    def finish(self):
+        self.query = None
+        return self._select() if len(self.group) else []
+
+
+def make_stages(top_hits=None, top_hsps=None, min_bitscore=None, min_pident=None, min_length=None, in_task=False):
+    '''Returns list of stages that filter blast output, which is empty if
+       no filtering is wanted. If in_task is True, then only returns the
+       filters that give the same final result when run on the output of
+       each array element before the output is combined: top_hits is
+       left out, because a query sequence can be split between elements'''
+    for name, value in [('top_hits', top_hits), ('top_hsps', top_hsps)]:
+        if value is not None and value < 1:
+            raise Error(name + ' must be at least 1. Got ' + str(value))
+
+    stages = []
+    if min_bitscore is not None or min_pident is not None or min_length is not None:
+        stages.append(ThresholdFilter(min_bitscore=min_bitscore, min_pident=min_pident, min_length=min_length))
+
+    if in_task:
+        top_hits = None
+
+    if top_hits is not None or top_hsps is not None:
+        stages.append(TopHitsFilter(top_hits=top_hits, top_hsps=top_hsps))
+
+    return stages
+
+
+def stages_from_options(options, in_task=False):
+    '''Returns make_stages() using the command line options'''
+    return make_stages(
+        top_hits=options.top_hits,
+        top_hsps=options.top_hsps,
+        min_bitscore=options.min_bitscore,
+        min_pident=options.min_pident,
+        min_length=options.min_length,
+        in_task=in_task
+    )
+
+
+def filter_file(infile, outfile, stages):
+    '''Writes the lines of blast output in infile that pass the stages to outfile'''
+    fin = fastaq_utils.open_file_read(infile)
+    fout = fastaq_utils.open_file_write(outfile)
+
+    while True:
+        lines = fin.readlines(utils.fix_coords_read_size)
+        if not lines:
+            break
+        lines = utils.fix_blast_line_list(lines, {})
+        fout.write(utils.lines_to_string(utils._run_stages(lines, stages)))
+
+    for i, stage in enumerate(stages):
+        fout.write(utils.lines_to_string(utils._run_stages(stage.finish(), stages[i + 1:])))
+
+    fastaq_utils.close(fin)
+    fastaq_utils.close(fout)
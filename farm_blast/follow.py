@@ -0,0 +1,222 @@
+import os
+import glob
+import time
+from pyfastaq import utils as fastaq_utils
+from farm_blast import utils
+
+class Error (Exception): pass
+
+
+partial_file = 'blast.partial.out'
+manifest_file = 'blast.partial.manifest'
+
+poll_seconds = 60
+
+# Lines of the manifest that start with this record which chunks have been
+# added to the partial output, and how long the partial output was after each
+chunk_line_prefix = '#chunk'
+
+
+def read_manifest(manifest):
+    '''Reads a manifest made by Publisher. Returns tuple (dict of query name
+       -> number of bytes at the start of the partial output that contain
+       all of its hits, set of numbers of chunks in the partial output,
+       number of bytes of the partial output that are complete). Anything
+       after the last chunk line (from a publisher that stopped halfway
+       through adding a chunk) is ignored'''
+    names = {}
+    pending = {}
+    chunks = set()
+    size = 0
+    if not os.path.exists(manifest):
+        return names, chunks, size
+
+    with open(manifest) as f:
+        for line in f:
+            if not line.endswith('\n'):
+                break
+            fields = line.rstrip('\n').split('\t')
+            if fields[0] == chunk_line_prefix:
+                chunks.add(int(fields[1]))
+                size = int(fields[2])
+                names.update(pending)
+                pending = {}
+            else:
+                pending[fields[0]] = int(fields[1])
+
+    return names, chunks, size
+
+
+def _truncate(filename, size):
+    if os.path.exists(filename):
+        with open(filename, 'r+b') as f:
+            f.truncate(size)
+
+
+class Publisher:
+    def __init__(self, outfile=partial_file, manifest=manifest_file, query_prefix='query.split', blast_prefix='tmp.array.out', done_prefix='tmp.array.done', stages_factory=None, duplicates=None, poll_seconds=poll_seconds, queue=None):
+        '''Appends the output of each array element to outfile, with the
+           coordinates fixed, as soon as the element has finished. When all
+           of the pieces of a query sequence have been added, a line
+           "name<TAB>bytes" is added to manifest, meaning that all the hits
+           of the query are in the first "bytes" bytes of outfile. After
+           the names, a line "#chunk<TAB>N<TAB>bytes" is written for each
+           chunk, so that a publisher that is stopped can carry on where it
+           left off. stages_factory is a function that returns a list of
+           stages (see utils.fix_blast_coords) to run on each chunk.
+           duplicates is a dict made by dedup.load_duplicates, so that the
+           duplicates of each complete query are also written to manifest.
+           queue is the work_queue.Queue that the chunks are run from, if
+           there is one, in which case failed chunks are found from the
+           queue instead of the LSF output of the array elements.
+           Must be run from inside the output directory'''
+        self.outfile = outfile
+        self.manifest = manifest
+        self.query_prefix = query_prefix
+        self.blast_prefix = blast_prefix
+        self.done_prefix = done_prefix
+        self.stages_factory = stages_factory
+        self.duplicates = {} if duplicates is None else duplicates
+        self.poll_seconds = poll_seconds
+        self.queue = queue
+        self.chunks = len(utils.array_output_files(query_prefix))
+        self.coords_offset = utils.load_offsets(query_prefix + '.coords')
+        self.names_cache = {}
+
+        names, self.published, size = read_manifest(manifest)
+        # throw away anything written by a publisher that stopped halfway
+        # through a chunk
+        _truncate(outfile, size)
+        _truncate(manifest, self._manifest_size())
+
+
+    def _manifest_size(self):
+        '''Returns number of bytes at the start of the manifest that are
+           before the last chunk line'''
+        size = 0
+        if not os.path.exists(self.manifest):
+            return size
+        position = 0
+        with open(self.manifest, 'rb') as f:
+            for line in f:
+                position += len(line)
+                if line.startswith(chunk_line_prefix.encode()) and line.endswith(b'\n'):
+                    size = position
+        return size
+
+
+    def _original_name(self, name):
+        offset = self.coords_offset.get(name)
+        return name if offset is None else offset[0]
+
+
+    def chunk_names(self, chunk):
+        '''Returns list of original names of the query sequences in chunk,
+           in the same order as the chunk file, with no name repeated'''
+        if chunk not in self.names_cache:
+            names = []
+            f = fastaq_utils.open_file_read(self.query_prefix + '.' + str(chunk))
+            for line in f:
+                if line.startswith('>'):
+                    name = self._original_name(line[1:].split()[0])
+                    if len(names) == 0 or names[-1] != name:
+                        names.append(name)
+            fastaq_utils.close(f)
+            self.names_cache[chunk] = names
+        return self.names_cache[chunk]
+
+
+    def _run_complete(self, chunk, name):
+        '''Returns True if every chunk that has a piece of name is published,
+           where name is in chunk. Sequences are split into pieces that are
+           next to each other, so the other pieces of name can only be at the
+           start of the next chunks or the end of the previous chunks'''
+        for direction in [1, -1]:
+            neighbour = chunk + direction
+            while 1 <= neighbour <= self.chunks:
+                neighbour_names = self.chunk_names(neighbour)
+                if len(neighbour_names) == 0 or neighbour_names[0 if direction == 1 else -1] != name:
+                    break
+                if neighbour not in self.published:
+                    return False
+                if len(neighbour_names) > 1:
+                    break
+                neighbour += direction
+
+        return True
+
+
+    def _ready(self, chunk):
+        return os.path.exists(self.done_prefix + '.' + str(chunk)) \
+               and os.path.exists(self.blast_prefix + '.' + str(chunk))
+
+
+    def _failed(self, chunk):
+        '''Returns True if the element that runs chunk failed and is not
+           going to be replaced by speculative runs'''
+        if self.queue is not None:
+            # the array elements are workers, not chunks
+            return self.queue.state(chunk) == 'failed'
+
+        lsf_file = 'tmp.array.o.' + str(chunk)
+        return os.path.exists(lsf_file) \
+               and utils.parse_lsf_report(lsf_file)['successful'] is False \
+               and len(glob.glob(lsf_file + '.spec*')) == 0
+
+
+    def publish(self, chunk):
+        '''Adds the output of chunk to the partial output, and the names of
+           queries that are now complete to the manifest'''
+        with open(self.outfile, 'a') as fout:
+            stages = [] if self.stages_factory is None else self.stages_factory()
+            fin = fastaq_utils.open_file_read(self.blast_prefix + '.' + str(chunk))
+            while True:
+                lines = fin.readlines(utils.fix_coords_read_size)
+                if not lines:
+                    break
+                fixed = utils.fix_blast_line_list(lines, self.coords_offset)
+                fout.write(utils.lines_to_string(utils._run_stages(fixed, stages)))
+            fastaq_utils.close(fin)
+            for i, stage in enumerate(stages):
+                fout.write(utils.lines_to_string(utils._run_stages(stage.finish(), stages[i + 1:])))
+            fout.flush()
+            os.fsync(fout.fileno())
+            size = os.fstat(fout.fileno()).st_size
+
+        self.published.add(chunk)
+        names = self.chunk_names(chunk)
+        complete = [names[i] for i in range(len(names)) if (0 < i < len(names) - 1) or self._run_complete(chunk, names[i])]
+
+        with open(self.manifest, 'a') as f:
+            for name in complete:
+                for x in [name] + self.duplicates.get(name, []):
+                    print(x, size, sep='\t', file=f)
+            print(chunk_line_prefix, chunk, size, sep='\t', file=f)
+            f.flush()
+            os.fsync(f.fileno())
+
+
+    def step(self):
+        '''Publishes every chunk that has finished since the last call.
+           Returns True if all chunks have been published'''
+        for chunk in range(1, self.chunks + 1):
+            if chunk in self.published:
+                continue
+            if self._ready(chunk):
+                self.publish(chunk)
+            elif self._failed(chunk):
+                raise Error('Array element ' + str(chunk) + ' failed')
+
+        return len(self.published) == self.chunks
+
+
+    def run(self):
+        '''Publishes chunks until all of them have been published'''
+        while not self.step():
+            time.sleep(self.poll_seconds)
+        self.close()
+
+
+    def close(self):
+        if hasattr(self.coords_offset, 'close'):
+            self.coords_offset.close()
@@ -0,0 +1,88 @@
+import os
+import subprocess
+from concurrent import futures
+
+class Error (Exception): pass
+
+
+def available_memory():
+    '''Returns the memory available on this machine in GB, using
+       MemAvailable from /proc/meminfo if possible, otherwise the total
+       physical memory. Returns None if it could not be found'''
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) / 1000000
+    except:
+        pass
+
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') / 1000000000
+    except:
+        return None
+
+
+def _run_task(command, index, stdout_file, stderr_file):
+    '''Runs one element of a job array. Returns the exit code'''
+    env = dict(os.environ)
+    env['LSB_JOBINDEX'] = str(index)
+    with open(stdout_file, 'w') as f_out, open(stderr_file, 'w') as f_err:
+        return subprocess.call(command, shell=True, stdout=f_out, stderr=f_err, env=env)
+
+
+class LocalExecutor:
+    def __init__(self, workers=None, memory=None, task_memory=0.5, task_threads=1):
+        '''Runs the elements of a job array on this machine, in parallel.
+           workers = maximum number of CPUs that the tasks can use between
+           them. Default is the number of CPUs.
+           task_threads = number of CPUs used by each task.
+           memory = memory in GB that the tasks can use between them. Default
+           is the available memory on this machine.
+           task_memory = memory in GB needed by each task'''
+        self.workers = os.cpu_count() if workers is None else workers
+        self.memory = available_memory() if memory is None else memory
+        self.task_memory = task_memory
+        self.task_threads = task_threads
+
+        if self.workers < 1:
+            raise Error('Number of workers must be at least 1. Got ' + str(self.workers))
+
+
+    def max_parallel_tasks(self):
+        '''Returns the number of tasks that can run at the same time, given
+           the number of workers, threads per task and the memory limit.
+           Always at least 1'''
+        by_cpus = max(1, self.workers // self.task_threads)
+        if self.memory is None or self.task_memory <= 0:
+            return by_cpus
+
+        return max(1, min(by_cpus, int(self.memory / self.task_memory)))
+
+
+    def run_array(self, command, indices, stdout_prefix, stderr_prefix):
+        '''Runs command once for each index in indices, with every appearance
+           of INDEX in the command replaced by the index. stdout and stderr of
+           each task are written to stdout_prefix.INDEX and stderr_prefix.INDEX,
+           the same names that LSF uses for an array. Raises Error after all
+           tasks have finished if any of them failed'''
+        failed = []
+
+        with futures.ProcessPoolExecutor(max_workers=self.max_parallel_tasks()) as pool:
+            jobs = {}
+            for i in indices:
+                job = pool.submit(
+                    _run_task,
+                    command.replace('INDEX', str(i)),
+                    i,
+                    stdout_prefix + '.' + str(i),
+                    stderr_prefix + '.' + str(i)
+                )
+                jobs[job] = i
+
+            for job in futures.as_completed(jobs):
+                if job.result() != 0:
+                    failed.append(jobs[job])
+
+        if len(failed):
+            raise Error('Error running array command. These indexes failed: ' + ' '.join([str(x) for x in sorted(failed)]) + '\nCommand was:\n' + command)
@@ -0,0 +1,217 @@
+import os
+import time
+from farm_blast import utils
+
+class Error (Exception): pass
+
+
+# Memory in GB used by blast whatever the database and query
+base_memory = 0.2
+
+# Memory in GB per GB of formatted database. blast memory maps the
+# database, and most of it is touched during a search
+database_memory_factor = 1.2
+
+# Memory in GB per query base in each chunk, for each type of blast.
+# blastall tblastx is much more hungry than blast+ (it needed 5GB for
+# chunks of 200000 bases)
+query_memory_per_base = {
+    'blastn': 5e-7,
+    'blastn-short': 5e-7,
+    'dc-megablast': 5e-7,
+    'megablast': 3e-7,
+    'rmblastn': 5e-7,
+    'tblastn': 2e-6,
+    'tblastx': 5e-6,
+    'blastp': 2e-6,
+    'blastp-short': 2e-6,
+    'deltablast': 3e-6,
+    'blastx': 2e-6,
+}
+blastall_tblastx_memory_per_base = 2.5e-5
+
+# Not filtering low complexity sequence makes many more hits
+no_filter_factor = 2
+
+# Extra memory requested on top of the largest that previous runs needed
+safety_factor = 1.25
+
+# Only use this many of the most recent similar runs in the history file
+history_runs_used = 20
+
+min_memory = 0.1
+
+history_columns = [
+    'time',
+    'blast_tool',
+    'blast_type',
+    'no_filter',
+    'database_size',
+    'split_bases',
+    'requested_memory',
+    'peak_memory',
+    'memlimit_kills',
+]
+
+database_extensions = {
+    False: ['nhr', 'nin', 'nsq', 'nal', 'nog', 'nsd', 'nsi', 'ndb', 'nos', 'not', 'ntf', 'nto', 'njs'],
+    True: ['phr', 'pin', 'psq', 'pal', 'pog', 'psd', 'psi', 'pdb', 'pos', 'pot', 'ptf', 'pto', 'pjs'],
+}
+
+
+def database_size(blast_obj):
+    '''Returns the size in bytes of the formatted database of blast_obj.reference.
+       If the database has not been made yet, it is estimated from the size
+       of the reference file'''
+    if blast_obj.blast_db_exists():
+        extensions = set(database_extensions[blast_obj.protein_reference])
+        directory = os.path.dirname(os.path.abspath(blast_obj.reference))
+        prefix = os.path.basename(blast_obj.reference) + '.'
+        total = 0
+        for filename in os.listdir(directory):
+            if filename.startswith(prefix) and filename.split('.')[-1] in extensions:
+                total += os.path.getsize(os.path.join(directory, filename))
+        return total
+    elif blast_obj.protein_reference:
+        return os.path.getsize(blast_obj.reference)
+    else:
+        # nucleotides are stored 4 per byte
+        return os.path.getsize(blast_obj.reference) // 4
+
+
+def formula_memory(database_size, blast_type, split_bases, no_filter=False, blastall=False):
+    '''Returns the estimated memory in GB needed to blast a chunk of
+       split_bases bases against a database of the given size in bytes,
+       without using any history of previous runs'''
+    if blastall and blast_type == 'tblastx':
+        per_base = blastall_tblastx_memory_per_base
+    else:
+        try:
+            per_base = query_memory_per_base[blast_type]
+        except KeyError:
+            raise Error('No memory estimate known for blast type: ' + blast_type)
+
+    mem = base_memory + database_memory_factor * database_size / 1000000000 + per_base * split_bases
+    if no_filter:
+        mem *= no_filter_factor
+    return mem
+
+
+class MemoryModel:
+    def __init__(self, history_file=None):
+        '''Estimates the memory needed by each array element. If history_file
+           is given, then the estimate is scaled using the peak memory of
+           previous runs recorded in that file'''
+        self.history_file = history_file
+
+
+    def _load_history(self):
+        if self.history_file is None or not os.path.exists(self.history_file):
+            return []
+
+        records = []
+        with open(self.history_file) as f:
+            for line in f:
+                if line.startswith('#'):
+                    continue
+                fields = line.rstrip('\n').split('\t')
+                if len(fields) != len(history_columns):
+                    continue
+                record = dict(zip(history_columns, fields))
+                try:
+                    for key in ['time', 'database_size', 'split_bases', 'requested_memory', 'peak_memory']:
+                        record[key] = float(record[key])
+                    record['memlimit_kills'] = int(record['memlimit_kills'])
+                    record['no_filter'] = record['no_filter'] == '1'
+                except ValueError:
+                    continue
+                records.append(record)
+
+        return records
+
+
+    def history_ratio(self, blast_tool, blast_type, no_filter):
+        '''Returns the largest ratio of real peak memory to the formula
+           estimate, from previous similar runs. Returns None if there
+           are no similar runs'''
+        records = [x for x in self._load_history() if
+                   x['blast_tool'] == blast_tool
+                   and x['blast_type'] == blast_type
+                   and x['no_filter'] == no_filter]
+        if len(records) == 0:
+            return None
+
+        records.sort(key=lambda x: x['time'])
+        ratios = []
+        for record in records[-history_runs_used:]:
+            peak = record['peak_memory']
+            # A job killed for using too much memory did not reach its peak,
+            # so all we know is that it needed more than it asked for
+            if record['memlimit_kills'] > 0:
+                peak = max(peak, 2 * record['requested_memory'])
+            formula = formula_memory(record['database_size'], blast_type, record['split_bases'], no_filter=no_filter, blastall=blast_tool == 'blastall')
+            ratios.append(peak / formula)
+
+        return max(ratios)
+
+
+    def estimate(self, blast_obj, split_bases, db_shards=1):
+        '''Returns the estimated memory in GB needed to blast one chunk.
+           If the database is split into db_shards shards, each job only
+           uses one shard'''
+        db_size = database_size(blast_obj) // db_shards
+        mem = formula_memory(db_size, blast_obj.blast_type, split_bases, no_filter=blast_obj.no_filter, blastall=blast_obj.blastall)
+        ratio = self.history_ratio(blast_tool(blast_obj), blast_obj.blast_type, blast_obj.no_filter)
+        if ratio is not None:
+            mem *= ratio * safety_factor
+        return round(max(min_memory, mem), 3)
+
+
+    def record_run(self, blast_obj, split_bases, requested_memory, lsf_files, db_shards=1):
+        '''Appends the peak memory used by an array to the history file.
+           lsf_files = list of LSF stdout files of the array elements.
+           db_shards = number of shards the database was split into.
+           Does nothing if none of the files have a memory usage report.
+           Returns the peak memory in GB, or None'''
+        peak = None
+        memlimit_kills = 0
+        for filename in lsf_files:
+            report = utils.parse_lsf_report(filename)
+            if report['memlimit']:
+                memlimit_kills += 1
+            if report['max_memory'] is not None:
+                peak = report['max_memory'] / 1000 if peak is None else max(peak, report['max_memory'] / 1000)
+
+        if peak is None or self.history_file is None:
+            return peak
+
+        fields = [
+            int(time.time()),
+            blast_tool(blast_obj),
+            blast_obj.blast_type,
+            1 if blast_obj.no_filter else 0,
+            database_size(blast_obj) // db_shards,
+            split_bases,
+            requested_memory,
+            peak,
+            memlimit_kills,
+        ]
+
+        history_dir = os.path.dirname(os.path.abspath(self.history_file))
+        os.makedirs(history_dir, exist_ok=True)
+        new_file = not os.path.exists(self.history_file)
+
+        # one write in append mode, so lines from runs finishing at
+        # the same time do not get mixed up
+        lines = ''
+        if new_file:
+            lines += '#' + '\t'.join(history_columns) + '\n'
+        lines += '\t'.join([str(x) for x in fields]) + '\n'
+        with open(self.history_file, 'a') as f:
+            f.write(lines)
+
+        return peak
+
+
+def blast_tool(blast_obj):
+    return 'blastall' if blast_obj.blastall else 'blast_plus'
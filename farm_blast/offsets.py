@@ -0,0 +1,277 @@
+import os
+import mmap
+import struct
+import shutil
+import zlib
+import tempfile
+import subprocess
+from array import array
+from bisect import bisect_left
+from pyfastaq import utils
+
+class Error (Exception): pass
+
+
+magic = b'FARMBLAST_OFFSETS_1\n'
+header_format = '<QQQQQQ'
+
+# Aim for about this many names per bucket of the bucket table, which
+# says where in the sorted hashes each range of hash values starts
+names_per_bucket = 8
+
+# Memory in MB that sort can use when making an index
+sort_memory = 200
+
+
+def name_hash(name):
+    '''Returns a 32 bit hash of name (which must be bytes) that is the same
+       in every process. Names with the same hash are allowed'''
+    return zlib.crc32(name)
+
+
+def bucket_bits(count):
+    '''Returns the number of bits of the hash used to choose a bucket, for an index of count names'''
+    return min(32, (count // names_per_bucket).bit_length())
+
+
+def _pad(n):
+    return (8 - n % 8) % 8
+
+
+def _write_uints(f, values, typecode='Q'):
+    a = array(typecode, values)
+    if a.itemsize != {'I': 4, 'Q': 8}[typecode]:
+        raise Error('Wrong size of unsigned integers to make offsets index')
+    a.tofile(f)
+
+
+def make_index(coords_file, index_file, tmp_dir=None):
+    '''Makes an index file from a file of coords in the format made by
+       fastaq chunker: split sequence name, original name, offset.
+       The index is sorted by hash of the split sequence name, using
+       the sort command so that the whole coords file does not need to be
+       in memory. Original names are stored once for each run of
+       consecutive lines with the same original name'''
+    if tmp_dir is None:
+        tmp_dir = os.path.dirname(os.path.abspath(index_file))
+    tmp_dir = tempfile.mkdtemp(prefix='tmp.offsets_index.', dir=tmp_dir)
+
+    try:
+        _make_index(coords_file, index_file, tmp_dir)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def _make_index(coords_file, index_file, tmp_dir):
+    unsorted_file = os.path.join(tmp_dir, 'unsorted')
+    sorted_file = os.path.join(tmp_dir, 'sorted')
+    refs_file = os.path.join(tmp_dir, 'refs')
+    sections = {x: os.path.join(tmp_dir, x) for x in ['hashes', 'name_starts', 'ref_ids', 'offsets', 'names']}
+
+    # first pass: number the original names, and write each line with the
+    # hash of its name at the start, ready for sorting
+    ref_starts = array('Q', [0])
+    refs_size = 0
+    last_ref = None
+    all_names_have_colon = True
+    count = 0
+    f_in = utils.open_file_read(coords_file)
+
+    with open(unsorted_file, 'wb') as f_out, open(refs_file, 'wb') as f_refs:
+        for line in f_in:
+            try:
+                (seq, ref, offset) = line.rstrip().split('\t')
+                offset = int(offset)
+            except ValueError:
+                raise Error('Error in coords file "' + coords_file + '" at this line:\n' + line)
+
+            if ref != last_ref:
+                ref_bytes = ref.encode()
+                f_refs.write(ref_bytes)
+                refs_size += len(ref_bytes)
+                ref_starts.append(refs_size)
+                last_ref = ref
+
+            seq_bytes = seq.encode()
+            all_names_have_colon = all_names_have_colon and b':' in seq_bytes
+            f_out.write(b'%08x\t%s\t%d\t%d\n' % (name_hash(seq_bytes), seq_bytes, len(ref_starts) - 2, offset))
+            count += 1
+
+    utils.close(f_in)
+
+    env = dict(os.environ)
+    env['LC_ALL'] = 'C'
+    cmd = ['sort', '-S', str(sort_memory) + 'M', '-T', tmp_dir, '-o', sorted_file, unsorted_file]
+    if subprocess.call(cmd, env=env) != 0:
+        raise Error('Error sorting coords file. Command was:\n' + ' '.join(cmd))
+    os.unlink(unsorted_file)
+
+    # second pass: write each part of the index to its own file, then
+    # put them together with a header
+    bits = bucket_bits(count)
+    bucket_starts = array('Q', [0]) * ((1 << bits) + 1)
+    next_bucket = 0
+    names_size = 0
+    last_name = None
+    files = {x: open(sections[x], 'wb') for x in sections}
+    typecodes = {'hashes': 'I', 'name_starts': 'Q', 'ref_ids': 'I', 'offsets': 'Q'}
+    batch = {x: [] for x in typecodes}
+    batch['name_starts'].append(0)
+
+    def flush():
+        for key in batch:
+            _write_uints(files[key], batch[key], typecode=typecodes[key])
+            batch[key] = []
+
+    with open(sorted_file, 'rb') as f:
+        for i, line in enumerate(f):
+            (hash_hex, name, ref_id, offset) = line.rstrip(b'\n').split(b'\t')
+            if name == last_name:
+                raise Error('Sequence name "' + name.decode() + '" found more than once in coords file "' + coords_file + '"')
+            last_name = name
+            h = int(hash_hex, 16)
+            bucket = h >> (32 - bits)
+            while next_bucket <= bucket:
+                bucket_starts[next_bucket] = i
+                next_bucket += 1
+
+            files['names'].write(name)
+            names_size += len(name)
+            batch['hashes'].append(h)
+            batch['name_starts'].append(names_size)
+            batch['ref_ids'].append(int(ref_id))
+            batch['offsets'].append(int(offset))
+            if len(batch['hashes']) >= 100000:
+                flush()
+
+    flush()
+    for f in files.values():
+        f.close()
+
+    while next_bucket < len(bucket_starts):
+        bucket_starts[next_bucket] = count
+        next_bucket += 1
+
+    with open(index_file, 'wb') as f_out:
+        f_out.write(magic)
+        f_out.write(b'\0' * _pad(len(magic)))
+        f_out.write(struct.pack(header_format, count, len(ref_starts) - 1, names_size, refs_size, bits, int(all_names_have_colon)))
+        bucket_starts.tofile(f_out)
+        # each section starts on a multiple of 8 bytes
+        for name in ['name_starts', 'offsets', 'ref_ids', 'hashes']:
+            with open(sections[name], 'rb') as f_in:
+                shutil.copyfileobj(f_in, f_out)
+            f_out.write(b'\0' * _pad(os.path.getsize(sections[name])))
+        ref_starts.tofile(f_out)
+        with open(sections['names'], 'rb') as f_in:
+            shutil.copyfileobj(f_in, f_out)
+        f_out.write(b'\0' * _pad(names_size))
+        with open(refs_file, 'rb') as f_in:
+            shutil.copyfileobj(f_in, f_out)
+
+
+class OffsetsIndex:
+    def __init__(self, index_file, use_mmap=True):
+        '''Compact lookup of the offsets in a coords file, from an index
+           file made by make_index. Has the same get() method as the dict
+           made by utils.offset_coords_file_to_dict, but uses much less
+           memory. If use_mmap is True, the index file is memory mapped
+           instead of read into memory, so only the parts that are used
+           need to be resident'''
+        self.index_file = index_file
+        with open(index_file, 'rb') as f:
+            if use_mmap and os.path.getsize(index_file) > 0:
+                self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                self.data = f.read()
+
+        if self.data[:len(magic)] != magic:
+            raise Error('File "' + index_file + '" is not an offsets index')
+
+        view = memoryview(self.data)
+        self._view = view
+        position = len(magic) + _pad(len(magic))
+        (self.count, ref_count, names_size, refs_size, bits, all_names_have_colon) = struct.unpack_from(header_format, self.data, position)
+        position += struct.calcsize(header_format)
+
+        def section(length, typecode):
+            nonlocal position
+            size = length * struct.calcsize(typecode)
+            values = view[position:position + size].cast(typecode)
+            position += size + _pad(size)
+            return values
+
+        self.bucket_shift = 32 - bits
+        self.bucket_starts = section((1 << bits) + 1, 'Q')
+        self.name_starts = section(self.count + 1, 'Q')
+        self.offsets = section(self.count, 'Q')
+        self.ref_ids = section(self.count, 'I')
+        self.hashes = section(self.count, 'I')
+        self.ref_starts = section(ref_count + 1, 'Q')
+        self.names = section(names_size, 'B')
+        self.refs = section(refs_size, 'B')
+
+        # names made by fastaq chunker always have a colon, so any other
+        # name can be rejected without searching
+        self.all_names_have_colon = bool(all_names_have_colon)
+
+        # blast output has all the hits of each query together, so the
+        # same name is usually looked up many times in a row
+        self._last_name = None
+        self._last_value = None
+
+
+    def __len__(self):
+        return self.count
+
+
+    def _ref_name(self, ref_id):
+        return bytes(self.refs[self.ref_starts[ref_id]:self.ref_starts[ref_id + 1]]).decode()
+
+
+    def _find(self, name):
+        '''Looks up name in the index. Does not use the cached last lookup'''
+        if self.all_names_have_colon and ':' not in name:
+            return None
+
+        name_bytes = name.encode()
+        h = zlib.crc32(name_bytes)
+        bucket = h >> self.bucket_shift
+        end = self.bucket_starts[bucket + 1]
+        i = bisect_left(self.hashes, h, self.bucket_starts[bucket], end)
+        while i < end and self.hashes[i] == h:
+            if self.names[self.name_starts[i]:self.name_starts[i + 1]] == name_bytes:
+                return (self._ref_name(self.ref_ids[i]), self.offsets[i])
+            i += 1
+
+        return None
+
+
+    def get(self, name, default=None):
+        '''Returns tuple (original name, offset) of a split sequence name,
+           or default if the name is not in the index'''
+        if name != self._last_name:
+            self._last_name = name
+            self._last_value = self._find(name)
+
+        return default if self._last_value is None else self._last_value
+
+
+    def __contains__(self, name):
+        return self.get(name) is not None
+
+
+    def __getitem__(self, name):
+        value = self.get(name)
+        if value is None:
+            raise KeyError(name)
+        return value
+
+
+    def close(self):
+        '''Releases the memory map. The index cannot be used after this'''
+        for name in ['bucket_starts', 'name_starts', 'ref_ids', 'offsets', 'hashes', 'ref_starts', 'names', 'refs']:
+            getattr(self, name).release()
+        self._view.release()
+        if type(self.data) == mmap.mmap:
+            self.data.close()
@@ -2,9 +2,12 @@ import os
 import sys
 import argparse
 import time
-import glob
+import shlex
+import copy
+import signal
+import subprocess
 from farmpy import lsf
-from farm_blast import blast, utils
+from farm_blast import batch, blast, chunker, driver, filters, follow, utils, local_executor, memory, planner, shards, sorter, work_queue
 
 class Error (Exception): pass
 
@@ -14,6 +17,26 @@ parser = argparse.ArgumentParser(
 
 parser.add_argument('--no_bsub', action='store_true', help=argparse.SUPPRESS)
 parser.add_argument('--fix_coords_in_blast_output', action='store_true', help=argparse.SUPPRESS)
+parser.add_argument('--sort_chunk', help=argparse.SUPPRESS)
+parser.add_argument('--merge_sorted', action='store_true', help=argparse.SUPPRESS)
+parser.add_argument('--filter_chunk', help=argparse.SUPPRESS)
+parser.add_argument('--chunk_query', action='store_true', help=argparse.SUPPRESS)
+parser.add_argument('--make_batch_query', action='store_true', help=argparse.SUPPRESS)
+parser.add_argument('--make_db_shards', action='store_true', help=argparse.SUPPRESS)
+parser.add_argument('--expand_query_chunks', action='store_true', help=argparse.SUPPRESS)
+parser.add_argument('--calibrate', action='store_true', help=argparse.SUPPRESS)
+parser.add_argument('--acquire_cached_db', action='store_true', help=argparse.SUPPRESS)
+parser.add_argument('--release_cached_db', action='store_true', help=argparse.SUPPRESS)
+parser.add_argument('--remove_duplicate_queries', action='store_true', help=argparse.SUPPRESS)
+parser.add_argument('--chunk_report', action='store_true', help=argparse.SUPPRESS)
+parser.add_argument('--record_memory', action='store_true', help=argparse.SUPPRESS)
+parser.add_argument('--watch_stragglers', action='store_true', help=argparse.SUPPRESS)
+parser.add_argument('--make_work_queue', action='store_true', help=argparse.SUPPRESS)
+parser.add_argument('--publish_chunks', action='store_true', help=argparse.SUPPRESS)
+parser.add_argument('--postprocess_chunk', help=argparse.SUPPRESS)
+parser.add_argument('--concat_chunks', action='store_true', help=argparse.SUPPRESS)
+parser.add_argument('--index_chunk_coords', action='store_true', help=argparse.SUPPRESS)
+parser.add_argument('--work_queue_worker', action='store_true', help=argparse.SUPPRESS)
 parser.add_argument('--split_bases_tolerance', type=int, default=1000, help=argparse.SUPPRESS)
 parser.add_argument('--test', action='store_true', help=argparse.SUPPRESS)
 
@@ -24,26 +47,98 @@ common_blast_group.add_argument('-e', '--evalue', help='Set the evalue cutoff')
 common_blast_group.add_argument('-W', '--word_size', help='Set the word size')
 common_blast_group.add_argument('--no_filter', action='store_true', help='Do not filter query sequence (equivalent to -F F in blastall, -dust no in blast+). By default, the query will be filtered')
 
+filter_group = parser.add_argument_group('Output filtering options', 'Filters are applied to the output of each BLAST job as soon as it finishes, and again when the output is combined, so that the final output is the same as filtering the whole output at the end. Hits of each query are ranked by bit score')
+filter_group.add_argument('--top_hits', type=int, help='Only keep hits to the INT reference sequences with the highest bit scores for each query sequence. Default is to keep all of them', metavar='INT', default=None)
+filter_group.add_argument('--top_hsps', type=int, help='Only keep the INT HSPs with the highest bit scores for each pair of query and reference sequences. Default is to keep all of them', metavar='INT', default=None)
+filter_group.add_argument('--min_bitscore', type=float, help='Only keep hits with at least this bit score', metavar='FLOAT', default=None)
+filter_group.add_argument('--min_pident', type=float, help='Only keep hits with at least this percent identity', metavar='FLOAT', default=None)
+filter_group.add_argument('--min_length', type=int, help='Only keep hits with alignment length at least INT', metavar='INT', default=None)
+
 bsub_group = parser.add_argument_group('Bsub options')
+bsub_group.add_argument('--async_driver', action='store_true', help='Stay running and submit each job from this process as soon as the jobs it needs have finished, printing the progress of the job array, instead of submitting all the jobs at once and returning. The array is submitted as soon as the query has been split. Exits with an error if any job fails')
 bsub_group.add_argument('-q', '--bsub_queue', help='Queue in which all jobs are run [%(default)s]', default = 'normal', metavar='Queue_name')
 bsub_group.add_argument('--blast_mem', type=float, help='Memory limit in GB for the farm jobs that run BLAST. Default is 0.5, except set to 5 if blastall tblastx is used. Defaults doubled if --no_filter used', metavar='FLOAT', default=None)
+bsub_group.add_argument('--estimate_mem', action='store_true', help='Estimate the memory limit for the farm jobs that run BLAST from the database size, blast type, --split_bases and --no_filter, instead of using the defaults of --blast_mem. The estimate is refined using the peak memory of previous runs made with this option, which is recorded in the --mem_history file. Ignored if --blast_mem is used. Cannot be used with --target_walltime, because the memory is chosen before the chunk size is known')
+bsub_group.add_argument('--mem_history', help='File of peak memory used by previous runs, used by --estimate_mem [%(default)s]', metavar='FILENAME', default=os.path.join(os.path.expanduser('~'), '.farm_blast', 'memory_history.tsv'))
+bsub_group.add_argument('--threads', help='Number of threads used by each BLAST job, or "auto" to choose the number of threads and --split_bases that should finish soonest, using --slots, --total_mem, the query size and the database size. The number of query bases is estimated from the size of the query file, assuming gzipped files are about a quarter of their uncompressed size. Jobs with several threads share one copy of the database in memory. --split_bases and --target_walltime are still used if given, in which case only the number of threads is chosen. With --target_walltime, --blast_mem must also be used, because the memory is chosen before the chunk size is known [%(default)s]', metavar='INT or auto', default='1')
+bsub_group.add_argument('--slots', type=int, help='With --threads auto, number of CPUs that the BLAST jobs can use at once. Default is 100 on the farm, or --local_workers when not using the farm', metavar='INT', default=None)
+bsub_group.add_argument('--total_mem', type=float, help='With --threads auto, memory in GB that the BLAST jobs can use at once. Default is no limit on the farm, or --local_mem when not using the farm', metavar='FLOAT', default=None)
 bsub_group.add_argument('--bsub_name_prefix', help='Set the prefix of the names of the bsub jobs', default=None)
 
 
 advanced_opts_group = parser.add_argument_group('Advanced options')
 advanced_opts_group.add_argument('--act', action='store_true', help='Make ACT-friendly blast file, by concatenating all reference sequences together and all query sequences together before blasting.')
+advanced_opts_group.add_argument('--balance_chunks', action='store_true', help='Split the query so that each chunk has about the same estimated BLAST run time, instead of the same number of bases. The estimate uses the sequence lengths and number of sequences in each chunk, the blast type and the reference size')
+advanced_opts_group.add_argument('--batch', action='store_true', help='Run many query files against the same reference in one run. <query> must be a file of query filenames, one per line. The reference is only formatted once, and all of the query files are split into one job array. The output for the Nth query file is written to batch.N.blast.out.gz instead of blast.out.gz. batch.tsv in the output directory lists the query files and their output files. Cannot be used with --act or --columnar')
 advanced_opts_group.add_argument('--blast_options', help='Put any extra options to the blast call (i.e. blastall, blastn, blastx ...etc) in quotes. e.g. --blast_options "-r 2". Whatever you put in here is NOT sanity checked.', default = '', metavar='"options in quotes"')
+advanced_opts_group.add_argument('--columnar', action='store_true', help='As well as blast.out.gz, write the output in a compact binary format to blast.out.columns, which stores each column separately. Query and reference names are stored once each. It can be read from python with farm_blast.columnar.ColumnarFile, without parsing text')
+advanced_opts_group.add_argument('--db_cache', help='Directory of formatted BLAST databases shared between runs. If the reference is not already indexed, its database is taken from this directory, and is only made if it is not there already. Databases are identified by the contents of the reference file, so renaming or moving a reference does not matter. Default is the value of the environment variable FARM_BLAST_DB_CACHE, if it is set', metavar='DIR', default=os.environ.get('FARM_BLAST_DB_CACHE', None))
+advanced_opts_group.add_argument('--db_cache_max_size', type=float, help='Maximum total size in GB of the --db_cache directory. Least recently used databases are deleted when this is exceeded, unless they are being used by a run. Default is no limit', metavar='FLOAT', default=None)
+advanced_opts_group.add_argument('--dedup_query', action='store_true', help='Only BLAST one copy of each query sequence that is in the query file more than once. The hits are copied to the other names of the sequence in the final output, in the order of the original query file, so the output is the same as without this option. Names of duplicated sequences are written to query.duplicates.tsv. Ignored if --act is used')
+advanced_opts_group.add_argument('--db_shards', type=int, help='Split the reference into INT databases of about the same size, and blast every query chunk against every database in separate jobs, so that each job needs less memory and time. The total size of the reference is given to every job, so that e-values are the same as when using the whole reference. Note that limits such as -max_target_seqs in --blast_options apply to each database separately. --db_cache is not used. Cannot be used with --act [%(default)s]', metavar='INT', default=1)
 advanced_opts_group.add_argument('--debug', action='store_true', help='Just make scripts etc but do not run anything')
+advanced_opts_group.add_argument('--fix_in_tasks', action='store_true', help='Each BLAST job fixes the coordinates of its own output and compresses it, so that the final job only has to join the compressed files together, without decompressing them. Cannot be used with --batch, --columnar, --db_shards, --dedup_query, --follow, --sort_output, --speculate, --top_hits or --top_hsps, which all need to look at the whole output at the end')
+advanced_opts_group.add_argument('--follow', action='store_true', help='Make results usable while the BLAST jobs are still running. The output of each BLAST job is added to ' + follow.partial_file + ' as soon as it finishes, with coordinates fixed. When all the hits of a query sequence are in that file, its name is added to ' + follow.manifest_file + ', with the number of bytes at the start of ' + follow.partial_file + ' that contain them. The hits in ' + follow.partial_file + ' are not sorted, and --top_hits is only applied to the final output. Cannot be used with --batch or --db_shards')
+advanced_opts_group.add_argument('--lookup_hits', action='store_true', help='Instead of running BLAST, print the hits of some query sequences from the output of a finished run. Use "farm_blast --lookup_hits blast.out.gz names", where names is a comma-separated list of query names, or a file of names (one per line), or - to read names from stdin. Exits with an error if any name has no hits. Uses the index blast.out.gz.qindex, so does not need to decompress the whole file')
+advanced_opts_group.add_argument('--local_workers', type=int, help='When not using the farm (--no_bsub), maximum number of BLAST jobs to run in parallel. Default is the number of CPUs', metavar='INT', default=None)
+advanced_opts_group.add_argument('--local_mem', type=float, help='When not using the farm (--no_bsub), total memory in GB that the parallel BLAST jobs can use. Each job is assumed to need --blast_mem. Default is the available memory on the machine', metavar='FLOAT', default=None)
 advanced_opts_group.add_argument('--outdir', help='Name of output directory (must not exist already)', metavar='output directory', default=None)
-advanced_opts_group.add_argument('--split_bases', type=int, help='Number of bases in each split file of query. Default is 500000, except set to 200000 if blastall tblastx is used', metavar='INT', default=None)
+advanced_opts_group.add_argument('--target_walltime', type=float, help='Choose the number of bases in each split file of the query by blasting a small random sample of the query, so that each BLAST job should take about this many minutes. Overrides --split_bases. The measurements and chosen value are written to calibration.tsv in the output directory', metavar='FLOAT', default=None)
+advanced_opts_group.add_argument('--resume', action='store_true', help='Resume a run that did not finish. If the output directory already exists, then only the BLAST jobs that did not finish are run again, followed by the final combine job. Use the same options as the original run')
+advanced_opts_group.add_argument('--sort_output', choices=sorted(sorter.sort_keys), help='Sort the final output by query name (query), then also by reference name (query_ref), then also by query and reference coordinates (query_ref_coords). The output of each BLAST job is sorted by the job, then all of them are merged, so sorting does not need much memory. With --act, use query_ref_coords to sort hits by position in the query. Default is to not sort', default=None)
+advanced_opts_group.add_argument('--speculate', action='store_true', help='When most of the BLAST jobs have finished, look for jobs that have been running for much longer than the others. The query sequences they have not finished yet are split into smaller pieces, which are run in parallel. Whichever finishes first out of the original job and the pieces is used. Ignored when not using the farm (--no_bsub)')
+advanced_opts_group.add_argument('--split_bases', type=int, help='Number of bases in each split file of query. Default is 500000, except set to 200000 if blastall tblastx is used, or ' + str(work_queue.split_bases) + ' if --work_queue is used', metavar='INT', default=None)
+advanced_opts_group.add_argument('--work_queue', type=int, help='Instead of one BLAST job per query chunk, run INT long-lived BLAST jobs that keep taking chunks from a shared queue until there are none left, so that jobs on fast nodes do more of the work. The query is split into smaller chunks than usual (see --split_bases). A chunk whose job dies is given to another job. Cannot be used with --speculate', metavar='INT', default=None)
 
 parser.add_argument('reference', help='Name of reference file. Does not need to be indexed already. If not indexed, can be any format from FASTA, FASTQ, GFF3, EMBL, Phylip, GBK', metavar='reference')
 parser.add_argument('query', help='Name of query file. Can be any format from FASTA, FASTQ, GFF3, EMBL, Phylip, GBK', metavar='query')
 
+def array_indices_string(indices):
+    '''Returns string of array indexes in the LSF format, eg [1,2,3,5] -> "1-3,5"'''
+    ranges = []
+    for i in sorted(indices):
+        if len(ranges) and ranges[-1][1] == i - 1:
+            ranges[-1][1] = i
+        else:
+            ranges.append([i, i])
+
+    return ','.join([str(x[0]) if x[0] == x[1] else str(x[0]) + '-' + str(x[1]) for x in ranges])
+
+
+class ArrayJob(lsf.Job):
+    '''lsf.Job that can also run an array of any list of indexes, instead
+       of a range, by setting array_indices'''
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.array_indices = None
+
+
+    def _make_job_name_string(self):
+        if self.array_indices is None:
+            return super()._make_job_name_string()
+
+        return '-J "' + self.name + '[' + array_indices_string(self.array_indices) + ']%' + str(self.max_array_size) + '"'
+
+
 def get_opts(args=None):
     return parser.parse_args(args=args)
 
 
+def get_blast(options, reference, query, outfile):
+    '''Returns a blast.Blast object using the BLAST options in options'''
+    return blast.Blast(
+        reference,
+        query,
+        outfile=outfile,
+        blastall=options.blastall,
+        blast_type=options.blast_type,
+        evalue=options.evalue,
+        word_size=options.word_size,
+        no_filter=options.no_filter,
+        extra_options=options.blast_options
+    )
+
+
 class Pipeline:
     def __init__(self, options, farm_blast_script):
         if options.outdir is None:
@@ -57,26 +152,43 @@ class Pipeline:
         self.outdir = os.path.abspath(options.outdir)
         self.reference = os.path.abspath(options.reference)
         self.query = os.path.abspath(options.query)
+        self.batch = options.batch
+        self.db_shards = options.db_shards
+        if self.db_shards < 1:
+            raise Error('--db_shards must be at least 1')
+        if self.db_shards > 1 and options.act:
+            raise Error('Cannot use --db_shards with --act')
+        self.batch_file = 'batch.tsv'
+        if self.batch:
+            if options.act or options.columnar:
+                raise Error('Cannot use --batch with --act or --columnar')
+            try:
+                self.batch_queries = batch.read_query_list(self.query)
+            except batch.Error as e:
+                raise Error(str(e))
         self.bsub_queue = options.bsub_queue
         self.farm_blast_script = farm_blast_script
         self.test = options.test
         self.union_for_act = options.act
-
-        self.blast = blast.Blast(
-            self.reference,
-            'query.split.INDEX',
-            outfile='tmp.array.out.INDEX',
-            blastall=options.blastall,
-            blast_type=options.blast_type,
-            evalue=options.evalue,
-            word_size=options.word_size,
-            no_filter=options.no_filter,
-            extra_options=options.blast_options
-        )
+        self.balance_chunks = options.balance_chunks
+        self.dedup_query = options.dedup_query and not self.union_for_act
+        self.duplicates_file = 'query.duplicates.tsv'
+        self.target_walltime = options.target_walltime
+        self.db_cache = None if options.db_cache is None else os.path.abspath(options.db_cache)
+        self.db_cache_max_size = options.db_cache_max_size
+        self.using_db_cache = False
+
+        self.blast = get_blast(options, self.reference, 'query.split.INDEX', 'tmp.array.out.INDEX')
+        # the shards are made from the fasta file of the reference
+        if self.db_shards > 1 and not os.path.exists(self.reference) and self.blast.blast_db_exists():
+            raise Error('Cannot use --db_shards with a reference that is only a BLAST database')
 
         self.setup_script = '01.setup.sh'
+        self.setup_done_file = '01.setup.sh.done'
         self.start_array_script = '02.run_array.sh'
+        self.array_task_script = '02.array_task.sh'
         self.combine_script = '03.combine.sh'
+        self.watch_script = '02.watch_stragglers.sh'
         if options.bsub_name_prefix is None:
             self.bsub_name_prefix = 'farm_blast:' + self.outdir
         else:
@@ -90,35 +202,133 @@ class Pipeline:
             self.memory_units = None
 
         self.debug = options.debug
+        self.resume = options.resume
+        self.local_workers = options.local_workers
+        self.local_mem = options.local_mem
         self.split_bases_tolerance = options.split_bases_tolerance
+        self.speculate = options.speculate and not self.no_bsub
+        self.async_driver = options.async_driver and not self.no_bsub
+        self.work_queue = options.work_queue
+        if self.work_queue is not None:
+            if self.work_queue < 1:
+                raise Error('--work_queue must be at least 1')
+            if self.speculate:
+                raise Error('Cannot use --work_queue with --speculate')
+        self.queue_worker_script = '02.queue_worker.sh'
+        self.follow = options.follow
+        if self.follow and (self.batch or self.db_shards > 1):
+            raise Error('Cannot use --follow with --batch or --db_shards')
+        self.follow_script = '02.follow.sh'
+        self.fix_in_tasks = options.fix_in_tasks
+        if self.fix_in_tasks and (self.batch or options.columnar or self.db_shards > 1 or self.dedup_query or self.follow or options.sort_output is not None or self.speculate or options.top_hits is not None or options.top_hsps is not None):
+            raise Error('Cannot use --fix_in_tasks with --batch, --columnar, --db_shards, --dedup_query, --follow, --sort_output, --speculate, --top_hits or --top_hsps')
+        self.sort_output = options.sort_output
+        self.columnar = options.columnar
+        self.filter_options = [(x, getattr(options, x)) for x in ['top_hits', 'top_hsps', 'min_bitscore', 'min_pident', 'min_length']]
+        try:
+            self.filtering = len(filters.stages_from_options(options)) > 0
+        except filters.Error as e:
+            raise Error(str(e))
 
         self.files_to_delete = [
             'tmp.array.*',
             'query.split.*',
-            'blast.out.tmp.gz',
+            self.setup_done_file,
             '02.array.id',
-            '03.combine.sh.id',
         ]
 
-        if not options.blast_mem:
-            if self.blast.blastall and self.blast.blast_type == 'tblastx':
-                self.array_mem = 5
-            else:
-                self.array_mem = 0.5
+        # the driver submits the combine job itself, so it has no id file
+        if not self.async_driver:
+            self.files_to_delete.append(self.combine_script + '.id')
 
-            if self.blast.no_filter:
-                self.array_mem *= 2
-        else:
-            self.array_mem = options.blast_mem
+        if self.speculate:
+            self.files_to_delete.append('02.watch.id')
+        if self.work_queue is not None:
+            self.files_to_delete.append(work_queue.queue_file)
+        if self.follow:
+            self.files_to_delete.append('02.follow.id')
 
         if not options.split_bases:
             if self.blast.blastall and self.blast.blast_type == 'tblastx':
                 self.split_bases = 200000
+            elif self.work_queue is not None:
+                self.split_bases = work_queue.split_bases
             else:
                 self.split_bases = 500000
         else:
             self.split_bases = options.split_bases
 
+        # the memory of the BLAST jobs is chosen here, but --target_walltime
+        # only chooses the chunk size when the setup job runs
+        if options.target_walltime is not None and not options.blast_mem:
+            if options.estimate_mem:
+                raise Error('Cannot use --estimate_mem with --target_walltime, unless --blast_mem is used')
+            if options.threads == 'auto':
+                raise Error('Cannot use --threads auto with --target_walltime, unless --blast_mem is used')
+
+        self.plan = None
+        if options.threads == 'auto':
+            self.plan = self._plan_threads(options)
+            self.threads = self.plan['threads']
+            if not options.split_bases and options.target_walltime is None:
+                self.split_bases = self.plan['split_bases']
+        else:
+            try:
+                self.threads = int(options.threads)
+            except ValueError:
+                raise Error('--threads must be a number or "auto". Got: ' + options.threads)
+            if self.threads < 1:
+                raise Error('--threads must be at least 1')
+        self.blast.threads = self.threads
+
+        self.estimate_mem = options.estimate_mem and not options.blast_mem
+        self.mem_history = os.path.abspath(options.mem_history)
+
+        if options.blast_mem:
+            self.array_mem = options.blast_mem
+        elif self.estimate_mem:
+            self.array_mem = memory.MemoryModel(history_file=self.mem_history).estimate(self.blast, self.split_bases, db_shards=self.db_shards)
+            self.array_mem = round(self.array_mem + planner.thread_memory * (self.threads - 1), 3)
+        elif self.plan is not None:
+            self.array_mem = planner.job_memory(self.split_bases, self.threads, memory.database_size(self.blast) // self.db_shards, self.blast.blast_type, no_filter=self.blast.no_filter, blastall=self.blast.blastall)
+            self.array_mem = round(self.array_mem, 3)
+        else:
+            if self.blast.blastall and self.blast.blast_type == 'tblastx':
+                self.array_mem = 5
+            else:
+                self.array_mem = 0.5
+
+            if self.blast.no_filter:
+                self.array_mem *= 2
+
+
+    def _plan_threads(self, options):
+        '''Returns planner.plan() for this pipeline'''
+        queries = self.batch_queries if self.batch else [self.query]
+        query_bases = sum([planner.query_size(x) for x in queries])
+
+        if options.no_bsub:
+            slots = options.slots or self.local_workers or os.cpu_count()
+            total_memory = options.total_mem or self.local_mem or local_executor.available_memory()
+        else:
+            slots = options.slots or 100
+            total_memory = options.total_mem
+
+        try:
+            return planner.plan(
+                query_bases * self.db_shards,
+                chunker.reference_size(self.blast) // self.db_shards,
+                memory.database_size(self.blast) // self.db_shards,
+                self.blast.blast_type,
+                slots,
+                total_memory=total_memory,
+                split_bases=options.split_bases,
+                no_filter=self.blast.no_filter,
+                blastall=self.blast.blastall
+            )
+        except (chunker.Error, planner.Error) as e:
+            raise Error(str(e))
+
 
     def _make_setup_script(self, script_name=None):
         if script_name is None:
@@ -129,7 +339,32 @@ class Pipeline:
             raise Error('Error opening setup script "' + script_name + '" for writing')
 
         print('set -e', file=f)
-        if not self.blast.blast_db_exists() or self.union_for_act:
+        # file used by --chunk_query to estimate the size of the reference
+        chunk_reference = None
+        if self.db_shards > 1:
+            print('fastaq to_fasta -s', self.reference, 'reference.fa', file=f)
+            self._print_farm_blast_command(' '.join(['--make_db_shards', '--db_shards', str(self.db_shards), 'x', 'x']), f)
+            for shard in range(1, self.db_shards + 1):
+                shard_blast = copy.copy(self.blast)
+                shard_blast.reference = shards.shard_filename(shard)
+                print(shard_blast.format_database_command(), file=f)
+            self.reference = 'reference.fa'
+            # the array task script sets $shard from the array index
+            self.blast.reference = shards.shard_filename('$shard')
+            self.blast.db_size = '`cat reference.dbsize`'
+            self.files_to_delete.append('reference.*')
+        elif self.db_cache is not None and (not self.blast.blast_db_exists() or self.union_for_act):
+            cache_options = ['--acquire_cached_db'] + self._db_cache_options_list() + self._blast_options_list()
+            if self.union_for_act:
+                cache_options.append('--act')
+            self._print_farm_blast_command(' '.join(cache_options + [self.reference, 'x']), f)
+            self.using_db_cache = True
+            # the cache only links the database files, not reference.fa
+            chunk_reference = self.reference
+            self.reference = 'reference.fa'
+            self.blast.reference = self.reference
+            self.files_to_delete.append('reference.*')
+        elif not self.blast.blast_db_exists() or self.union_for_act:
             if self.union_for_act:
                 print('fastaq merge', self.reference, '- |',
                       'fastaq to_fasta -s - reference.fa', file=f)
@@ -142,13 +377,73 @@ class Pipeline:
 
         # blast strips off everything after the first whitespace, so do this
         # before chunking so names stay consistent with query fasta and in blast output
-        if self.union_for_act:
-            print('fastaq merge', self.query, '- |',
-                  'fastaq to_fasta -s - - |', end=' ', file=f)
+        use_query_file = self.balance_chunks or self.target_walltime is not None or self.dedup_query or self.batch
+        if use_query_file:
+            query_out = 'query.fa'
+            self.files_to_delete.append('query.fa')
+        else:
+            query_out = '-'
+
+        if self.batch:
+            self._print_farm_blast_command('--make_batch_query x ' + query_out, f)
+        else:
+            if self.union_for_act:
+                print('fastaq merge', self.query, '- |',
+                      'fastaq to_fasta -s - ' + query_out, end='', file=f)
+            else:
+                print('fastaq to_fasta -s', self.query, query_out, end='', file=f)
+
+            if use_query_file:
+                print(file=f)
+
+        query_file = query_out
+        if self.dedup_query:
+            self._print_farm_blast_command('--remove_duplicate_queries x query.fa', f)
+            query_file = 'query.dedup.fa'
+            self.files_to_delete.append(query_file)
+
+        if self.target_walltime is not None:
+            calibrate_options = ['--calibrate', '--target_walltime', str(self.target_walltime)] + self._blast_options_list()
+            # calibrate with the same number of threads as the real jobs
+            if self.threads > 1:
+                calibrate_options.extend(['--threads', str(self.threads)])
+            # each array element searches one shard, so time the first one
+            if self.db_shards > 1:
+                calibrate_options.extend(['--db_shards', str(self.db_shards)])
+                calibrate_options += [shards.shard_filename(1), query_file]
+            else:
+                calibrate_options += [self.reference, query_file]
+            self._print_farm_blast_command(' '.join(calibrate_options), f, stdout_variable='split_bases')
+            self.files_to_delete.append('calibration.tmp.*')
+            split_bases = '$split_bases'
+        else:
+            split_bases = str(self.split_bases)
+
+        if self.balance_chunks:
+            chunk_options = ['--chunk_query'] + self._blast_options_list() + [
+                '--split_bases', split_bases,
+                '--split_bases_tolerance', str(self.split_bases_tolerance),
+                chunk_reference or self.reference,
+                query_file
+            ]
+            self._print_farm_blast_command(' '.join(chunk_options), f)
+        elif use_query_file:
+            print('fastaq chunker --skip_all_Ns', query_file, 'query.split', split_bases, self.split_bases_tolerance, file=f)
         else:
-            print('fastaq to_fasta -s', self.query, '- |', end=' ', file=f)
+            print(' |', 'fastaq chunker --skip_all_Ns', '-', 'query.split', split_bases, self.split_bases_tolerance, file=f)
+
+        if self.db_shards > 1:
+            self._print_farm_blast_command(' '.join(['--expand_query_chunks', '--db_shards', str(self.db_shards), 'x', 'x']), f)
+            self.files_to_delete.append('query.chunk.*')
+
+        # so that each array element only reads its own lines of the coords file
+        if self.sort_output is not None or self.fix_in_tasks:
+            self._print_farm_blast_command('--index_chunk_coords x x', f)
+
+        if self.work_queue is not None:
+            self._print_farm_blast_command('--make_work_queue x x', f)
 
-        print('fastaq chunker --skip_all_Ns', '-', 'query.split', self.split_bases, self.split_bases_tolerance, file=f)
+        print('touch', self.setup_done_file, file=f)
         f.close()
 
 
@@ -161,21 +456,79 @@ class Pipeline:
             1,
             'bash ' + self.setup_script,
             memory_units=self.memory_units,
+            threads=self.threads if self.target_walltime is not None else 1
         )
 
 
+    def _make_array_task_script(self, script_name=None):
+        '''Makes script run by each element of the job array. It takes the
+           array index as its only argument. Writes the file tmp.array.start.INDEX
+           when it starts, and tmp.array.done.INDEX when blast has finished
+           successfully'''
+        if script_name is None:
+            script_name = self.array_task_script
+        try:
+            f = open(script_name, 'w')
+        except:
+            raise Error('Error writing script "' + script_name + '"')
+
+        print('set -e', file=f)
+        print('touch tmp.array.start.$1', file=f)
+        if self.db_shards > 1:
+            # speculative runs of element i have indexes like i.spec.0
+            print('shard=$(( (${1%%.*} - 1) % ' + str(self.db_shards) + ' + 1 ))', file=f)
+        print(self.blast.get_run_command().replace('INDEX', '$1'), file=f)
+        if self.sort_output is not None:
+            self._print_farm_blast_command(' '.join(self._sort_options_list() + ['--sort_chunk', '$1', 'x', 'x']), f)
+        elif self.fix_in_tasks:
+            self._print_farm_blast_command(' '.join(self._filter_options_list() + ['--postprocess_chunk', '$1', 'x', 'x']), f)
+        elif self.filtering:
+            self._print_farm_blast_command(' '.join(self._filter_options_list() + ['--filter_chunk', '$1', 'x', 'x']), f)
+        print('touch tmp.array.done.$1', file=f)
+        f.close()
+
+
+    def _make_queue_worker_script(self, script_name=None):
+        '''Makes script run by each element of the job array when using a
+           work queue. It runs array task scripts until the queue is empty'''
+        if script_name is None:
+            script_name = self.queue_worker_script
+        try:
+            f = open(script_name, 'w')
+        except:
+            raise Error('Error writing script "' + script_name + '"')
+
+        print('set -e', file=f)
+        self._print_farm_blast_command('--work_queue_worker x x', f)
+        f.close()
+
+
+    def _array_elements(self, chunks):
+        '''Returns the number of array elements needed to run the given
+           number of query chunks'''
+        if self.work_queue is None:
+            return chunks
+        return min(chunks, self.work_queue)
+
+
     def _make_array_job(self):
-        self.array_job = lsf.Job(
+        if self.work_queue is None:
+            command = 'bash ' + self.array_task_script + ' INDEX'
+        else:
+            command = 'bash ' + self.queue_worker_script
+
+        self.array_job = ArrayJob(
             'tmp.array.o',
             'tmp.array.e',
             self.bsub_name_prefix + '.array',
             self.bsub_queue,
             self.array_mem,
-            self.blast.get_run_command(),
+            command,
             array_start=1,
             array_end=r'''$n''',
             memory_units=self.memory_units,
-            max_array_size=100
+            max_array_size=100,
+            threads=self.threads
         )
 
 
@@ -200,13 +553,172 @@ class Pipeline:
             raise Error('Error writing script "' + script_name + '"')
         print('set -e', file=f)
         print(r'''n=`ls query.split.* | grep -v coords | wc -l`''', file=f)
+        if self.work_queue is not None:
+            print('n=$(( n < ' + str(self.work_queue) + ' ? n : ' + str(self.work_queue) + ' ))', file=f)
         print(str(self.array_job) + r''' |  awk '{print substr($2,2,length($2)-2)}' > 02.array.id''', file=f)
         print(r'''array_id=`cat 02.array.id`
-combine_id=`cat ''' + self.combine_script + r'''.id`
-bmod -w "done($array_id)" $combine_id''', file=f)
+combine_id=`cat ''' + self.combine_script + r'''.id`''', file=f)
+        if self.speculate:
+            # The watcher kills array elements when speculative runs finish
+            # first, so the array may not be "done". The watcher only
+            # finishes when every element has output
+            print(str(self.watch_job) + r''' |  awk '{print substr($2,2,length($2)-2)}' > 02.watch.id''', file=f)
+            print(r'''watch_id=`cat 02.watch.id`''', file=f)
+            dependencies = ['done($watch_id)']
+        else:
+            dependencies = ['done($array_id)']
+        if self.follow:
+            print(str(self.follow_job) + r''' |  awk '{print substr($2,2,length($2)-2)}' > 02.follow.id''', file=f)
+            print(r'''follow_id=`cat 02.follow.id`''', file=f)
+            dependencies.append('done($follow_id)')
+        print('bmod -w "' + ' && '.join(dependencies) + '" $combine_id', file=f)
+        f.close()
+
+
+    def _make_watch_script(self, script_name=None):
+        '''Makes script that watches the array for stragglers'''
+        if script_name is None:
+            script_name = self.watch_script
+        try:
+            f = open(script_name, 'w')
+        except:
+            raise Error('Error writing script "' + script_name + '"')
+
+        print('set -e', file=f)
+        watch_options = [
+            '--watch_stragglers',
+            '--bsub_queue', self.bsub_queue,
+            '--blast_mem', str(self.array_mem),
+            '--bsub_name_prefix', shlex.quote(self.bsub_name_prefix),
+        ]
+        if self.threads > 1:
+            watch_options.extend(['--threads', str(self.threads)])
+        watch_options.extend(['x', 'x'])
+        self._print_farm_blast_command(' '.join(watch_options), f)
+        f.close()
+
+
+    def _make_watch_job(self):
+        self.watch_job = lsf.Job(
+            self.watch_script + '.o',
+            self.watch_script + '.e',
+            self.bsub_name_prefix + '.watch',
+            self.bsub_queue,
+            0.5,
+            'bash ' + self.watch_script,
+            memory_units=self.memory_units,
+        )
+
+
+    def _make_follow_script(self, script_name=None):
+        '''Makes script that adds the output of each array element to the
+           partial output as soon as it finishes'''
+        if script_name is None:
+            script_name = self.follow_script
+        try:
+            f = open(script_name, 'w')
+        except:
+            raise Error('Error writing script "' + script_name + '"')
+
+        print('set -e', file=f)
+        self._print_farm_blast_command(' '.join(self._follow_options_list() + ['x', 'x']), f)
         f.close()
 
 
+    def _follow_options_list(self):
+        opts = ['--publish_chunks'] + self._filter_options_list()
+        if self.dedup_query:
+            opts.append('--dedup_query')
+        if self.work_queue is not None:
+            opts.extend(['--work_queue', str(self.work_queue)])
+        return opts
+
+
+    def _make_follow_job(self):
+        self.follow_job = lsf.Job(
+            self.follow_script + '.o',
+            self.follow_script + '.e',
+            self.bsub_name_prefix + '.follow',
+            self.bsub_queue,
+            1,
+            'bash ' + self.follow_script,
+            memory_units=self.memory_units,
+        )
+
+
+    def _blast_options_list(self):
+        '''Returns list of command line options to pass the BLAST options of
+           this pipeline to another call of the farm_blast script'''
+        opts = ['--blast_type', self.blast.blast_type]
+        if self.blast.blastall:
+            opts.append('--blastall')
+        if self.blast.evalue:
+            opts.extend(['--evalue', str(self.blast.evalue)])
+        if self.blast.word_size:
+            opts.extend(['--word_size', str(self.blast.word_size)])
+        if self.blast.no_filter:
+            opts.append('--no_filter')
+        if self.blast.extra_options:
+            opts.append('--blast_options=' + shlex.quote(self.blast.extra_options))
+        return opts
+
+
+    def _filter_options_list(self):
+        '''Returns list of command line options to pass the output filtering
+           options of this pipeline to another call of the farm_blast script'''
+        opts = []
+        for name, value in self.filter_options:
+            if value is not None:
+                opts.extend(['--' + name, str(value)])
+        return opts
+
+
+    def _sort_options_list(self):
+        opts = ['--sort_output', self.sort_output] + self._filter_options_list()
+        if self.dedup_query:
+            opts.append('--dedup_query')
+        return opts
+
+
+    def _output_options_list(self):
+        '''Returns list of command line options about the final output files,
+           to pass to the farm_blast call in the combine job'''
+        opts = []
+        if self.columnar:
+            opts.append('--columnar')
+        if self.batch:
+            opts.append('--batch')
+        return opts
+
+
+    def _db_cache_options_list(self):
+        opts = ['--db_cache', self.db_cache]
+        if self.db_cache_max_size is not None:
+            opts.extend(['--db_cache_max_size', str(self.db_cache_max_size)])
+        return opts
+
+
+    def _print_farm_blast_command(self, args, f, stdout_variable=None):
+        '''Writes a call to the farm_blast script with the given arguments to
+           the filehandle f. If self.test is True, then calls the farm_blast
+           script from this repository instead of the installed one.
+           If stdout_variable is given, then the stdout of the call is
+           stored in a shell variable of that name'''
+        if self.test:
+            p = os.path.dirname(self.farm_blast_script)
+            p = os.path.join(p, os.pardir)
+            p = os.path.normpath(p)
+            print('PYTHONPATH=' + p + ':$PYTHONPATH', file=f)
+            cmd = ' '.join([self.farm_blast_script, '--test', args])
+        else:
+            cmd = ' '.join(['farm_blast', args])
+
+        if stdout_variable is None:
+            print(cmd, file=f)
+        else:
+            print(stdout_variable + '=`' + cmd + '`', file=f)
+
+
     def _make_combine_job(self):
         self.combine_job = lsf.Job(
             self.combine_script + '.o',
@@ -232,17 +744,32 @@ bmod -w "done($array_id)" $combine_id''', file=f)
             print('set -e', file=f)
 
         print(r'''cat tmp.array.e.* > 02.array.e
-cat tmp.array.o.* > 02.array.o
-cat tmp.array.out.* | gzip -9 -c > blast.out.tmp.gz''', file=f)
-        if self.test:
-            p = os.path.dirname(self.farm_blast_script)
-            p = os.path.join(p, os.pardir)
-            p = os.path.normpath(p)
-            print('PYTHONPATH=' + p + ':$PYTHONPATH', file=f)
-        if self.test:
-            print(self.farm_blast_script, '--test --fix_coords_in_blast_output x x', file=f)
+cat tmp.array.o.* > 02.array.o''', file=f)
+        if self.sort_output is not None:
+            self._print_farm_blast_command(' '.join(self._sort_options_list() + self._output_options_list() + ['--merge_sorted', 'x', 'x']), f)
+        elif self.fix_in_tasks:
+            self._print_farm_blast_command('--concat_chunks x x', f)
         else:
-            print('farm_blast --fix_coords_in_blast_output x x', file=f)
+            fix_options = ['--fix_coords_in_blast_output'] + self._filter_options_list()
+            if self.db_shards > 1:
+                fix_options.extend(['--db_shards', str(self.db_shards)])
+            if self.dedup_query:
+                fix_options.append('--dedup_query')
+            self._print_farm_blast_command(' '.join(fix_options + self._output_options_list() + ['x', 'x']), f)
+        if self.work_queue is None:
+            self._print_farm_blast_command('--chunk_report x x', f)
+        else:
+            self._print_farm_blast_command('--chunk_report --work_queue ' + str(self.work_queue) + ' x x', f)
+        if self.estimate_mem:
+            record_options = ['--record_memory', '--mem_history', self.mem_history,
+                              '--split_bases', str(self.split_bases),
+                              '--blast_mem', str(self.array_mem)]
+            if self.db_shards > 1:
+                record_options.extend(['--db_shards', str(self.db_shards)])
+            record_options += self._blast_options_list() + [self.reference, 'x']
+            self._print_farm_blast_command(' '.join(record_options), f)
+        if self.using_db_cache:
+            self._print_farm_blast_command(' '.join(['--release_cached_db'] + self._db_cache_options_list() + ['x', 'x']), f)
         print('rm', ' '.join(self.files_to_delete), file=f)
         print('touch FINISHED', file=f)
         f.close()
@@ -268,44 +795,61 @@ cat tmp.array.out.* | gzip -9 -c > blast.out.tmp.gz''', file=f)
         #         the combien job runs when the array has finished
         # 5. When the array finishes, Job3 will then run.
 
-        try:
-            os.mkdir(self.outdir)
-        except:
-            print('Error making output directory', self.outdir, file=sys.stderr)
-            sys.exit(1)
+        if self.plan is not None:
+            print('Planned', self.threads, 'threads per BLAST job and', self.split_bases, 'query bases per job.',
+                  'Estimated run time', round(self.plan['seconds'] / 60), 'minutes with', self.plan['parallel_jobs'], 'jobs at once')
+
+        resuming = self.resume and os.path.exists(self.outdir)
+
+        if not resuming:
+            try:
+                os.mkdir(self.outdir)
+            except:
+                print('Error making output directory', self.outdir, file=sys.stderr)
+                sys.exit(1)
 
         original_dir = os.getcwd()
         os.chdir(self.outdir)
-        self._make_setup_script()
-        self._make_setup_job()
-        self._make_array_job()
-        self._make_start_array_script()
-        self._make_start_array_job()
-        self._make_combine_script()
-        self._make_combine_job()
-
-        if self.debug:
-            sys.exit()
-
-        if self.no_bsub:
+        # restore the directory even if something fails, because the
+        # pipeline is also run from python by api.farm_hits
+        try:
+            if self.batch:
+                batch.write_batch_file(self.batch_queries, self.batch_file)
+            self._make_setup_script()
+            self._make_setup_job()
+            self._make_array_task_script()
+            if self.work_queue is not None:
+                self._make_queue_worker_script()
+            self._make_array_job()
+            if self.speculate:
+                self._make_watch_script()
+                self._make_watch_job()
+            if self.follow:
+                self._make_follow_script()
+                self._make_follow_job()
+            self._make_start_array_script()
+            self._make_start_array_job()
+            self._make_combine_script()
+            self._make_combine_job()
+
+            if self.debug:
+                sys.exit()
+
+            if resuming:
+                self._resume()
+            else:
+                self._run_all_jobs()
+        finally:
+            os.chdir(original_dir)
+
+
+    def _run_all_jobs(self):
+        if self.async_driver:
+            self._run_with_driver()
+        elif self.no_bsub:
             self.setup_job.run_not_bsubbed()
-            # get size of job array
-            files_count = len(glob.glob('query.split.*')) - 1
-            self.array_job.array_end = files_count
-            print(self.array_job)
-            print(self.array_job.array_start)
-            print(self.array_job.array_end)
-            print(self.array_job._make_command_string().replace('\$LSB_JOBINDEX', '$LSB_JOBINDEX'))
-            self.array_job.run_not_bsubbed()
-
-            # a little hack here to make the farm_blast script run
-            this_script = os.path.realpath(__file__)
-            this_script_dir = os.path.dirname(this_script)
-            module_root_dir = os.path.join(this_script_dir, '..')
-            module_root_dir = os.path.normpath(module_root_dir)
-            os.environ["PATH"] = os.path.join(module_root_dir, 'scripts:') + os.environ["PATH"]
-            os.environ["PYTHONPATH"] = module_root_dir + ':' + os.environ["PYTHONPATH"]
-            self.combine_job.run_not_bsubbed()
+            self._run_array_not_bsubbed(range(1, self._array_elements(len(utils.array_output_files('query.split'))) + 1))
+            self._run_combine_not_bsubbed()
         else:
             self.setup_job.run()
             time.sleep(1)
@@ -313,17 +857,136 @@ cat tmp.array.out.* | gzip -9 -c > blast.out.tmp.gz''', file=f)
             self.start_array_job.run()
             time.sleep(1)
             self.combine_job.add_dependency(self.start_array_job.job_id)
-            self.combine_job.run()
-            time.sleep(1)
-            try:
-                f = open(self.combine_script + '.id', 'w')
-            except:
-                raise Error('Error opening file "' + self.combine_script + '.id' + '" for writing')
-            print(self.combine_job.job_id, file=f)
-            f.close()
-            print('Jobs submitted to the farm.')
-            print('Final job id is', self.combine_job.job_id)
-            print('\nPipeline finished OK when this file is written:\n   ', os.path.join(self.outdir, 'FINISHED'))
+            self._run_combine_bsubbed()
+
+
+    def _run_with_driver(self, run_setup=True, indices=None):
+        pipeline_driver = driver.Driver(
+            self.setup_job,
+            self.array_job,
+            self.combine_job,
+            watch_job=self.watch_job if self.speculate else None,
+            max_elements=self.work_queue,
+            follow_job=self.follow_job if self.follow else None
+        )
+        try:
+            pipeline_driver.run(run_setup=run_setup, indices=indices)
+        except driver.Error as e:
+            raise Error(str(e))
+        print('\nPipeline finished OK')
+        if self.batch:
+            print('Final files are listed in:\n   ', os.path.join(self.outdir, self.batch_file))
+        else:
+            print('Final file is:\n   ', os.path.join(self.outdir, 'blast.out.gz'))
+
+
+    def _run_array_not_bsubbed(self, indices):
+        self.array_job.array_end = max(indices, default=0)
+        print(self.array_job)
+        print(self.array_job.array_start)
+        print(self.array_job.array_end)
+        executor = local_executor.LocalExecutor(
+            workers=self.local_workers,
+            memory=self.local_mem,
+            task_memory=self.array_mem,
+            task_threads=self.threads
+        )
+
+        # publish the output of each element while the others are running
+        follower = None
+        if self.follow:
+            self._set_script_environment()
+            with open(self.follow_job.stdout_file, 'w') as f_out, open(self.follow_job.stderr_file, 'w') as f_err:
+                follower = subprocess.Popen(self.follow_job.command, shell=True, stdout=f_out, stderr=f_err, start_new_session=True)
+
+        try:
+            executor.run_array(self.array_job.command, indices, self.array_job.stdout_file, self.array_job.stderr_file)
+        except:
+            if follower is not None:
+                os.killpg(follower.pid, signal.SIGKILL)
+                follower.wait()
+            raise
+
+        if follower is not None and follower.wait() != 0:
+            raise Error('Error adding output to ' + follow.partial_file + '. See ' + self.follow_job.stderr_file)
+
+
+    def _set_script_environment(self):
+        # a little hack here to make the farm_blast script run
+        this_script = os.path.realpath(__file__)
+        this_script_dir = os.path.dirname(this_script)
+        module_root_dir = os.path.join(this_script_dir, '..')
+        module_root_dir = os.path.normpath(module_root_dir)
+        os.environ["PATH"] = os.path.join(module_root_dir, 'scripts:') + os.environ["PATH"]
+        os.environ["PYTHONPATH"] = module_root_dir + ':' + os.environ.get("PYTHONPATH", '')
+
+
+    def _run_combine_not_bsubbed(self):
+        self._set_script_environment()
+        self.combine_job.run_not_bsubbed()
+
+
+    def _run_combine_bsubbed(self):
+        self.combine_job.run()
+        time.sleep(1)
+        try:
+            f = open(self.combine_script + '.id', 'w')
+        except:
+            raise Error('Error opening file "' + self.combine_script + '.id' + '" for writing')
+        print(self.combine_job.job_id, file=f)
+        f.close()
+        print('Jobs submitted to the farm.')
+        print('Final job id is', self.combine_job.job_id)
+        print('\nPipeline finished OK when this file is written:\n   ', os.path.join(self.outdir, 'FINISHED'))
+        if self.batch:
+            print('\nFinal files are listed in:\n   ', os.path.join(self.outdir, self.batch_file))
+        else:
             print('\nFinal file will be called:\n   ', os.path.join(self.outdir, 'blast.out.gz'))
 
-        os.chdir(original_dir)
+
+    def incomplete_array_indices(self):
+        '''Returns list of indexes of array elements that did not finish
+           successfully. Must be run from inside the output directory'''
+        chunks = utils.array_output_files('query.split')
+        return [i for i in range(1, len(chunks) + 1) if not (
+            os.path.exists('tmp.array.done.' + str(i)) and (
+                os.path.exists('tmp.array.out.' + str(i)) or os.path.exists('tmp.array.out.' + str(i) + '.gz')
+            )
+        )]
+
+
+    def _resume(self):
+        '''Runs the parts of the pipeline that have not finished. Must be run from
+           inside the output directory, after the scripts and jobs have been made'''
+        if os.path.exists('FINISHED'):
+            print('Pipeline already finished. Nothing to do')
+            return
+
+        if not os.path.exists(self.setup_done_file):
+            print('Setup job did not finish. Running the whole pipeline again')
+            self._run_all_jobs()
+            return
+
+        indices = self.incomplete_array_indices()
+        print('Array elements to run again:', len(indices))
+        if self.work_queue is not None:
+            # the chunks that did not finish go in a new queue, which is
+            # emptied by new workers
+            work_queue.make_queue()
+            indices = list(range(1, self._array_elements(len(indices)) + 1))
+
+        if self.async_driver:
+            self._run_with_driver(run_setup=False, indices=indices)
+        elif self.no_bsub:
+            if len(indices):
+                self._run_array_not_bsubbed(indices)
+            self._run_combine_not_bsubbed()
+        else:
+            if len(indices):
+                self.array_job.array_indices = indices
+                self.array_job.run()
+                time.sleep(1)
+                with open('02.array.id', 'w') as f:
+                    print(self.array_job.job_id, file=f)
+                self.combine_job.add_dependency(self.array_job.job_id)
+            self._run_combine_bsubbed()
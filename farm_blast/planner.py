@@ -0,0 +1,121 @@
+import os
+import math
+from farm_blast import chunker, memory
+
+class Error (Exception): pass
+
+
+# Numbers of threads per BLAST job that are considered
+thread_choices = [1, 2, 4, 8, 16]
+
+# Fraction of the work of a BLAST job that does not get faster with more
+# threads (reading the query, writing output, setting up the search)
+serial_fraction = 0.1
+
+# Extra memory in GB needed by each extra thread. The database is memory
+# mapped, so it is shared by all the threads of a job
+thread_memory = 0.1
+
+# Rough speed of one thread of blastn against a 1Mb reference, in query
+# bases per second. Other blast types and bigger references are scaled by
+# the costs in chunker.blast_type_base_cost
+blastn_bases_per_second = 20000
+
+# Time in seconds to start a job and load the database
+job_overhead_seconds = 60
+
+# split_bases is kept within these limits
+min_split_bases = 10000
+max_split_bases = 100000000
+
+# For each number of threads, try having the chunks run in up to this many
+# rounds of jobs. More rounds means fewer, bigger chunks
+max_rounds = 4
+
+# Rough ratio of the uncompressed to compressed size of a gzipped FASTA file
+gzip_ratio = 4
+
+
+def query_size(filename):
+    '''Returns an estimate of the number of bases in a query file, from
+       the size of the file. Gzipped files are scaled by gzip_ratio'''
+    size = os.path.getsize(filename)
+    if filename.endswith('.gz'):
+        size *= gzip_ratio
+    return size
+
+
+def speedup(threads):
+    '''Returns how many times faster a job runs with the given number of threads than with one thread'''
+    return threads / (1 + serial_fraction * (threads - 1))
+
+
+def job_seconds(split_bases, threads, seconds_per_base):
+    '''Returns the estimated run time of one job'''
+    return job_overhead_seconds + split_bases * seconds_per_base / speedup(threads)
+
+
+def job_memory(split_bases, threads, database_size, blast_type, no_filter=False, blastall=False):
+    '''Returns the estimated memory in GB needed by one job'''
+    return memory.formula_memory(database_size, blast_type, split_bases, no_filter=no_filter, blastall=blastall) \
+           + thread_memory * (threads - 1)
+
+
+def plan(query_bases, reference_size, database_size, blast_type, slots, total_memory=None, max_threads=None, split_bases=None, no_filter=False, blastall=False):
+    '''Chooses the number of threads per BLAST job and the number of query
+       bases in each job (split_bases) that should finish the whole array
+       soonest. slots = number of CPUs that the jobs can use at once.
+       total_memory = memory in GB that the jobs can use at once (default
+       no limit). reference_size is in bytes, and database_size is the size
+       of the formatted database (see memory.database_size). If split_bases
+       is given, only the number of threads is chosen.
+       Returns a dict with keys threads, split_bases, chunks,
+       parallel_jobs, job_memory and seconds (the estimated total run time)'''
+    if slots < 1:
+        raise Error('Number of slots must be at least 1. Got ' + str(slots))
+
+    try:
+        seconds_per_base = chunker.blast_type_base_cost[blast_type] * max(1, reference_size / 1000000) / blastn_bases_per_second
+    except KeyError:
+        raise Error('No speed estimate known for blast type: ' + blast_type)
+
+    query_bases = max(1, query_bases)
+    best = None
+
+    for threads in thread_choices:
+        if threads > slots or (max_threads is not None and threads > max_threads):
+            break
+
+        for rounds in range(1, max_rounds + 1):
+            if split_bases is None:
+                chunk_bases = math.ceil(query_bases / (rounds * (slots // threads)))
+                chunk_bases = min(max_split_bases, max(min_split_bases, chunk_bases))
+            else:
+                chunk_bases = split_bases
+
+            mem = job_memory(chunk_bases, threads, database_size, blast_type, no_filter=no_filter, blastall=blastall)
+            parallel_jobs = slots // threads
+            if total_memory is not None:
+                parallel_jobs = min(parallel_jobs, int(total_memory / mem))
+            if parallel_jobs < 1:
+                continue
+
+            chunks = math.ceil(query_bases / chunk_bases)
+            seconds = math.ceil(chunks / parallel_jobs) * job_seconds(chunk_bases, threads, seconds_per_base)
+            candidate = {
+                'threads': threads,
+                'split_bases': chunk_bases,
+                'chunks': chunks,
+                'parallel_jobs': parallel_jobs,
+                'job_memory': round(mem, 3),
+                'seconds': round(seconds),
+            }
+
+            # ties go to the first one found, which has fewer threads
+            if best is None or candidate['seconds'] < best['seconds']:
+                best = candidate
+
+    if best is None:
+        raise Error('Not enough memory to run even one BLAST job. Each job needs at least ' + str(round(job_memory(min_split_bases, 1, database_size, blast_type, no_filter=no_filter, blastall=blastall), 3)) + 'GB')
+
+    return best
@@ -0,0 +1,206 @@
+import os
+import json
+import statistics
+from pyfastaq import sequences
+from farm_blast import utils
+
+class Error (Exception): pass
+
+
+# An array element is a straggler if its run time is more than this many
+# times the median run time of all the elements
+straggler_factor = 2
+
+# An array element is a memory outlier if its peak memory is more than this
+# many times the median peak memory, or if LSF killed it for using too much
+memory_outlier_factor = 2
+
+columns = [
+    'chunk',
+    'sequences',
+    'bases',
+    'hits',
+    'run_time',
+    'cpu_time',
+    'max_memory',
+    'bases_per_second',
+    'successful',
+    'straggler',
+    'memory_outlier',
+]
+
+
+def query_file_stats(filename):
+    '''Returns tuple (number of sequences, number of bases) in a file'''
+    seqs = 0
+    bases = 0
+    for seq in sequences.file_reader(filename):
+        seqs += 1
+        bases += len(seq)
+    return seqs, bases
+
+
+def count_lines(filename, block_size=1048576):
+    '''Returns number of lines in a file'''
+    total = 0
+    with open(filename, 'rb') as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            total += block.count(b'\n')
+    return total
+
+
+def _marker_run_time(index):
+    '''Returns run time in seconds of an array element, from the
+       modification times of its start and done marker files, or None if
+       they do not both exist. Used when there is no LSF report'''
+    try:
+        return round(os.path.getmtime('tmp.array.done.' + index) - os.path.getmtime('tmp.array.start.' + index), 3)
+    except OSError:
+        return None
+
+
+def chunk_rows(query_prefix='query.split', blast_prefix='tmp.array.out', lsf_prefix='tmp.array.o'):
+    '''Returns list of dicts, one per array element, with keys in columns
+       (straggler and memory_outlier are not set). The LSF report of each
+       element is lsf_prefix.N. If lsf_prefix is None, LSF reports are not
+       used, and the run time comes from the marker files.
+       Must be run from inside the output directory'''
+    rows = []
+
+    for query_file in utils.array_output_files(query_prefix):
+        index = query_file.split('.')[-1]
+        row = {x: None for x in columns}
+        row['chunk'] = int(index)
+        row['sequences'], row['bases'] = query_file_stats(query_file)
+
+        blast_file = blast_prefix + '.' + index
+        if os.path.exists(blast_file):
+            row['hits'] = count_lines(blast_file)
+
+        lsf_file = None if lsf_prefix is None else lsf_prefix + '.' + index
+        if lsf_file is not None and os.path.exists(lsf_file):
+            lsf_report = utils.parse_lsf_report(lsf_file)
+            for key in ['run_time', 'cpu_time', 'max_memory', 'successful']:
+                row[key] = lsf_report[key]
+            if lsf_report['memlimit']:
+                row['memory_outlier'] = True
+
+        if row['run_time'] is None:
+            row['run_time'] = _marker_run_time(index)
+
+        # an element killed because a speculative run finished first has
+        # a failed LSF report, but its output is complete
+        if os.path.exists('tmp.array.done.' + index):
+            row['successful'] = True
+        elif row['successful'] is None:
+            row['successful'] = False
+
+        if row['run_time']:
+            row['bases_per_second'] = round(row['bases'] / row['run_time'], 3)
+
+        rows.append(row)
+
+    return rows
+
+
+def flag_outliers(rows):
+    '''Sets the straggler and memory_outlier values of each row'''
+    run_times = [x['run_time'] for x in rows if x['run_time'] is not None]
+    memories = [x['max_memory'] for x in rows if x['max_memory'] is not None]
+    median_run_time = statistics.median(run_times) if len(run_times) else None
+    median_memory = statistics.median(memories) if len(memories) else None
+
+    for row in rows:
+        row['straggler'] = median_run_time is not None \
+                           and row['run_time'] is not None \
+                           and row['run_time'] > straggler_factor * median_run_time
+        row['memory_outlier'] = bool(row['memory_outlier']) or (
+                                median_memory is not None
+                                and row['max_memory'] is not None
+                                and row['max_memory'] > memory_outlier_factor * median_memory)
+
+
+def summarise(rows):
+    '''Returns dict summarising all the rows'''
+    run_times = [x['run_time'] for x in rows if x['run_time'] is not None]
+    memories = [x['max_memory'] for x in rows if x['max_memory'] is not None]
+    total_run_time = sum(run_times)
+    total_bases = sum([x['bases'] for x in rows])
+    return {
+        'chunks': len(rows),
+        'sequences': sum([x['sequences'] for x in rows]),
+        'bases': total_bases,
+        'hits': sum([x['hits'] for x in rows if x['hits'] is not None]),
+        'failed_chunks': [x['chunk'] for x in rows if not x['successful']],
+        'median_run_time': statistics.median(run_times) if len(run_times) else None,
+        'max_run_time': max(run_times, default=None),
+        'total_run_time': round(total_run_time, 3),
+        'bases_per_second': round(total_bases / total_run_time, 3) if total_run_time else None,
+        'median_max_memory': statistics.median(memories) if len(memories) else None,
+        'max_memory': max(memories, default=None),
+        'stragglers': [x['chunk'] for x in rows if x['straggler']],
+        'memory_outliers': [x['chunk'] for x in rows if x['memory_outlier']],
+    }
+
+
+def _tsv_value(value):
+    if value is None:
+        return '.'
+    elif value is True:
+        return '1'
+    elif value is False:
+        return '0'
+    else:
+        return str(value)
+
+
+def write_tsv(rows, filename):
+    with open(filename, 'w') as f:
+        print('#' + '\t'.join(columns), file=f)
+        for row in rows:
+            print('\t'.join([_tsv_value(row[x]) for x in columns]), file=f)
+
+
+def write_json(rows, summary, filename):
+    with open(filename, 'w') as f:
+        json.dump({'summary': summary, 'chunks': rows}, f, indent=2, sort_keys=True)
+        print(file=f)
+
+
+def print_summary(summary, f):
+    def fmt(value):
+        return 'NA' if value is None else str(value)
+
+    def fmt_list(values):
+        return ','.join([str(x) for x in values]) if len(values) else 'none'
+
+    print('Chunks:', summary['chunks'], file=f)
+    print('Query sequences:', summary['sequences'], file=f)
+    print('Query bases:', summary['bases'], file=f)
+    print('Hits:', summary['hits'], file=f)
+    print('Failed chunks:', fmt_list(summary['failed_chunks']), file=f)
+    print('Median/max run time (s):', fmt(summary['median_run_time']), fmt(summary['max_run_time']), file=f)
+    print('Bases per second:', fmt(summary['bases_per_second']), file=f)
+    print('Median/max peak memory (MB):', fmt(summary['median_max_memory']), fmt(summary['max_memory']), file=f)
+    print('Stragglers (run time >', straggler_factor, 'x median):', fmt_list(summary['stragglers']), file=f)
+    print('Memory outliers (peak memory >', memory_outlier_factor, 'x median, or killed):', fmt_list(summary['memory_outliers']), file=f)
+
+
+def chunk_report(outprefix, f=None, work_queue=False):
+    '''Makes the per-chunk report of the array, writing outprefix.tsv and
+       outprefix.json. Prints a summary to filehandle f, if given.
+       If work_queue is True, the chunks were run by queue workers, so the
+       LSF report tmp.array.o.N is of worker N, not chunk N. Then the cpu
+       time and memory of each chunk are not known.
+       Must be run from inside the output directory. Returns the summary dict'''
+    rows = chunk_rows(lsf_prefix=None if work_queue else 'tmp.array.o')
+    flag_outliers(rows)
+    summary = summarise(rows)
+    write_tsv(rows, outprefix + '.tsv')
+    write_json(rows, summary, outprefix + '.json')
+    if f is not None:
+        print_summary(summary, f)
+    return summary
@@ -0,0 +1,199 @@
+import os
+from pyfastaq import sequences, utils as fastaq_utils
+from farm_blast import utils
+
+class Error (Exception): pass
+
+
+def shard_filename(shard, prefix='reference.shard'):
+    return prefix + '.' + str(shard) + '.fa'
+
+
+def array_index(chunk, shard, db_shards):
+    '''Returns the array index of the job that blasts query chunk number
+       chunk against database shard number shard (both counting from 1)'''
+    return (chunk - 1) * db_shards + shard
+
+
+def make_shards(reference, db_shards, prefix='reference.shard'):
+    '''Splits the sequences in the FASTA file reference into db_shards
+       files, called shard_filename(1, prefix) ... shard_filename(db_shards, prefix).
+       Sequences are not split. Each sequence goes into the file with the
+       fewest bases so far, longest sequences first, so that the shards
+       are about the same size. Returns the total number of
+       bases (or amino acids) in the reference'''
+    lengths = []
+    for seq in sequences.file_reader(reference):
+        lengths.append(len(seq))
+
+    if len(lengths) < db_shards:
+        raise Error('Cannot split reference into ' + str(db_shards) + ' shards, because it only has ' + str(len(lengths)) + ' sequences')
+
+    shard_sizes = [0] * db_shards
+    seq_to_shard = [None] * len(lengths)
+    for i in sorted(range(len(lengths)), key=lambda x: -lengths[x]):
+        shard = min(range(db_shards), key=lambda x: shard_sizes[x])
+        seq_to_shard[i] = shard
+        shard_sizes[shard] += lengths[i]
+
+    files = [fastaq_utils.open_file_write(shard_filename(i + 1, prefix=prefix)) for i in range(db_shards)]
+    for i, seq in enumerate(sequences.file_reader(reference)):
+        print(seq, file=files[seq_to_shard[i]])
+    for f in files:
+        fastaq_utils.close(f)
+
+    return sum(lengths)
+
+
+def expand_query_chunks(db_shards, query_prefix='query.split', chunk_prefix='query.chunk'):
+    '''Renames each query chunk query_prefix.N to chunk_prefix.N, and makes
+       one link to it for each database shard, called query_prefix.I,
+       where I = array_index(N, shard, db_shards). Then the array element
+       with index I blasts the right query chunk. Must be run from inside
+       the output directory. Returns the number of array elements'''
+    chunks = []
+    for filename in os.listdir('.'):
+        if filename.startswith(query_prefix + '.') and filename[len(query_prefix) + 1:].isdigit():
+            chunks.append(int(filename[len(query_prefix) + 1:]))
+
+    for chunk in sorted(chunks):
+        os.rename(query_prefix + '.' + str(chunk), chunk_prefix + '.' + str(chunk))
+
+    for chunk in chunks:
+        for shard in range(1, db_shards + 1):
+            os.symlink(chunk_prefix + '.' + str(chunk), query_prefix + '.' + str(array_index(chunk, shard, db_shards)))
+
+    return len(chunks) * db_shards
+
+
+def _query_names(query_file):
+    f = fastaq_utils.open_file_read(query_file)
+    for line in f:
+        if line.startswith('>'):
+            yield line[1:].split()[0]
+    fastaq_utils.close(f)
+
+
+class _ShardOutput:
+    def __init__(self, blast_file):
+        '''Reads the blast output of one shard, one query at a time'''
+        self.f = fastaq_utils.open_file_read(blast_file)
+        self._next()
+
+
+    def _next(self):
+        '''Sets self.fields to the fields of the next hit, or None at the
+           end of the file'''
+        for line in self.f:
+            if '\t' in line:
+                self.fields = line.split()
+                return
+        self.fields = None
+
+
+    def query_hits(self, name):
+        '''Returns list of the fields of the hits of query name that are
+           next in the file'''
+        hits = []
+        while self.fields is not None and self.fields[0] == name:
+            hits.append(self.fields)
+            self._next()
+        return hits
+
+
+    def remaining_hits(self):
+        while self.fields is not None:
+            yield self.fields
+            self._next()
+
+
+    def close(self):
+        fastaq_utils.close(self.f)
+
+
+def _subject_order_lines(subjects):
+    '''Takes dict of subject name -> list of fields of hits of one query.
+       Returns list of lines, with the subjects ordered by their best
+       evalue (and then bit score)'''
+    lines = []
+    for subject in sorted(subjects, key=lambda x: min([(float(hit[10]), -float(hit[11])) for hit in subjects[x]])):
+        lines.extend(['\t'.join(hit) for hit in subjects[subject]])
+    return lines
+
+
+def merge_shard_outputs(blast_files, query_file):
+    '''Iterates over the lines of the blast output of one query chunk
+       against each of the database shards, in the order that blast would
+       write them for the whole database: queries in the same order as
+       query_file, then within each query the subjects ordered by their
+       best evalue (and then bit score). HSPs of each subject stay in
+       the order blast wrote them. Blast writes the hits of each query
+       together, in the order of query_file, so only the hits of one query
+       are in memory at a time'''
+    outputs = [_ShardOutput(x) for x in blast_files]
+    try:
+        for name in _query_names(query_file):
+            subjects = {}
+            for output in outputs:
+                for hit in output.query_hits(name):
+                    subjects.setdefault(hit[1], []).append(hit)
+            yield from _subject_order_lines(subjects)
+
+        # hits of queries not found in query_file go at the end
+        leftovers = {}
+        for output in outputs:
+            for hit in output.remaining_hits():
+                leftovers.setdefault(hit[0], {}).setdefault(hit[1], []).append(hit)
+        for name in sorted(leftovers):
+            yield from _subject_order_lines(leftovers[name])
+    finally:
+        for output in outputs:
+            output.close()
+
+
+class _LinesFile:
+    def __init__(self, lines):
+        '''Read only file-like object of an iterator of lines without
+           newline characters, for utils.fix_blast_coords'''
+        self.lines = lines
+
+
+    def readlines(self, hint=-1):
+        lines = []
+        size = 0
+        for line in self.lines:
+            lines.append(line + '\n')
+            size += len(line) + 1
+            if 0 < hint <= size:
+                break
+        return lines
+
+
+    def read(self):
+        return ''.join(self.readlines())
+
+
+    def close(self):
+        self.lines.close()
+
+
+def merged_chunks(db_shards, blast_prefix='tmp.array.out', query_prefix='query.split'):
+    '''Returns list of one file-like object for each query chunk, which
+       has the merged output of that chunk against all the shards (see
+       merge_shard_outputs). The output of array element I is
+       blast_prefix.I, and its query is query_prefix.I. Must be run
+       from inside the output directory'''
+    elements = len(utils.array_output_files(query_prefix))
+    if elements % db_shards != 0:
+        raise Error('Number of array elements (' + str(elements) + ') is not a multiple of the number of database shards (' + str(db_shards) + ')')
+
+    missing = [str(i) for i in range(1, elements + 1) if not os.path.exists(blast_prefix + '.' + str(i))]
+    if len(missing):
+        raise Error('Blast output missing for array elements: ' + ','.join(missing))
+
+    # nothing is read until each file-like object is used
+    chunks = []
+    for i in range(1, elements + 1, db_shards):
+        blast_files = [blast_prefix + '.' + str(j) for j in range(i, i + db_shards)]
+        chunks.append(_LinesFile(merge_shard_outputs(blast_files, query_prefix + '.' + str(i))))
+    return chunks
@@ -0,0 +1,210 @@
+import os
+import heapq
+from pyfastaq import utils as fastaq_utils
+from farm_blast import utils
+
+class Error (Exception): pass
+
+
+# Maximum number of lines of blast output held in memory when sorting. More
+# lines than this are sorted in runs, which are written to temporary files
+# and then merged
+sort_max_lines = 500000
+
+# Maximum number of files merged at once. More files than this are merged
+# in groups first, to limit the number of open files
+merge_fan_in = 100
+
+# Number of lines written at once when merging
+merge_write_lines = 10000
+
+
+def _query_key(line):
+    return line.split('\t', 1)[0]
+
+
+def _query_ref_key(line):
+    return tuple(line.split('\t', 2)[:2])
+
+
+def _query_ref_coords_key(line):
+    fields = line.split('\t', 10)
+    return (fields[0], fields[1], int(fields[6]), int(fields[7]), int(fields[8]), int(fields[9]))
+
+
+# Ways of sorting blast output. query_ref_coords sorts by query name,
+# reference name, query start and end, then reference start and end.
+# With --act there is only one query and one reference sequence, so it
+# sorts the hits by position in the query, as ACT wants
+sort_keys = {
+    'query': _query_key,
+    'query_ref': _query_ref_key,
+    'query_ref_coords': _query_ref_coords_key,
+}
+
+
+def get_key(sort_order):
+    try:
+        return sort_keys[sort_order]
+    except KeyError:
+        raise Error('Unknown sort order: ' + str(sort_order))
+
+
+def _write_lines(lines, filename):
+    f = fastaq_utils.open_file_write(filename)
+    f.write(''.join(lines))
+    fastaq_utils.close(f)
+
+
+def _merge(infiles, outfile, key, stages=None, index_file=None):
+    '''Merges files of lines already sorted by key into outfile. Lines with
+       the same key are kept in the order of infiles. If stages are given,
+       the merged lines are passed through them before writing.
+       See utils.open_output_file for index_file'''
+    filehandles = [fastaq_utils.open_file_read(x) for x in infiles]
+    fout = utils.open_output_file(outfile, index_file=index_file)
+    batch = []
+
+    def write_batch():
+        if stages:
+            fout.write(utils.lines_to_string(utils._run_stages([x.rstrip('\n') for x in batch], stages)))
+        else:
+            fout.write(''.join(batch))
+
+    for line in heapq.merge(*filehandles, key=key):
+        batch.append(line)
+        if len(batch) >= merge_write_lines:
+            write_batch()
+            batch = []
+
+    write_batch()
+    if stages:
+        for i, stage in enumerate(stages):
+            fout.write(utils.lines_to_string(utils._run_stages(stage.finish(), stages[i + 1:])))
+    fastaq_utils.close(fout)
+    for f in filehandles:
+        fastaq_utils.close(f)
+
+
+def merge_sorted_files(infiles, outfile, sort_order, tmp_prefix=None, fan_in=None, stages=None, index_file=None):
+    '''Merges files of blast output that are each already sorted into one
+       sorted file. If there are more than fan_in files, they are merged in
+       groups first, making temporary files called tmp_prefix.*. stages
+       and index_file are used for the final merge'''
+    key = get_key(sort_order)
+    if fan_in is None:
+        fan_in = merge_fan_in
+    if fan_in < 2:
+        raise Error('Cannot merge fewer than 2 files at once')
+    if tmp_prefix is None:
+        tmp_prefix = outfile + '.tmp'
+
+    files = list(infiles)
+    temporary_files = set()
+    level = 0
+
+    while len(files) > fan_in:
+        merged_files = []
+        for i in range(0, len(files), fan_in):
+            merged = tmp_prefix + '.merge.' + str(level) + '.' + str(len(merged_files))
+            _merge(files[i:i + fan_in], merged, key)
+            merged_files.append(merged)
+            for filename in files[i:i + fan_in]:
+                if filename in temporary_files:
+                    os.unlink(filename)
+
+        files = merged_files
+        temporary_files = set(merged_files)
+        level += 1
+
+    _merge(files, outfile, key, stages=stages, index_file=index_file)
+    for filename in files:
+        if filename in temporary_files:
+            os.unlink(filename)
+
+
+def sort_blast_file(infile, outfile, sort_order, coords_offset=None, stages=None, tmp_prefix=None, max_lines=None):
+    '''Sorts a file of blast output, holding at most max_lines lines in
+       memory. If coords_offset is given, the coordinates are fixed first
+       (see utils.fix_blast_line_list). stages are applied to the lines
+       after fixing, as in utils.fix_blast_coords'''
+    key = get_key(sort_order)
+    if stages is None:
+        stages = []
+    if max_lines is None:
+        max_lines = sort_max_lines
+    if tmp_prefix is None:
+        tmp_prefix = outfile + '.tmp'
+
+    runs = []
+    buffer = []
+
+    def add_lines(lines):
+        nonlocal buffer
+        buffer.extend([x + '\n' for x in lines])
+        if len(buffer) >= max_lines:
+            buffer.sort(key=key)
+            runs.append(tmp_prefix + '.run.' + str(len(runs)))
+            _write_lines(buffer, runs[-1])
+            buffer = []
+
+    fin = fastaq_utils.open_file_read(infile)
+    while True:
+        lines = fin.readlines(utils.fix_coords_read_size)
+        if not lines:
+            break
+        if coords_offset is not None:
+            lines = utils.fix_blast_line_list(lines, coords_offset)
+        else:
+            lines = [x.rstrip('\n') for x in lines if '\t' in x]
+        add_lines(utils._run_stages(lines, stages))
+    fastaq_utils.close(fin)
+
+    for i, stage in enumerate(stages):
+        add_lines(utils._run_stages(stage.finish(), stages[i + 1:]))
+
+    buffer.sort(key=key)
+    if len(runs) == 0:
+        _write_lines(buffer, outfile)
+    else:
+        if len(buffer):
+            runs.append(tmp_prefix + '.run.' + str(len(runs)))
+            _write_lines(buffer, runs[-1])
+        buffer = []
+        merge_sorted_files(runs, outfile, sort_order, tmp_prefix=tmp_prefix)
+        for filename in runs:
+            os.unlink(filename)
+
+
+def sort_chunk(index, sort_order, stages=None):
+    '''Fixes the coordinates of the blast output of one array element and
+       sorts it, writing tmp.array.sorted.index. Only the coords of the
+       sequences in that element's query file are loaded (see
+       utils.chunk_coords_offset). Must be run from inside the output
+       directory'''
+    index = str(index)
+    coords_offset = utils.chunk_coords_offset(index)
+    outfile = 'tmp.array.sorted.' + index
+    tmp_file = outfile + '.tmp'
+    sort_blast_file('tmp.array.out.' + index, tmp_file, sort_order, coords_offset=coords_offset, stages=stages, tmp_prefix='tmp.array.sort_tmp.' + index)
+    # the output only appears when complete, so that the combine job
+    # can tell which elements still need sorting
+    os.rename(tmp_file, outfile)
+
+
+def merge_chunks(sort_order, outfile, stages_factory=None, stages=None, index_file=None):
+    '''Merges the sorted output of all the array elements into outfile.
+       Any element without sorted output is sorted first. stages_factory
+       is a function that returns a new list of stages for each element
+       that needs sorting. stages are applied to the merged lines, and
+       index_file is passed to utils.open_output_file.
+       Must be run from inside the output directory'''
+    sorted_files = []
+    for blast_file in utils.array_output_files('tmp.array.out'):
+        index = blast_file.split('.')[-1]
+        sorted_file = 'tmp.array.sorted.' + index
+        if not os.path.exists(sorted_file):
+            sort_chunk(index, sort_order, stages=None if stages_factory is None else stages_factory())
+        sorted_files.append(sorted_file)
+
+    merge_sorted_files(sorted_files, outfile, sort_order, tmp_prefix='tmp.array.merge_tmp', stages=stages, index_file=index_file)
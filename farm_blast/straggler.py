@@ -0,0 +1,313 @@
+import os
+import time
+import shutil
+import statistics
+import subprocess
+from farmpy import lsf
+from pyfastaq import sequences
+from pyfastaq import utils as fastaq_utils
+from farm_blast import utils
+
+class Error (Exception): pass
+
+
+# Only look for stragglers when at least this fraction of the array
+# elements have finished, so that the median run time means something
+min_finished_fraction = 0.75
+
+# An element that has been running for more than this many times the
+# median run time of the finished elements is a straggler
+straggler_factor = 2
+
+# Do not bother with elements that have been running for less than this
+# many seconds, however quick the others were
+min_straggler_seconds = 60
+
+# Number of pieces the unfinished query sequences of a straggler are split into
+sub_chunks = 4
+
+poll_seconds = 30
+
+
+def spec_name(filename, index, sub_index):
+    '''Returns name of file used by a speculative run of part of array
+       element index. eg ('tmp.array.out', 3, 2) -> tmp.array.out.3.spec.2'''
+    return filename + '.' + str(index) + '.spec.' + str(sub_index)
+
+
+def finished_queries(blast_file):
+    '''Reads the output of a blast run that may not have finished yet.
+       blast writes the hits of each query together, in the same order as
+       the query file, so all queries except the last one in the file are
+       finished. Returns tuple (set of finished query names, number of bytes
+       at the start of the file that contain their hits)'''
+    finished = set()
+    current_query = None
+    current_start = 0
+    offset = 0
+
+    with open(blast_file, 'rb') as f:
+        for line in f:
+            # the last line may be half written
+            if not line.endswith(b'\n'):
+                break
+
+            query = line.split(b'\t', 1)[0]
+            if query != current_query:
+                if current_query is not None:
+                    finished.add(current_query.decode())
+                current_query = query
+                current_start = offset
+
+            offset += len(line)
+
+    return finished, current_start
+
+
+def split_unfinished_queries(query_file, finished, outfiles, number_of_files):
+    '''Writes the sequences in query_file whose names are not in the set
+       finished to files outfiles(1), outfiles(2), ..., with about the same
+       number of bases in each, keeping the sequences in the same order.
+       outfiles is a function that returns a filename from a file number.
+       Returns the number of files written'''
+    lengths = [len(seq) for seq in sequences.file_reader(query_file) if seq.id not in finished]
+    if len(lengths) == 0:
+        return 0
+
+    bases_per_file = sum(lengths) / min(number_of_files, len(lengths))
+    file_number = 0
+    f = None
+    cumulative_bases = 0
+
+    for seq in sequences.file_reader(query_file):
+        if seq.id in finished:
+            continue
+
+        wanted_file = min(number_of_files, 1 + int(cumulative_bases / bases_per_file))
+        cumulative_bases += len(seq)
+
+        if wanted_file != file_number:
+            if f is not None:
+                fastaq_utils.close(f)
+            file_number += 1
+            f = fastaq_utils.open_file_write(outfiles(file_number))
+
+        print(seq, file=f)
+
+    fastaq_utils.close(f)
+    return file_number
+
+
+def _touch(filename):
+    with open(filename, 'w'):
+        pass
+
+
+class Watcher:
+    def __init__(self, runner, chunks=None, sub_chunks=sub_chunks, poll_seconds=poll_seconds):
+        '''Watches the elements of the blast job array. Splits the unfinished
+           query sequences of stragglers into sub_chunks pieces, which runner
+           blasts in parallel. Whichever of the original run and the
+           speculative runs finish first are used. Must be run from inside
+           the output directory. chunks = number of array elements (default
+           is the number of query.split.N files).
+           runner must have these methods:
+             run(index, number_of_pieces): start the pieces of element index
+             kill(index): kill the original run of element index
+             kill_speculative(index): kill the pieces of element index'''
+        self.runner = runner
+        self.chunks = len(utils.array_output_files('query.split')) if chunks is None else chunks
+        self.sub_chunks = sub_chunks
+        self.poll_seconds = poll_seconds
+        self.speculating = {}
+        self.speculated = set()
+        self.won = set()
+
+
+    def _done(self, index):
+        return os.path.exists('tmp.array.done.' + str(index))
+
+
+    def _failed(self, lsf_file):
+        return os.path.exists(lsf_file) and utils.parse_lsf_report(lsf_file)['successful'] is False
+
+
+    def _run_time(self, index, now):
+        '''Returns how long element index has run (or did run) in seconds, or
+           None if it has not started'''
+        try:
+            start = os.path.getmtime('tmp.array.start.' + str(index))
+        except OSError:
+            return None
+
+        if self._done(index):
+            return os.path.getmtime('tmp.array.done.' + str(index)) - start
+        else:
+            return now - start
+
+
+    def stragglers(self, now):
+        '''Returns list of indexes of elements that are running much longer
+           than the median of the elements that have finished'''
+        indexes = range(1, self.chunks + 1)
+        finished = [i for i in indexes if self._done(i) and i not in self.won]
+        if len(finished) == 0 or len(finished) < min_finished_fraction * self.chunks:
+            return []
+
+        median = statistics.median([self._run_time(i, now) for i in finished])
+        limit = max(min_straggler_seconds, straggler_factor * median)
+        stragglers = []
+
+        for i in indexes:
+            if i in self.speculated or self._done(i):
+                continue
+            run_time = self._run_time(i, now)
+            if run_time is not None and run_time > limit:
+                stragglers.append(i)
+
+        return stragglers
+
+
+    def speculate(self, index):
+        '''Starts speculative runs of the unfinished query sequences of
+           element index. Returns the number of pieces started'''
+        self.speculated.add(index)
+        blast_file = 'tmp.array.out.' + str(index)
+        if os.path.exists(blast_file):
+            finished, prefix_bytes = finished_queries(blast_file)
+        else:
+            finished, prefix_bytes = set(), 0
+
+        pieces = split_unfinished_queries(
+            'query.split.' + str(index),
+            finished,
+            lambda x: spec_name('query.split', index, x),
+            self.sub_chunks
+        )
+
+        if pieces == 0:
+            return 0
+
+        # keep the hits of the finished queries, so the speculative output
+        # can be put together without needing the original output file
+        with open(spec_name('tmp.array.out', index, 0), 'wb') as f_out:
+            if prefix_bytes > 0:
+                with open(blast_file, 'rb') as f_in:
+                    f_out.write(f_in.read(prefix_bytes))
+
+        self.speculating[index] = pieces
+        self.runner.run(index, pieces)
+        return pieces
+
+
+    def _speculation_status(self, index):
+        '''Returns "done", "failed" or "running"'''
+        pieces = range(1, self.speculating[index] + 1)
+        if all([os.path.exists(spec_name('tmp.array.done', index, i)) for i in pieces]):
+            return 'done'
+        elif any([self._failed(spec_name('tmp.array.o', index, i)) for i in pieces]):
+            return 'failed'
+        else:
+            return 'running'
+
+
+    def _use_speculative_output(self, index):
+        '''Puts the speculative output of element index together, and
+           replaces the original output file with it'''
+        tmp_file = spec_name('tmp.array.out', index, 'tmp')
+        with open(tmp_file, 'wb') as f_out:
+            for i in range(self.speculating[index] + 1):
+                with open(spec_name('tmp.array.out', index, i), 'rb') as f_in:
+                    shutil.copyfileobj(f_in, f_out)
+
+        # the original run still has the old file open, so
+        # renaming means it cannot write into the new one
+        os.rename(tmp_file, 'tmp.array.out.' + str(index))
+        _touch('tmp.array.done.' + str(index))
+        self.won.add(index)
+
+
+    def step(self, now=None):
+        '''Checks on all the array elements once. Returns True if every
+           element has finished'''
+        if now is None:
+            now = time.time()
+
+        for index in sorted(self.speculating):
+            if self._done(index):
+                self.runner.kill_speculative(index)
+            else:
+                status = self._speculation_status(index)
+                if status == 'done':
+                    self._use_speculative_output(index)
+                    self.runner.kill(index)
+                elif status == 'failed':
+                    self.runner.kill_speculative(index)
+                else:
+                    continue
+
+            del self.speculating[index]
+
+        unfinished = [i for i in range(1, self.chunks + 1) if not self._done(i)]
+        if len(unfinished) == 0:
+            return True
+
+        for index in unfinished:
+            if index not in self.speculating and self._failed('tmp.array.o.' + str(index)):
+                raise Error('Array element ' + str(index) + ' failed')
+
+        for index in self.stragglers(now):
+            self.speculate(index)
+
+        return False
+
+
+    def run(self):
+        '''Watches the array until every element has finished'''
+        while not self.step():
+            time.sleep(self.poll_seconds)
+
+        print('Array elements finished using speculative runs:', len(self.won))
+
+
+class LsfRunner:
+    def __init__(self, array_id, queue, mem, name_prefix, memory_units=None, threads=1):
+        '''Runs the speculative pieces of array elements as LSF job arrays'''
+        self.array_id = array_id
+        self.threads = threads
+        self.queue = queue
+        self.mem = mem
+        self.name_prefix = name_prefix
+        self.memory_units = memory_units
+        self.job_ids = {}
+
+
+    def run(self, index, pieces):
+        # farmpy adds .INDEX to the names of the stdout and stderr files
+        job = lsf.Job(
+            'tmp.array.o.' + str(index) + '.spec',
+            'tmp.array.e.' + str(index) + '.spec',
+            self.name_prefix + '.spec.' + str(index),
+            self.queue,
+            self.mem,
+            'bash 02.array_task.sh ' + str(index) + '.spec.INDEX',
+            array_start=1,
+            array_end=pieces,
+            memory_units=self.memory_units,
+            threads=self.threads,
+        )
+        job.run()
+        self.job_ids[index] = job.job_id
+
+
+    def _bkill(self, job):
+        subprocess.call('bkill "' + job + '"', shell=True)
+
+
+    def kill(self, index):
+        self._bkill(str(self.array_id) + '[' + str(index) + ']')
+
+
+    def kill_speculative(self, index):
+        if index in self.job_ids:
+            self._bkill(str(self.job_ids[index]))
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+
+import os
+import shutil
+import unittest
+from farm_blast import api
+
+modules_dir = os.path.dirname(os.path.abspath(api.__file__))
+data_dir = os.path.join(modules_dir, 'tests', 'data')
+
+# Stand-in for blastn, which reads the query from stdin and writes one hit
+# per query sequence, from position 2 to the end, to stdout
+fake_blastn = r'''#!/usr/bin/env python3
+import sys
+args = sys.argv[1:]
+assert args[args.index('-query') + 1] == '-'
+assert args[args.index('-out') + 1] == '-'
+name = None
+length = 0
+def hit():
+    if name is not None:
+        print(name, 'ref1', '100.00', length - 1, 0, 0, 2, length, 1, length - 1, '1e-10', 42.5, sep='\t', flush=True)
+for line in sys.stdin:
+    if line.startswith('>'):
+        hit()
+        name = line[1:].rstrip()
+        length = 0
+    else:
+        length += len(line.rstrip())
+hit()
+'''
+
+fake_makeblastdb = r'''#!/bin/bash
+while [ $# -gt 0 ]; do if [ "$1" = "-in" ]; then f=$2; fi; shift; done
+touch $f.nhr $f.nin $f.nsq
+'''
+
+
+class TestApi(unittest.TestCase):
+    def setUp(self):
+        self.original_dir = os.getcwd()
+        self.tmp_dir = os.path.abspath('tmp.api_test')
+        os.mkdir(self.tmp_dir)
+        os.chdir(self.tmp_dir)
+        os.mkdir('bin')
+        for name, script in [('blastn', fake_blastn), ('makeblastdb', fake_makeblastdb)]:
+            with open(os.path.join('bin', name), 'w') as f:
+                print(script, file=f)
+            os.chmod(os.path.join('bin', name), 0o755)
+        self.original_path = os.environ['PATH']
+        os.environ['PATH'] = os.path.join(self.tmp_dir, 'bin') + ':' + self.original_path
+
+        with open('query.fa', 'w') as f:
+            print('>seq1 description', 'ACGT' * 5, '>seq2', 'ACGT' * 20, sep='\n', file=f)
+
+
+    def tearDown(self):
+        os.environ['PATH'] = self.original_path
+        os.chdir(self.original_dir)
+        shutil.rmtree(self.tmp_dir)
+
+
+    def test_hit_from_line(self):
+        '''test Hit.from_line'''
+        hit = api.Hit.from_line('q\tr\t99.5\t10\t1\t0\t1\t10\t11\t20\t1e-5\t20.1\n')
+        self.assertEqual(api.Hit('q', 'r', 99.5, 10, 1, 0, 1, 10, 11, 20, 1e-5, 20.1), hit)
+        self.assertEqual(10, hit.qend)
+        with self.assertRaises(api.Error):
+            api.Hit.from_line('q\tr\t99.5\n')
+
+
+    def test_read_hits(self):
+        '''test read_hits'''
+        hits = list(api.read_hits(os.path.join(data_dir, 'pipeline_test.blast.out')))
+        self.assertGreater(len(hits), 0)
+        self.assertTrue(all(isinstance(x.bitscore, float) for x in hits))
+
+
+    def test_local_hits(self):
+        '''test local_hits splits the query and fixes coordinates'''
+        hits = list(api.local_hits(os.path.join(data_dir, 'pipeline_test.ref.fa'), 'query.fa', split_bases=30, split_bases_tolerance=5))
+        self.assertEqual([
+            ('seq1', 2, 20),
+            ('seq2', 2, 30),
+            ('seq2', 32, 60),
+            ('seq2', 62, 80),
+        ], [(x.qseqid, x.qstart, x.qend) for x in hits])
+        self.assertEqual(['bin', 'query.fa'], sorted(os.listdir('.')))
+
+
+    def test_local_hits_bad_query(self):
+        '''test local_hits raises an error, instead of hanging, when the query cannot be read'''
+        hits = api.local_hits(os.path.join(data_dir, 'pipeline_test.ref.fa'), 'does_not_exist.fa')
+        with self.assertRaises(api.Error):
+            list(hits)
+        self.assertEqual(['bin', 'query.fa'], sorted(os.listdir('.')))
+
+
+    def test_farm_hits_error(self):
+        '''test farm_hits goes back to the original directory when the pipeline fails'''
+        # a directory where the setup script should be makes the pipeline fail
+        os.makedirs(os.path.join('out', '01.setup.sh'))
+        hits = api.farm_hits(os.path.join(data_dir, 'pipeline_test.ref.fa'), 'query.fa', options=['--no_bsub', '--resume', '--outdir', 'out'])
+        with self.assertRaises(api.Error):
+            list(hits)
+        self.assertEqual(self.tmp_dir, os.getcwd())
+
+
+    def test_local_hits_stop_early(self):
+        '''test local_hits when the caller does not use all the hits'''
+        hits = api.local_hits(os.path.join(data_dir, 'pipeline_test.ref.fa'), 'query.fa', split_bases=30, split_bases_tolerance=5)
+        self.assertEqual('seq1', next(hits).qseqid)
+        hits.close()
+        self.assertEqual(['bin', 'query.fa'], sorted(os.listdir('.')))
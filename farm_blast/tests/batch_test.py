@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+
+import os
+import gzip
+import unittest
+from farm_blast import batch, bgzf
+
+modules_dir = os.path.dirname(os.path.abspath(batch.__file__))
+data_dir = os.path.join(modules_dir, 'tests', 'data')
+
+
+class TestBatch(unittest.TestCase):
+    def test_batch_files(self):
+        '''Test reading list of query files, and writing and loading batch file'''
+        query_list = 'tmp.batch_test.list'
+        batch_file = 'tmp.batch_test.tsv'
+        query_files = [os.path.join(data_dir, x) for x in ['dedup_test.fa', 'chunker_test.fa']]
+        with open(query_list, 'w') as f:
+            print(query_files[0], '', query_files[1], sep='\n', file=f)
+        self.assertEqual(query_files, batch.read_query_list(query_list))
+
+        batch.write_batch_file(query_files, batch_file)
+        expected = {1: (query_files[0], 'batch.1.blast.out.gz'), 2: (query_files[1], 'batch.2.blast.out.gz')}
+        self.assertEqual(expected, batch.load_batch_file(batch_file))
+
+        with open(query_list, 'w') as f:
+            print('notafile', file=f)
+        with self.assertRaises(batch.Error):
+            batch.read_query_list(query_list)
+        open(query_list, 'w').close()
+        with self.assertRaises(batch.Error):
+            batch.read_query_list(query_list)
+        os.unlink(query_list)
+        os.unlink(batch_file)
+
+
+    def test_make_batch_query(self):
+        '''Test make_batch_query'''
+        batch_file = 'tmp.batch_test.tsv'
+        outfile = 'tmp.batch_test.fa'
+        query_file = 'tmp.batch_test.in.fa'
+        with open(query_file, 'w') as f:
+            print('>seq1 description', 'ACGT', '>seq2', 'GGGG', sep='\n', file=f)
+        batch.write_batch_file([query_file, query_file], batch_file)
+        self.assertEqual(4, batch.make_batch_query(batch_file, outfile))
+        with open(outfile) as f:
+            got = f.read()
+        self.assertEqual('>batch1.seq1\nACGT\n>batch1.seq2\nGGGG\n>batch2.seq1\nACGT\n>batch2.seq2\nGGGG\n', got)
+        for filename in [batch_file, outfile, query_file]:
+            os.unlink(filename)
+
+
+    def test_demultiplexer(self):
+        '''Test Demultiplexer writes hits of each query file to its own indexed file'''
+        batch_file = 'tmp.batch_test.tsv'
+        batch.write_batch_file(['a.fa', 'b.fa', 'c.fa'], batch_file)
+        lines = [
+            'batch1.seq1\tref1\t100.00\t10\t0\t0\t1\t10\t1\t10\t1e-5\t20',
+            'batch2.seq1\tref1\t100.00\t10\t0\t0\t1\t10\t1\t10\t1e-5\t20',
+            'batch1.seq.2\tref2\t100.00\t10\t0\t0\t1\t10\t1\t10\t1e-5\t20',
+        ]
+        demux = batch.Demultiplexer(batch_file)
+        self.assertEqual([], demux.process(lines[:2]))
+        self.assertEqual([], demux.process(lines[2:]))
+        self.assertEqual([], demux.finish())
+
+        expected = {
+            1: [lines[0][7:], lines[2][7:]],
+            2: [lines[1][7:]],
+            3: [],
+        }
+        for i in expected:
+            output_file = batch.output_filename(i)
+            with gzip.open(output_file, 'rt') as f:
+                self.assertEqual(expected[i], [x.rstrip('\n') for x in f])
+            reader = bgzf.Reader(output_file)
+            self.assertEqual(expected[i][:1], reader.hits('seq1'))
+            reader.close()
+            os.unlink(output_file)
+            os.unlink(bgzf.index_filename(output_file))
+
+        # only one output file open at a time
+        original_max = batch.max_open_writers
+        batch.max_open_writers = 1
+        demux = batch.Demultiplexer(batch_file)
+        self.assertEqual([], demux.process(lines[:2]))
+        self.assertEqual([], demux.process(lines[2:]))
+        self.assertEqual(1, len(demux.open_writers))
+        self.assertEqual([], demux.finish())
+        batch.max_open_writers = original_max
+        for i in expected:
+            output_file = batch.output_filename(i)
+            with gzip.open(output_file, 'rt') as f:
+                self.assertEqual(expected[i], [x.rstrip('\n') for x in f])
+            reader = bgzf.Reader(output_file)
+            self.assertEqual(expected[i][:1], reader.hits('seq1'))
+            reader.close()
+            os.unlink(output_file)
+            os.unlink(bgzf.index_filename(output_file))
+
+        demux = batch.Demultiplexer(batch_file)
+        with self.assertRaises(batch.Error):
+            demux.process(['seq1\tref1'])
+        with self.assertRaises(batch.Error):
+            demux.process(['batch4.seq1\tref1'])
+        os.unlink(batch_file)
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+
+import os
+import io
+import gzip
+import random
+import subprocess
+import unittest
+from farm_blast import bgzf
+
+
+def make_lines(number):
+    rand = random.Random(42)
+    lines = []
+    for i in range(number):
+        query = 'query' + str(i // 3)
+        lines.append('\t'.join([query, 'ref' + str(rand.randint(1, 5)), '99.00', '100', '1', '0', str(i), str(i + 99), '1', '100', '1e-40', str(rand.randint(50, 200))]))
+    return lines
+
+
+class TestBgzf(unittest.TestCase):
+    def test_write_and_lookup(self):
+        '''Test block gzipped file can be read by gzip and zcat, and lookup of queries using the index'''
+        outfile = 'tmp.bgzf_test.gz'
+        index_file = bgzf.index_filename(outfile)
+        lines = make_lines(6000)
+        # query2 is in the file twice, not next to each other
+        lines.append(lines[6].replace('\t1e-40\t', '\t1e-30\t'))
+        writer = bgzf.Writer(outfile, index_file=index_file)
+        for i in range(0, len(lines), 1000):
+            writer.write('\n'.join(lines[i:i + 1000]) + '\n')
+            # the files are opened again by the next write
+            if i % 2000 == 0:
+                writer.suspend()
+        writer.close()
+        self.assertFalse(any([x.startswith('tmp.bgzf_index.') for x in os.listdir('.')]))
+
+        expected = '\n'.join(lines) + '\n'
+        with gzip.open(outfile, 'rt') as f:
+            self.assertEqual(expected, f.read())
+        self.assertEqual(expected, subprocess.check_output(['zcat', outfile]).decode())
+
+        reader = bgzf.Reader(outfile)
+        self.assertGreater(len(reader.block_offsets), 3)
+        self.assertEqual(lines[0:3], reader.hits('query0'))
+        self.assertEqual(lines[6:9] + lines[-1:], reader.hits('query2'))
+        self.assertEqual(lines[5997:6000], reader.hits('query1999'))
+        for i in random.Random(1).sample(range(1, 1999), 50):
+            self.assertEqual(lines[3 * i:3 * i + 3], reader.hits('query' + str(i)))
+        self.assertEqual([], reader.hits('query'))
+        self.assertEqual([], reader.hits('query2000'))
+        self.assertEqual([], reader.hits('a'))
+        reader.close()
+
+        fout = io.StringIO()
+        self.assertEqual(1, bgzf.lookup_hits(outfile, ['query5', 'oops', 'query1'], fout))
+        self.assertEqual('\n'.join(lines[15:18] + lines[3:6]) + '\n', fout.getvalue())
+        os.unlink(outfile)
+        os.unlink(index_file)
+
+
+    def test_empty_file(self):
+        '''Test block gzipped file with no lines'''
+        outfile = 'tmp.bgzf_test.gz'
+        index_file = bgzf.index_filename(outfile)
+        writer = bgzf.Writer(outfile, index_file=index_file)
+        writer.close()
+        with gzip.open(outfile, 'rt') as f:
+            self.assertEqual('', f.read())
+        reader = bgzf.Reader(outfile)
+        self.assertEqual([], reader.hits('query1'))
+        reader.close()
+        os.unlink(index_file)
+        with self.assertRaises(bgzf.Error):
+            bgzf.Reader(outfile)
+        os.unlink(outfile)
+
+
+    def test_concatenate(self):
+        '''Test concatenating block gzipped files and their indexes'''
+        lines = make_lines(9000)
+        # query1000 is split between the first and third files, and the
+        # second file is empty
+        parts = [lines[:3001], [], lines[3001:]]
+        infiles = []
+        for i, part in enumerate(parts):
+            infile = 'tmp.bgzf_test.' + str(i) + '.gz'
+            writer = bgzf.Writer(infile, index_file=bgzf.index_filename(infile), eof=False)
+            if len(part):
+                writer.write('\n'.join(part) + '\n')
+            writer.close()
+            infiles.append(infile)
+
+        outfile = 'tmp.bgzf_test.gz'
+        index_file = bgzf.index_filename(outfile)
+        bgzf.concatenate(infiles, outfile, index_file=index_file)
+        self.assertFalse(any([x.startswith('tmp.bgzf_index.') for x in os.listdir('.')]))
+        expected = '\n'.join(lines) + '\n'
+        self.assertEqual(expected, subprocess.check_output(['zcat', outfile]).decode())
+
+        reader = bgzf.Reader(outfile)
+        self.assertEqual(len(expected), reader.uncompressed_size)
+        self.assertEqual(lines[3000:3003], reader.hits('query1000'))
+        for i in random.Random(1).sample(range(0, 3000), 50):
+            self.assertEqual(lines[3 * i:3 * i + 3], reader.hits('query' + str(i)))
+        reader.close()
+
+        for filename in infiles + [outfile]:
+            os.unlink(filename)
+            os.unlink(bgzf.index_filename(filename))
@@ -98,6 +98,10 @@ class TestBlast(unittest.TestCase):
             blast.Blast('ref', 'qry', blastall=True, evalue=0.1),
             blast.Blast('ref', 'qry', blastall=True, word_size=42),
             blast.Blast('ref', 'qry', blastall=True, no_filter=True),
+            blast.Blast('ref', 'qry', db_size=1000000),
+            blast.Blast('ref', 'qry', blastall=True, db_size=1000000),
+            blast.Blast('ref', 'qry', threads=4),
+            blast.Blast('ref', 'qry', blastall=True, threads=4),
         ]
 
         correct = [
@@ -110,7 +114,11 @@ class TestBlast(unittest.TestCase):
             '-m 8',
             '-m 8 -e 0.1',
             '-m 8 -W 42',
-            '-m 8 -F F'
+            '-m 8 -F F',
+            '-outfmt 6 -dbsize 1000000',
+            '-m 8 -z 1000000',
+            '-outfmt 6 -num_threads 4',
+            '-m 8 -a 4',
         ]
 
         for i in range(len(correct)):
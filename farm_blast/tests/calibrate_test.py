@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+
+import sys
+import os
+import glob
+import unittest
+from pyfastaq import sequences
+from farm_blast import calibrate
+
+modules_dir = os.path.dirname(os.path.abspath(calibrate.__file__))
+data_dir = os.path.join(modules_dir, 'tests', 'data')
+
+
+class FakeBlast:
+    def __init__(self):
+        self.query = None
+        self.outfile = None
+
+    def get_run_command(self):
+        return 'cp ' + self.query + ' ' + self.outfile
+
+
+class TestCalibrate(unittest.TestCase):
+    def test_sample_query(self):
+        '''Test random sample of query made'''
+        infile = os.path.join(data_dir, 'chunker_test.fa')
+        outfile = 'tmp.sample_query_test.fa'
+        seq_count, base_count = calibrate.sample_query(infile, outfile, 15, seed=1)
+        lengths = [len(x) for x in sequences.file_reader(outfile)]
+        self.assertEqual(seq_count, len(lengths))
+        self.assertEqual(base_count, sum(lengths))
+        self.assertTrue(base_count >= 15)
+        self.assertTrue(max(lengths) <= 15)
+
+        got = calibrate.sample_query(infile, outfile, 1000, seed=1)
+        self.assertEqual((5, 100), got)
+        self.assertEqual(['allNs', 'long', 'short1', 'short2', 'short3'], sorted([x.id for x in sequences.file_reader(outfile)]))
+        os.unlink(outfile)
+
+
+    def test_split_bases_for_walltime(self):
+        '''Test split_bases calculated from blast speed'''
+        expected = int(100 * (60 * calibrate.safety_factor - 10))
+        self.assertEqual(expected, calibrate.split_bases_for_walltime(100, 10, 1))
+        self.assertEqual(calibrate.min_split_bases, calibrate.split_bases_for_walltime(1, 10, 1))
+        self.assertEqual(calibrate.max_split_bases, calibrate.split_bases_for_walltime(1000000000, 0, 60))
+
+
+    def test_calibrate_split_bases(self):
+        '''Test calibration run writes measurements'''
+        infile = os.path.join(data_dir, 'chunker_test.fa')
+        outfile = 'tmp.calibrate_split_bases_test.tsv'
+        blast_obj = FakeBlast()
+        split_bases = calibrate.calibrate_split_bases(blast_obj, infile, 1.0, outfile, seed=1)
+        self.assertIsNone(blast_obj.query)
+        self.assertTrue(calibrate.min_split_bases <= split_bases <= calibrate.max_split_bases)
+
+        with open(outfile) as f:
+            got = dict([line.rstrip().split('\t') for line in f])
+        self.assertEqual(str(split_bases), got['split_bases'])
+        self.assertEqual('100', got['sample_bases'])
+        self.assertEqual('1.0', got['target_walltime_minutes'])
+        os.unlink(outfile)
+        for filename in glob.glob('calibration.tmp.*'):
+            os.unlink(filename)
+
+
+if __name__ == '__main__':
+    unittest.main()
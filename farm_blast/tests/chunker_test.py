@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+
+import sys
+import os
+import glob
+import unittest
+from pyfastaq import sequences
+from farm_blast import blast, chunker
+
+modules_dir = os.path.dirname(os.path.abspath(chunker.__file__))
+data_dir = os.path.join(modules_dir, 'tests', 'data')
+
+class TestChunker(unittest.TestCase):
+    def test_cost_model(self):
+        '''Test cost model depends on blast type and reference size'''
+        with self.assertRaises(chunker.Error):
+            chunker.CostModel('oops', 1000)
+
+        small_ref = chunker.CostModel('blastn', 1000)
+        big_ref = chunker.CostModel('blastn', 10000000)
+        tblastx = chunker.CostModel('tblastx', 1000)
+        self.assertEqual(small_ref.cost(0), chunker.sequence_overhead_cost)
+        self.assertEqual(small_ref.cost(100), chunker.sequence_overhead_cost + 100)
+        self.assertEqual(big_ref.cost(100), chunker.sequence_overhead_cost + 1000)
+        self.assertEqual(tblastx.cost(100), chunker.sequence_overhead_cost + 3600)
+
+
+    def test_reference_size(self):
+        '''Test reference size from the reference file, or from the database when there is no file'''
+        infile = os.path.join(data_dir, 'chunker_test.fa')
+        blast_obj = blast.Blast(infile, 'query')
+        self.assertEqual(os.path.getsize(infile), chunker.reference_size(blast_obj))
+
+        prefix = 'tmp.reference_size_test'
+        blast_obj = blast.Blast(prefix, 'query')
+        with self.assertRaises(chunker.Error):
+            chunker.reference_size(blast_obj)
+        for extension in ['nhr', 'nin', 'nsq']:
+            with open(prefix + '.' + extension, 'w') as f:
+                print('x' * 9, file=f)
+        self.assertEqual(4 * 30, chunker.reference_size(blast_obj))
+        for extension in ['nhr', 'nin', 'nsq']:
+            os.unlink(prefix + '.' + extension)
+
+
+    def test_query_pieces(self):
+        '''Test sequences split into pieces the same way as fastaq chunker'''
+        infile = os.path.join(data_dir, 'chunker_test.fa')
+        got = [(seq.id, len(seq), offset) for seq, offset in chunker._query_pieces(infile, 20, 5, True)]
+        expected = [
+            ('long:1-20', 20, ('long', 0)),
+            ('long:21-40', 20, ('long', 20)),
+            ('long:41-50', 10, ('long', 40)),
+            ('short1', 10, None),
+            ('short2', 10, None),
+            ('short3', 20, None),
+        ]
+        self.assertListEqual(expected, got)
+
+        got = [(seq.id, offset) for seq, offset in chunker._query_pieces(infile, 20, 10, False)]
+        expected = [
+            ('long:1-20', ('long', 0)),
+            ('long:21-50', ('long', 20)),
+            ('short1', None),
+            ('allNs', None),
+            ('short2', None),
+            ('short3', None),
+        ]
+        self.assertListEqual(expected, got)
+
+
+    def test_chunk_query(self):
+        '''Test query split into files with balanced cost'''
+        infile = os.path.join(data_dir, 'chunker_test.fa')
+        prefix = 'tmp.chunk_query_test'
+        old_overhead = chunker.sequence_overhead_cost
+        chunker.sequence_overhead_cost = 10
+        files = chunker.chunk_query(infile, prefix, 20, 5, 'blastn', os.path.getsize(infile))
+        chunker.sequence_overhead_cost = old_overhead
+
+        # costs are 30, 30, 20, 20, 20, 30, total 150, the same as five
+        # sequences of 20 bases. So we should get five files, each
+        # containing the sequences whose midpoint cost lies in 0-30, 30-60 ...etc
+        self.assertEqual(5, files)
+        got = []
+        for i in range(1, files + 1):
+            seqs = [seq.id for seq in sequences.file_reader(prefix + '.' + str(i))]
+            got.append(seqs)
+            os.unlink(prefix + '.' + str(i))
+
+        expected = [['long:1-20'], ['long:21-40'], ['long:41-50'], ['short1', 'short2'], ['short3']]
+        self.assertListEqual(expected, got)
+
+        with open(prefix + '.coords') as f:
+            got = f.read()
+        self.assertEqual('long:1-20\tlong\t0\nlong:21-40\tlong\t20\nlong:41-50\tlong\t40\n', got)
+        os.unlink(prefix + '.coords')
+        self.assertEqual([], glob.glob(prefix + '*'))
+
+
+if __name__ == '__main__':
+    unittest.main()
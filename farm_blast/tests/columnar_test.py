@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+
+import os
+import unittest
+from farm_blast import columnar
+
+
+lines = [
+    'q1\tr1\t100.00\t50\t0\t0\t1\t50\t1001\t1050\t1e-20\t99.5',
+    'q1\tr2\t95.50\t40\t2\t0\t11\t50\t40\t1',
+    'q2\tr1\t90.00\t30\t3\t1\t1\t30\t5000000000\t5000000029\t0.0\t40',
+]
+lines[1] += '\t2e-10\t70.1'
+
+
+class TestColumnar(unittest.TestCase):
+    def test_write_and_read(self):
+        '''Test writing lines with ColumnarWriter and reading them back'''
+        outfile = 'tmp.columnar_test.columns'
+        old_write_rows = columnar.write_rows
+        columnar.write_rows = 2
+        writer = columnar.ColumnarWriter(outfile)
+        self.assertEqual(lines[:2], writer.process(lines[:2]))
+        self.assertEqual(lines[2:], writer.process(lines[2:]))
+        self.assertEqual([], writer.finish())
+        columnar.write_rows = old_write_rows
+
+        for use_mmap in [True, False]:
+            f = columnar.ColumnarFile(outfile, use_mmap=use_mmap)
+            self.assertEqual(3, len(f))
+            self.assertEqual(['q1', 'q2'], f.query_names())
+            self.assertEqual(['r1', 'r2'], f.subject_names())
+            self.assertEqual([0, 0, 1], list(f.column('qseqid')))
+            self.assertEqual([1001, 40, 5000000000], list(f.column('sstart')))
+            self.assertEqual([1e-20, 2e-10, 0.0], list(f.column('evalue')))
+            expected = [
+                ('q1', 'r1', 100.0, 50, 0, 0, 1, 50, 1001, 1050, 1e-20, 99.5),
+                ('q1', 'r2', 95.5, 40, 2, 0, 11, 50, 40, 1, 2e-10, 70.1),
+                ('q2', 'r1', 90.0, 30, 3, 1, 1, 30, 5000000000, 5000000029, 0.0, 40.0),
+            ]
+            self.assertEqual(expected, list(f.rows_iter()))
+            self.assertEqual([('r1', 99.5), ('r2', 70.1), ('r1', 40.0)], list(f.rows_iter(names=['sseqid', 'bitscore'])))
+            with self.assertRaises(columnar.Error):
+                f.column('oops')
+            f.close()
+
+        loaded = columnar.load_columns(outfile, ['qend', 'pident'])
+        self.assertEqual([50, 50, 30], list(loaded['qend']))
+        self.assertEqual([100.0, 95.5, 90.0], list(loaded['pident']))
+        self.assertEqual([outfile], [x for x in os.listdir('.') if x.startswith(outfile)])
+        os.unlink(outfile)
+
+
+    def test_empty_and_bad_input(self):
+        '''Test columnar file with no rows, and errors from bad lines or files'''
+        outfile = 'tmp.columnar_test.columns'
+        writer = columnar.ColumnarWriter(outfile)
+        writer.finish()
+        f = columnar.ColumnarFile(outfile)
+        self.assertEqual(0, len(f))
+        self.assertEqual([], f.query_names())
+        self.assertEqual([], list(f.rows_iter()))
+        f.close()
+
+        writer = columnar.ColumnarWriter(outfile)
+        with self.assertRaises(columnar.Error):
+            writer.process(['q1\tr1\t100'])
+        with self.assertRaises(columnar.Error):
+            writer.process([lines[0].replace('\t50\t', '\tx\t', 1)])
+        writer.finish()
+
+        with open(outfile, 'w') as f:
+            print('not a columnar file', file=f)
+        with self.assertRaises(columnar.Error):
+            columnar.ColumnarFile(outfile)
+        os.unlink(outfile)
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+
+import sys
+import os
+import time
+import shutil
+import unittest
+from farm_blast import blast, db_cache
+
+modules_dir = os.path.dirname(os.path.abspath(db_cache.__file__))
+data_dir = os.path.join(modules_dir, 'tests', 'data')
+
+
+class TestDbCache(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = 'tmp.db_cache_test'
+        self.cache = db_cache.DbCache(self.cache_dir)
+        self.ref = os.path.join(data_dir, 'pipeline_test.ref.fa')
+        self.blast_obj = blast.Blast(self.ref, 'qry')
+        self.blast_obj.format_database_command = lambda: 'touch reference.fa.nhr reference.fa.nin reference.fa.nsq formatdb.log'
+
+
+    def test_key(self):
+        '''Test database key depends on reference, tool and molecule type'''
+        keys = set([
+            self.cache.key(self.ref, self.blast_obj),
+            self.cache.key(self.ref, blast.Blast(self.ref, 'qry', blastall=True)),
+            self.cache.key(self.ref, blast.Blast(self.ref, 'qry', blast_type='blastp')),
+            self.cache.key(self.ref, self.blast_obj, union_for_act=True),
+            self.cache.key(os.path.join(data_dir, 'pipeline_test.qry.fa'), self.blast_obj),
+        ])
+        self.assertEqual(5, len(keys))
+        self.assertEqual(self.cache.key(self.ref, self.blast_obj), self.cache.key(self.ref, blast.Blast(self.ref, 'qry', blast_type='megablast')))
+
+
+    def test_acquire_and_release(self):
+        '''Test database built once and symlinked'''
+        prefix = 'tmp.db_cache_test.reference.fa'
+        key = self.cache.acquire(self.ref, self.blast_obj, 'run1', prefix)
+        entry_dir = os.path.join(self.cache.cache_dir, key)
+        self.assertEqual(['reference.fa.nhr', 'reference.fa.nin', 'reference.fa.nsq'], sorted(os.listdir(entry_dir)))
+        for suffix in ['nhr', 'nin', 'nsq']:
+            self.assertTrue(os.path.islink(prefix + '.' + suffix))
+            self.assertEqual(os.path.join(entry_dir, 'reference.fa.' + suffix), os.readlink(prefix + '.' + suffix))
+
+        # second run must not rebuild the database
+        self.blast_obj.format_database_command = lambda: 'false'
+        self.assertEqual(key, self.cache.acquire(self.ref, self.blast_obj, 'run2', prefix))
+        self.assertTrue(self.cache._in_use(key, time.time()))
+        self.cache.release(key, 'run1')
+        self.assertTrue(self.cache._in_use(key, time.time()))
+        self.cache.release(key, 'run2')
+        self.assertFalse(self.cache._in_use(key, time.time()))
+
+        for suffix in ['nhr', 'nin', 'nsq']:
+            os.unlink(prefix + '.' + suffix)
+
+
+    def test_build_fails(self):
+        '''Test failed database build leaves nothing in the cache'''
+        self.blast_obj.format_database_command = lambda: 'false'
+        with self.assertRaises(db_cache.Error):
+            self.cache.acquire(self.ref, self.blast_obj, 'run1', 'tmp.db_cache_test.reference.fa')
+        self.assertEqual([], self.cache.entries())
+
+
+    def test_evict(self):
+        '''Test least recently used databases not in use are evicted'''
+        for i, key in enumerate(['key1', 'key2', 'key3']):
+            os.mkdir(os.path.join(self.cache.cache_dir, key))
+            with open(os.path.join(self.cache.cache_dir, key, 'reference.fa.nsq'), 'w') as f:
+                f.write('x' * 1000)
+            os.utime(os.path.join(self.cache.cache_dir, key), (i, i))
+
+        os.mkdir(self.cache._users_dir('key1'))
+        open(self.cache._user_file('key1', 'run1'), 'w').close()
+        self.assertEqual(['key1', 'key2', 'key3'], self.cache.entries())
+        self.assertEqual([], self.cache.evict())
+        self.cache.max_size = 2.5 / 1000000
+        self.assertEqual(['key2'], self.cache.evict())
+        self.assertEqual(['key1', 'key3'], self.cache.entries())
+        self.cache.max_size = 0
+        self.assertEqual(['key3'], self.cache.evict())
+        self.assertEqual(['key1'], self.cache.entries())
+
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
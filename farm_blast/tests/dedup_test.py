@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+
+import sys
+import os
+import filecmp
+import unittest
+from farm_blast import dedup
+
+modules_dir = os.path.dirname(os.path.abspath(dedup.__file__))
+data_dir = os.path.join(modules_dir, 'tests', 'data')
+
+class TestDedup(unittest.TestCase):
+    def test_dedup_query(self):
+        '''Test duplicate query sequences removed'''
+        outfile = 'tmp.dedup_query.fa'
+        dups_file = 'tmp.dedup_query.tsv'
+        self.assertEqual((3, 3), dedup.dedup_query(os.path.join(data_dir, 'dedup_test.fa'), outfile, dups_file))
+
+        with open(outfile) as f:
+            self.assertEqual('>seq1\nACGTACGTAC\n>seq2\nGGGGGCCCCC\n>seq4\nacgtacgtac\n', f.read())
+
+        with open(dups_file) as f:
+            self.assertEqual('seq3\tseq1\t2\nseq5\tseq1\t3\nseq6\tseq2\t3\n', f.read())
+
+        expected = {'seq1': ['seq3', 'seq5'], 'seq2': ['seq6']}
+        self.assertDictEqual(expected, dedup.load_duplicates(dups_file))
+        os.unlink(outfile)
+        os.unlink(dups_file)
+
+
+    def test_duplicate_expander(self):
+        '''Test hits copied to duplicate query names'''
+        dups_file = 'tmp.duplicate_expander.tsv'
+        with open(dups_file, 'w') as f:
+            print('seq3', 'seq1', 2, sep='\t', file=f)
+            print('seq5', 'seq1', 3, sep='\t', file=f)
+            print('seq6', 'seq2', 3, sep='\t', file=f)
+
+        expander = dedup.DuplicateExpander(dups_file)
+        os.unlink(dups_file)
+
+        got = expander.process(['seq1\tref1\t1', 'seq1\tref2\t2'])
+        self.assertEqual([], got)
+        got = expander.process(['seq1\tref3\t3', 'seq4\tref1\t4', 'seq2\tref1\t5'])
+        expected = [
+            'seq1\tref1\t1', 'seq1\tref2\t2', 'seq1\tref3\t3',
+            'seq3\tref1\t1', 'seq3\tref2\t2', 'seq3\tref3\t3',
+            'seq5\tref1\t1', 'seq5\tref2\t2', 'seq5\tref3\t3',
+            'seq4\tref1\t4',
+        ]
+        self.assertEqual(expected, got)
+        self.assertEqual(['seq2\tref1\t5', 'seq6\tref1\t5'], expander.finish())
+        self.assertEqual([], expander.finish())
+
+
+    def test_duplicate_expander_query_order(self):
+        '''Test hits copied to duplicate query names in query file order'''
+        dups_file = 'tmp.duplicate_expander.tsv'
+        with open(dups_file, 'w') as f:
+            print('seq3', 'seq1', 2, sep='\t', file=f)
+            print('seq5', 'seq1', 3, sep='\t', file=f)
+            print('seq6', 'seq2', 3, sep='\t', file=f)
+        query_file = 'tmp.duplicate_expander.fa'
+        with open(query_file, 'w') as f:
+            print('>seq1\nA\n>seq2\nC\n>seq4\nG', file=f)
+
+        expander = dedup.DuplicateExpander(dups_file, query_file=query_file)
+        os.unlink(dups_file)
+
+        got = expander.process(['seq1\tref1\t1', 'seq1\tref2\t2'])
+        got += expander.process(['seq1\tref3\t3', 'seq2\tref1\t4', 'seq4\tref1\t5'])
+        got += expander.finish()
+        os.unlink(query_file)
+        expected = [
+            'seq1\tref1\t1', 'seq1\tref2\t2', 'seq1\tref3\t3',
+            'seq2\tref1\t4',
+            'seq3\tref1\t1', 'seq3\tref2\t2', 'seq3\tref3\t3',
+            'seq4\tref1\t5',
+            'seq5\tref1\t1', 'seq5\tref2\t2', 'seq5\tref3\t3',
+            'seq6\tref1\t4',
+        ]
+        self.assertEqual(expected, got)
+        self.assertEqual([], expander.finish())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+
+import os
+import io
+import shutil
+import unittest
+from farmpy import lsf
+from farm_blast import driver, pipeline
+
+# Stand-in for bsub, which runs the job straight away and records its
+# state for the fake bjobs. Array elements are run one after the other
+fake_bsub = r'''#!/usr/bin/env python3
+import os
+import re
+import sys
+import subprocess
+
+options_with_values = {'-q', '-E', '-R', '-o', '-e', '-J', '-n', '-w', '-M'}
+options = {}
+args = sys.argv[1:]
+while len(args) and args[0].startswith('-'):
+    if args[0] in options_with_values:
+        options[args[0]] = args[1]
+        args = args[2:]
+    else:
+        args = args[1:]
+
+with open('tmp.fake_lsf.counter', 'a+') as f:
+    f.seek(0)
+    job_id = len(f.read().split()) + 1
+    print(job_id, file=f)
+
+match = re.match(r'^.*\[(.*)\]', options['-J'])
+indices = []
+if match is None:
+    indices = [None]
+else:
+    for x in match.group(1).split(','):
+        start, end = (x + '-' + x).split('-')[:2]
+        indices.extend(range(int(start), int(end) + 1))
+
+states = []
+for i in indices:
+    env = dict(os.environ)
+    out, err = options['-o'], options['-e']
+    if i is not None:
+        env['LSB_JOBINDEX'] = str(i)
+        out, err = out.replace('%I', str(i)), err.replace('%I', str(i))
+    with open(out, 'w') as f_out, open(err, 'w') as f_err:
+        code = subprocess.call(' '.join(args), shell=True, env=env, stdout=f_out, stderr=f_err)
+    states.append('DONE' if code == 0 else 'EXIT')
+
+with open('tmp.fake_lsf.jobs', 'a') as f:
+    print(job_id, ' '.join(states), file=f)
+
+print('Job <' + str(job_id) + '> is submitted to queue <normal>.')
+'''
+
+# Stand-in for "bjobs -a -noheader -o stat ID"
+fake_bjobs = r'''#!/usr/bin/env python3
+import sys
+with open('tmp.fake_lsf.jobs') as f:
+    for line in f:
+        fields = line.split()
+        if fields[0] == sys.argv[-1]:
+            print(*fields[1:], sep='\n')
+            sys.exit(0)
+print('Job <' + sys.argv[-1] + '> is not found', file=sys.stderr)
+sys.exit(255)
+'''
+
+
+def make_job(name, cmd, job_class=lsf.Job, **kwargs):
+    return job_class(name + '.o', name + '.e', name, 'normal', 0.1, cmd, memory_units='MB', **kwargs)
+
+
+class TestDriver(unittest.TestCase):
+    def setUp(self):
+        self.original_dir = os.getcwd()
+        self.tmp_dir = os.path.abspath('tmp.driver_test')
+        os.mkdir(self.tmp_dir)
+        os.chdir(self.tmp_dir)
+        bin_dir = os.path.join(self.tmp_dir, 'bin')
+        os.mkdir(bin_dir)
+        for name, script in [('bsub', fake_bsub), ('bjobs', fake_bjobs)]:
+            with open(os.path.join(bin_dir, name), 'w') as f:
+                print(script, file=f)
+            os.chmod(os.path.join(bin_dir, name), 0o755)
+        self.original_path = os.environ['PATH']
+        os.environ['PATH'] = bin_dir + ':' + self.original_path
+
+
+    def tearDown(self):
+        os.environ['PATH'] = self.original_path
+        os.chdir(self.original_dir)
+        shutil.rmtree(self.tmp_dir)
+
+
+    def make_driver(self, array_cmd='touch tmp.array.done.INDEX', watch_job=None):
+        self.out = io.StringIO()
+        return driver.Driver(
+            make_job('setup', 'touch query.split.1 query.split.2 query.split.3 query.split.coords'),
+            make_job('array', array_cmd, job_class=pipeline.ArrayJob, array_start=1, array_end='$n'),
+            make_job('combine', 'touch FINISHED'),
+            watch_job=watch_job,
+            poll_seconds=0,
+            out=self.out
+        )
+
+
+    def test_job_id_from_bsub_output(self):
+        '''test job_id_from_bsub_output'''
+        self.assertEqual('42', driver.job_id_from_bsub_output('Job <42> is submitted to queue <normal>.\n'))
+        with self.assertRaises(driver.Error):
+            driver.job_id_from_bsub_output('oops')
+
+
+    def test_run(self):
+        '''test run'''
+        d = self.make_driver()
+        d.run()
+        self.assertEqual(3, d.array_job.array_end)
+        for i in range(1, 4):
+            self.assertTrue(os.path.exists('tmp.array.done.' + str(i)))
+        self.assertTrue(os.path.exists('FINISHED'))
+        with open('02.array.id') as f:
+            self.assertEqual('2', f.read().rstrip())
+        log = self.out.getvalue()
+        self.assertIn('Submitted array job 2 with 3 elements', log)
+        self.assertIn('Array elements: 0 pending, 0 running, 3 done, 0 failed', log)
+        self.assertIn('Combine job finished', log)
+
+
+    def test_run_with_watcher(self):
+        '''test run with straggler watcher'''
+        d = self.make_driver(watch_job=make_job('watch', 'cp 02.array.id watched'))
+        d.run()
+        with open('watched') as f:
+            self.assertEqual('2', f.read().rstrip())
+        with open('02.watch.id') as f:
+            self.assertEqual('3', f.read().rstrip())
+        self.assertTrue(os.path.exists('FINISHED'))
+
+
+    def test_run_resume(self):
+        '''test run resuming some array elements'''
+        d = self.make_driver()
+        d.run(run_setup=False, indices=[2, 3])
+        self.assertFalse(os.path.exists('setup.o'))
+        self.assertFalse(os.path.exists('tmp.array.done.1'))
+        self.assertTrue(os.path.exists('tmp.array.done.2'))
+        self.assertTrue(os.path.exists('tmp.array.done.3'))
+        self.assertTrue(os.path.exists('FINISHED'))
+
+
+    def test_run_array_fails(self):
+        '''test run stops when array element fails'''
+        d = self.make_driver(array_cmd='test INDEX -ne 2')
+        with self.assertRaises(driver.Error):
+            d.run()
+        self.assertIn('2 done, 1 failed', self.out.getvalue())
+        self.assertFalse(os.path.exists('FINISHED'))
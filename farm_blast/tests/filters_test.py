@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+
+import os
+import unittest
+from farm_blast import filters
+
+
+def blast_line(query, ref, pident, length, qstart, bitscore):
+    return '\t'.join([query, ref, str(pident), str(length), '0', '0', str(qstart), str(qstart + length - 1), '1', str(length), '1e-5', str(bitscore)])
+
+
+def run_stages(stages, lines, batch_size=2):
+    '''Passes lines through the stages a few at a time, as fix_blast_coords does'''
+    out = []
+    for i in range(0, len(lines), batch_size):
+        batch = lines[i:i + batch_size]
+        for stage in stages:
+            batch = stage.process(batch)
+        out.extend(batch)
+
+    for i, stage in enumerate(stages):
+        batch = stage.finish()
+        for later_stage in stages[i + 1:]:
+            batch = later_stage.process(batch)
+        out.extend(batch)
+    return out
+
+
+class TestFilters(unittest.TestCase):
+    def test_threshold_filter(self):
+        '''Test ThresholdFilter'''
+        lines = [
+            blast_line('q1', 'r1', 100.00, 50, 1, 90),
+            blast_line('q1', 'r1', 85.00, 50, 1, 80),
+            blast_line('q1', 'r2', 99.00, 20, 1, 30),
+            blast_line('q2', 'r1', 95.00, 100, 1, 150),
+        ]
+        self.assertEqual(lines, filters.ThresholdFilter().process(lines))
+        self.assertEqual([lines[0], lines[1], lines[3]], filters.ThresholdFilter(min_bitscore=50).process(lines))
+        self.assertEqual([lines[0], lines[2], lines[3]], filters.ThresholdFilter(min_pident=90).process(lines))
+        self.assertEqual([lines[3]], filters.ThresholdFilter(min_pident=90, min_length=50, min_bitscore=100).process(lines))
+        self.assertEqual([], filters.ThresholdFilter(min_length=200).finish())
+
+
+    def test_top_hits_filter(self):
+        '''Test TopHitsFilter'''
+        lines = [
+            blast_line('q1', 'r1', 100, 50, 1, 90),
+            blast_line('q1', 'r1', 100, 40, 100, 70),
+            blast_line('q1', 'r2', 100, 60, 200, 110),
+            blast_line('q1', 'r3', 100, 30, 300, 50),
+            blast_line('q1', 'r2', 100, 20, 400, 30),
+            blast_line('q1', 'r2', 100, 45, 500, 80),
+            blast_line('q2', 'r3', 100, 30, 1, 50),
+            blast_line('q3', 'r1', 100, 30, 1, 40),
+            blast_line('q3', 'r2', 100, 30, 1, 40),
+        ]
+
+        self.assertEqual(lines, run_stages([filters.TopHitsFilter()], lines))
+        expected = [lines[i] for i in [0, 1, 2, 3, 5, 6, 7, 8]]
+        self.assertEqual(expected, run_stages([filters.TopHitsFilter(top_hsps=2)], lines))
+        expected = [lines[i] for i in [0, 1, 2, 4, 5, 6, 7, 8]]
+        self.assertEqual(expected, run_stages([filters.TopHitsFilter(top_hits=2)], lines, batch_size=4))
+        expected = [lines[i] for i in [2, 6, 7]]
+        self.assertEqual(expected, run_stages([filters.TopHitsFilter(top_hits=1, top_hsps=1)], lines, batch_size=100))
+
+
+    def test_make_stages(self):
+        '''Test make_stages'''
+        self.assertEqual([], filters.make_stages())
+        stages = filters.make_stages(top_hits=1, min_length=10)
+        self.assertEqual(2, len(stages))
+        self.assertEqual(1, stages[1].top_hits)
+        self.assertEqual([], filters.make_stages(top_hits=1, in_task=True))
+        stages = filters.make_stages(top_hits=1, top_hsps=2, in_task=True)
+        self.assertEqual(1, len(stages))
+        self.assertEqual(None, stages[0].top_hits)
+        self.assertEqual(2, stages[0].top_hsps)
+        with self.assertRaises(filters.Error):
+            filters.make_stages(top_hits=0)
+
+
+    def test_in_task_filters_give_same_result(self):
+        '''Test filtering in each task and again when combining gives the same result as filtering once'''
+        lines = [
+            blast_line('q1', 'r1', 100, 50, 1, 90),
+            blast_line('q1', 'r1', 100, 40, 100, 70),
+            blast_line('q1', 'r2', 100, 60, 200, 110),
+            blast_line('q1', 'r1', 100, 45, 1000, 95),
+            blast_line('q1', 'r2', 80, 30, 1100, 50),
+            blast_line('q1', 'r3', 100, 30, 1200, 100),
+        ]
+        options = {'top_hits': 2, 'top_hsps': 1, 'min_pident': 90}
+        expected = run_stages(filters.make_stages(**options), lines)
+        self.assertEqual([lines[i] for i in [2, 5]], expected)
+        # lines 0-2 and 3-5 come from two pieces of q1 blasted in different tasks
+        in_task = run_stages(filters.make_stages(in_task=True, **options), lines[:3]) \
+                + run_stages(filters.make_stages(in_task=True, **options), lines[3:])
+        self.assertEqual(expected, run_stages(filters.make_stages(**options), in_task))
+
+
+    def test_filter_file(self):
+        '''Test filter_file'''
+        infile = 'tmp.filters_test.in'
+        outfile = 'tmp.filters_test.out'
+        with open(infile, 'w') as f:
+            print('# BLASTN 2.2.26', file=f)
+            print(blast_line('q1', 'r1', 100, 50, 1, 90), file=f)
+            print(blast_line('q1', 'r1', 100, 50, 100, 80).replace('\t1e-5', '\t 1e-5'), file=f)
+            print(blast_line('q2', 'r1', 100, 50, 1, 30), file=f)
+
+        filters.filter_file(infile, outfile, filters.make_stages(top_hsps=1))
+        with open(outfile) as f:
+            got = f.read()
+        expected = blast_line('q1', 'r1', 100, 50, 1, 90) + '\n' + blast_line('q2', 'r1', 100, 50, 1, 30) + '\n'
+        self.assertEqual(expected, got)
+        os.unlink(infile)
+        os.unlink(outfile)
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+
+import os
+import shutil
+import unittest
+from farm_blast import follow, work_queue
+
+
+def write_file(filename, lines):
+    with open(filename, 'w') as f:
+        for line in lines:
+            print(line, file=f)
+
+
+def hit(query, start):
+    return '\t'.join([query, 'ref', '100.00', '10', '0', '0', str(start), str(start + 9), '1', '10', '1e-5', '20.0'])
+
+
+class TestFollow(unittest.TestCase):
+    def setUp(self):
+        self.original_dir = os.getcwd()
+        self.tmp_dir = os.path.abspath('tmp.follow_test')
+        os.mkdir(self.tmp_dir)
+        os.chdir(self.tmp_dir)
+
+        # sequence "long" is split into three pieces, one in each chunk
+        write_file('query.split.1', ['>a', 'ACGT', '>long.1', 'ACGT'])
+        write_file('query.split.2', ['>long.2', 'ACGT'])
+        write_file('query.split.3', ['>long.3', 'ACGT', '>b', 'ACGT'])
+        write_file('query.split.coords', ['long.1\tlong\t0', 'long.2\tlong\t100', 'long.3\tlong\t200'])
+        write_file('tmp.array.out.1', [hit('a', 1), hit('long.1', 1)])
+        write_file('tmp.array.out.2', [hit('long.2', 1)])
+        write_file('tmp.array.out.3', [hit('long.3', 1), hit('b', 1)])
+
+
+    def tearDown(self):
+        os.chdir(self.original_dir)
+        shutil.rmtree(self.tmp_dir)
+
+
+    def finish_chunk(self, chunk):
+        write_file('tmp.array.done.' + str(chunk), [])
+
+
+    def test_publisher(self):
+        '''test Publisher adds chunks as they finish, and only lists complete queries'''
+        publisher = follow.Publisher(duplicates={'b': ['b_copy']}, poll_seconds=0)
+        self.assertEqual(['a', 'long'], publisher.chunk_names(1))
+        self.assertFalse(publisher.step())
+        self.assertFalse(os.path.exists(follow.partial_file))
+
+        self.finish_chunk(3)
+        self.assertFalse(publisher.step())
+        names, chunks, size = follow.read_manifest(follow.manifest_file)
+        self.assertEqual({3}, chunks)
+        self.assertEqual({'b': size, 'b_copy': size}, names)
+        with open(follow.partial_file) as f:
+            self.assertEqual([hit('long', 201), hit('b', 1)], [x.rstrip() for x in f])
+
+        self.finish_chunk(1)
+        self.assertFalse(publisher.step())
+        names, chunks, size = follow.read_manifest(follow.manifest_file)
+        self.assertEqual({1, 3}, chunks)
+        self.assertEqual(['a', 'b', 'b_copy'], sorted(names))
+
+        self.finish_chunk(2)
+        self.assertTrue(publisher.step())
+        names, chunks, size = follow.read_manifest(follow.manifest_file)
+        self.assertEqual({1, 2, 3}, chunks)
+        self.assertEqual(['a', 'b', 'b_copy', 'long'], sorted(names))
+        self.assertEqual(size, names['long'])
+        self.assertEqual(os.path.getsize(follow.partial_file), size)
+        with open(follow.partial_file) as f:
+            got = [x.rstrip() for x in f]
+        self.assertEqual([hit('long', 201), hit('b', 1), hit('a', 1), hit('long', 1), hit('long', 101)], got)
+        publisher.close()
+
+
+    def test_publisher_work_queue(self):
+        '''test Publisher gets failed chunks from the work queue, not from LSF output'''
+        work_queue.make_queue()
+        queue = work_queue.Queue(max_attempts=1)
+        # with a work queue, tmp.array.o.N is the output of worker N, not chunk N
+        with open('tmp.array.o.1', 'w') as f:
+            print('Exited with exit code 1.', file=f)
+        publisher = follow.Publisher(queue=queue)
+        self.assertFalse(publisher.step())
+
+        self.assertEqual(1, queue.claim('w1'))
+        self.assertEqual(2, queue.claim('w2'))
+        queue.finish(2, 'w2', False)
+        with self.assertRaises(follow.Error):
+            publisher.step()
+        publisher.close()
+        queue.close()
+
+
+    def test_publisher_restart(self):
+        '''test Publisher carries on after being stopped halfway through a chunk'''
+        self.finish_chunk(1)
+        publisher = follow.Publisher()
+        publisher.step()
+        publisher.close()
+        size = os.path.getsize(follow.partial_file)
+        manifest_size = os.path.getsize(follow.manifest_file)
+
+        with open(follow.partial_file, 'a') as f:
+            print('half written line', file=f)
+        with open(follow.manifest_file, 'a') as f:
+            print('x\t42', file=f)
+
+        publisher = follow.Publisher()
+        self.assertEqual({1}, publisher.published)
+        self.assertEqual(size, os.path.getsize(follow.partial_file))
+        self.assertEqual(manifest_size, os.path.getsize(follow.manifest_file))
+        self.finish_chunk(2)
+        self.finish_chunk(3)
+        self.assertTrue(publisher.step())
+        names, chunks, size = follow.read_manifest(follow.manifest_file)
+        self.assertEqual(['a', 'b', 'long'], sorted(names))
+        publisher.close()
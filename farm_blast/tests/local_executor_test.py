@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+
+import sys
+import os
+import unittest
+from farm_blast import local_executor
+
+modules_dir = os.path.dirname(os.path.abspath(local_executor.__file__))
+data_dir = os.path.join(modules_dir, 'tests', 'data')
+
+class TestLocalExecutor(unittest.TestCase):
+    def test_max_parallel_tasks(self):
+        '''Test number of parallel tasks limited by workers and memory'''
+        self.assertEqual(4, local_executor.LocalExecutor(workers=4, memory=100, task_memory=1).max_parallel_tasks())
+        self.assertEqual(2, local_executor.LocalExecutor(workers=4, memory=2.5, task_memory=1).max_parallel_tasks())
+        self.assertEqual(1, local_executor.LocalExecutor(workers=4, memory=0.5, task_memory=1).max_parallel_tasks())
+        self.assertEqual(4, local_executor.LocalExecutor(workers=4, memory=None, task_memory=1).max_parallel_tasks())
+        self.assertEqual(2, local_executor.LocalExecutor(workers=4, memory=100, task_memory=1, task_threads=2).max_parallel_tasks())
+        self.assertEqual(1, local_executor.LocalExecutor(workers=4, memory=None, task_memory=1, task_threads=8).max_parallel_tasks())
+
+        with self.assertRaises(local_executor.Error):
+            local_executor.LocalExecutor(workers=0)
+
+
+    def test_run_array(self):
+        '''Test array tasks run with the same output files as an LSF array'''
+        prefix = 'tmp.local_executor_test'
+        executor = local_executor.LocalExecutor(workers=2, memory=1, task_memory=0.5)
+        executor.run_array('echo INDEX > ' + prefix + '.out.INDEX; env | grep ^LSB_JOB >> ' + prefix + '.out.INDEX; echo err INDEX >&2', range(1, 4), prefix + '.o', prefix + '.e')
+
+        for i in range(1, 4):
+            for suffix, expected in [('out', str(i) + '\nLSB_JOBINDEX=' + str(i)), ('o', ''), ('e', 'err ' + str(i))]:
+                filename = prefix + '.' + suffix + '.' + str(i)
+                with open(filename) as f:
+                    self.assertEqual(expected, f.read().rstrip())
+                os.unlink(filename)
+
+
+    def test_run_array_fail(self):
+        '''Test error raised if an array task fails'''
+        prefix = 'tmp.local_executor_test'
+        executor = local_executor.LocalExecutor(workers=2)
+        with self.assertRaises(local_executor.Error):
+            executor.run_array('test INDEX -ne 2', range(1, 4), prefix + '.o', prefix + '.e')
+
+        for i in range(1, 4):
+            os.unlink(prefix + '.o.' + str(i))
+            os.unlink(prefix + '.e.' + str(i))
+
+
+if __name__ == '__main__':
+    unittest.main()
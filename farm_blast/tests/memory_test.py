@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+
+import sys
+import os
+import unittest
+from farm_blast import blast, memory
+
+modules_dir = os.path.dirname(os.path.abspath(memory.__file__))
+data_dir = os.path.join(modules_dir, 'tests', 'data')
+
+class TestMemory(unittest.TestCase):
+    def test_formula_memory(self):
+        '''Test memory estimated from database, blast type, chunk size and filtering'''
+        expected = memory.base_memory + memory.database_memory_factor + 500000 * memory.query_memory_per_base['blastn']
+        self.assertAlmostEqual(expected, memory.formula_memory(1000000000, 'blastn', 500000))
+        self.assertAlmostEqual(expected * memory.no_filter_factor, memory.formula_memory(1000000000, 'blastn', 500000, no_filter=True))
+        expected = memory.base_memory + 200000 * memory.blastall_tblastx_memory_per_base
+        self.assertAlmostEqual(expected, memory.formula_memory(0, 'tblastx', 200000, blastall=True))
+        with self.assertRaises(memory.Error):
+            memory.formula_memory(0, 'oops', 1)
+
+
+    def test_database_size(self):
+        '''Test size of formatted database, or estimate if not formatted'''
+        indexed = os.path.join(data_dir, 'pipeline_test.ref.indexed.fa')
+        expected = sum([os.path.getsize(indexed + '.' + x) for x in ['nhr', 'nin', 'nsq']])
+        self.assertEqual(expected, memory.database_size(blast.Blast(indexed, 'qry')))
+        not_indexed = os.path.join(data_dir, 'pipeline_test.ref.fa')
+        self.assertEqual(os.path.getsize(not_indexed) // 4, memory.database_size(blast.Blast(not_indexed, 'qry')))
+        self.assertEqual(os.path.getsize(not_indexed), memory.database_size(blast.Blast(not_indexed, 'qry', blast_type='blastp')))
+
+
+    def test_estimate_with_history(self):
+        '''Test estimate refined using peak memory of previous runs'''
+        history_file = 'tmp.memory_history.tsv'
+        ref = os.path.join(data_dir, 'pipeline_test.ref.indexed.fa')
+        b = blast.Blast(ref, 'qry')
+        model = memory.MemoryModel(history_file=history_file)
+        formula = memory.formula_memory(memory.database_size(b), 'blastn', 1000)
+        self.assertEqual(round(formula, 3), model.estimate(b, 1000))
+        self.assertIsNone(model.history_ratio('blast_plus', 'blastn', False))
+
+        lsf_files = [os.path.join(data_dir, 'utils_test_parse_lsf_report.o')]
+        self.assertEqual(1.5, model.record_run(b, 1000, 2, lsf_files))
+        ratio = 1.5 / formula
+        self.assertAlmostEqual(ratio, model.history_ratio('blast_plus', 'blastn', False))
+        self.assertIsNone(model.history_ratio('blast_plus', 'blastn', True))
+        self.assertIsNone(model.history_ratio('blastall', 'blastn', False))
+        self.assertEqual(round(1.5 * memory.safety_factor, 3), model.estimate(b, 1000))
+
+        # a job killed for using too much memory means it needed more than it asked for
+        lsf_files.append(os.path.join(data_dir, 'utils_test_parse_lsf_report.memlimit.o'))
+        self.assertEqual(1.5, model.record_run(b, 1000, 2, lsf_files))
+        self.assertAlmostEqual(4 / formula, model.history_ratio('blast_plus', 'blastn', False))
+
+        with open(history_file) as f:
+            lines = f.readlines()
+        self.assertEqual(3, len(lines))
+        self.assertTrue(lines[0].startswith('#time'))
+        os.unlink(history_file)
+
+
+    def test_record_run_no_reports(self):
+        '''Test nothing recorded if there are no LSF reports'''
+        history_file = 'tmp.memory_history.tsv'
+        b = blast.Blast(os.path.join(data_dir, 'pipeline_test.ref.fa'), 'qry')
+        model = memory.MemoryModel(history_file=history_file)
+        self.assertIsNone(model.record_run(b, 1000, 2, [os.path.join(data_dir, 'utils_test_coords_offset.tsv')]))
+        self.assertFalse(os.path.exists(history_file))
+
+
+if __name__ == '__main__':
+    unittest.main()
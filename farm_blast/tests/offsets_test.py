@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+
+import sys
+import os
+import unittest
+from farm_blast import offsets, utils
+
+modules_dir = os.path.dirname(os.path.abspath(offsets.__file__))
+data_dir = os.path.join(modules_dir, 'tests', 'data')
+
+class TestOffsets(unittest.TestCase):
+    def test_offsets_index(self):
+        '''Test index gives same offsets as dict, with and without mmap'''
+        coords_file = 'tmp.offsets_test.coords'
+        index_file = 'tmp.offsets_test.index'
+        with open(coords_file, 'w') as f:
+            for i in range(101):
+                for j in range(i % 4 + 1):
+                    print('ctg' + str(i) + ':' + str(j * 100 + 1) + '-' + str((j + 1) * 100), 'ctg' + str(i), j * 100, sep='\t', file=f)
+            print('big:1000000000001-1000000000100', 'big', 1000000000000, sep='\t', file=f)
+        expected = utils.offset_coords_file_to_dict(coords_file)
+
+        offsets.make_index(coords_file, index_file)
+        for use_mmap in [True, False]:
+            index = offsets.OffsetsIndex(index_file, use_mmap=use_mmap)
+            self.assertEqual(len(expected), len(index))
+            self.assertTrue(index.all_names_have_colon)
+            for name in sorted(expected):
+                self.assertEqual(expected[name], index.get(name))
+                self.assertEqual(expected[name], index[name])
+            self.assertIsNone(index.get('ctg0'))
+            self.assertIsNone(index.get('ctg0:1-101'))
+            self.assertEqual('x', index.get('ctg0:1-101', 'x'))
+            self.assertFalse('ctg1000:1-100' in index)
+            with self.assertRaises(KeyError):
+                index['ctg0']
+            index.close()
+
+        os.unlink(coords_file)
+        os.unlink(index_file)
+
+
+    def test_offsets_index_names_without_colons(self):
+        '''Test index of coords file with names that do not have colons'''
+        index_file = 'tmp.offsets_test.index'
+        coords_file = os.path.join(data_dir, 'utils_test_coords_offset.tsv')
+        offsets.make_index(coords_file, index_file)
+        index = offsets.OffsetsIndex(index_file)
+        self.assertFalse(index.all_names_have_colon)
+        self.assertEqual(utils.offset_coords_file_to_dict(coords_file), {x: index[x] for x in ['seq1', 'seq2', 'seq3', 'seq4']})
+        index.close()
+        os.unlink(index_file)
+
+
+    def test_empty_index(self):
+        '''Test index of empty coords file'''
+        coords_file = 'tmp.offsets_test.coords'
+        index_file = 'tmp.offsets_test.index'
+        open(coords_file, 'w').close()
+        offsets.make_index(coords_file, index_file)
+        index = offsets.OffsetsIndex(index_file)
+        self.assertEqual(0, len(index))
+        self.assertIsNone(index.get('x:1-2'))
+        index.close()
+        os.unlink(coords_file)
+        os.unlink(index_file)
+
+
+    def test_bad_files(self):
+        '''Test errors with duplicated names or file that is not an index'''
+        coords_file = 'tmp.offsets_test.coords'
+        index_file = 'tmp.offsets_test.index'
+        with open(coords_file, 'w') as f:
+            print('x:1-2', 'x', 0, sep='\t', file=f)
+            print('x:1-2', 'x', 2, sep='\t', file=f)
+        with self.assertRaises(offsets.Error):
+            offsets.make_index(coords_file, index_file)
+        with self.assertRaises(offsets.Error):
+            offsets.OffsetsIndex(coords_file)
+        os.unlink(coords_file)
+        self.assertFalse(os.path.exists(index_file))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -9,7 +9,7 @@ import unittest
 
 from nose.tools import nottest
 
-from farm_blast import pipeline
+from farm_blast import pipeline, memory
 
 modules_dir = os.path.dirname(os.path.abspath(pipeline.__file__))
 data_dir = os.path.join(modules_dir, 'tests', 'data')
@@ -49,6 +49,7 @@ class TestPipeline(unittest.TestCase):
         print('set -e', file=f)
         print('fastaq to_fasta -s', os.path.abspath(self.qry), '- |',
               'fastaq chunker --skip_all_Ns - query.split 100 1', file=f)
+        print('touch 01.setup.sh.done', file=f)
         f.close()
         self.assertTrue(filecmp.cmp(expected_script, test_script))
         os.unlink(expected_script)
@@ -66,6 +67,7 @@ class TestPipeline(unittest.TestCase):
         print('makeblastdb -dbtype nucl -in reference.fa', file=f)
         print('fastaq to_fasta -s', os.path.abspath(self.qry), '- |',
               'fastaq chunker --skip_all_Ns - query.split 100 1', file=f)
+        print('touch 01.setup.sh.done', file=f)
         f.close()
         self.assertTrue(filecmp.cmp(expected_script, test_script))
         os.unlink(expected_script)
@@ -86,12 +88,248 @@ class TestPipeline(unittest.TestCase):
         print('fastaq merge', os.path.abspath(self.qry), '- |',
               'fastaq to_fasta -s - - |',
               'fastaq chunker --skip_all_Ns - query.split 100 1', file=f)
+        print('touch 01.setup.sh.done', file=f)
         f.close()
         self.assertTrue(filecmp.cmp(expected_script, test_script))
         os.unlink(expected_script)
         os.unlink(test_script)
 
 
+    def test_make_setup_script_balance_chunks(self):
+        expected_script = 'tmp.make_setup_script_expected'
+        test_script = 'tmp.make_setup_script_test'
+        self.p.balance_chunks = True
+        self.p._make_setup_script(script_name=test_script)
+
+        f = open(expected_script, 'w')
+        print('set -e', file=f)
+        print('fastaq to_fasta -s', os.path.abspath(self.ref), 'reference.fa', file=f)
+        print('makeblastdb -dbtype nucl -in reference.fa', file=f)
+        print('fastaq to_fasta -s', os.path.abspath(self.qry), 'query.fa', file=f)
+        print('PYTHONPATH=' + os.path.abspath('.') + ':$PYTHONPATH', file=f)
+        print(os.path.abspath('scripts/farm_blast'), '--test --chunk_query --blast_type blastn --split_bases 100 --split_bases_tolerance 1 reference.fa query.fa', file=f)
+        print('touch 01.setup.sh.done', file=f)
+        f.close()
+        self.assertTrue(filecmp.cmp(expected_script, test_script))
+        self.assertIn('query.fa', self.p.files_to_delete)
+        os.unlink(expected_script)
+        os.unlink(test_script)
+
+
+    def test_make_setup_script_target_walltime(self):
+        expected_script = 'tmp.make_setup_script_expected'
+        test_script = 'tmp.make_setup_script_test'
+        self.p.target_walltime = 30.0
+        self.p.blast.evalue = '0.1'
+        self.p.blast.extra_options = '-x "a b"'
+        self.p._make_setup_script(script_name=test_script)
+
+        f = open(expected_script, 'w')
+        print('set -e', file=f)
+        print('fastaq to_fasta -s', os.path.abspath(self.ref), 'reference.fa', file=f)
+        print('makeblastdb -dbtype nucl -in reference.fa', file=f)
+        print('fastaq to_fasta -s', os.path.abspath(self.qry), 'query.fa', file=f)
+        print('PYTHONPATH=' + os.path.abspath('.') + ':$PYTHONPATH', file=f)
+        print('split_bases=`' + os.path.abspath('scripts/farm_blast'), '--test --calibrate --target_walltime 30.0 --blast_type blastn --evalue 0.1 --blast_options=\'-x "a b"\' reference.fa query.fa`', file=f)
+        print('fastaq chunker --skip_all_Ns query.fa query.split $split_bases 1', file=f)
+        print('touch 01.setup.sh.done', file=f)
+        f.close()
+        self.assertTrue(filecmp.cmp(expected_script, test_script))
+        self.assertIn('calibration.tmp.*', self.p.files_to_delete)
+        os.unlink(expected_script)
+        os.unlink(test_script)
+
+
+    def test_make_setup_and_combine_scripts_db_cache(self):
+        expected_script = 'tmp.make_setup_script_expected'
+        test_script = 'tmp.make_setup_script_test'
+        self.p.db_cache = '/cache'
+        self.p._make_setup_script(script_name=test_script)
+
+        f = open(expected_script, 'w')
+        print('set -e', file=f)
+        print('PYTHONPATH=' + os.path.abspath('.') + ':$PYTHONPATH', file=f)
+        print(os.path.abspath('scripts/farm_blast'), '--test --acquire_cached_db --db_cache /cache --blast_type blastn', os.path.abspath(self.ref), 'x', file=f)
+        print('PYTHONPATH=' + os.path.abspath('.') + ':$PYTHONPATH', file=f)
+        print(os.path.abspath('scripts/farm_blast'), '--test --chunk_query', file=f)
+        f.close()
+        with open(test_script) as f:
+            got = f.readlines()
+        with open(expected_script) as f:
+            expected = f.readlines()
+        self.assertListEqual(expected[:3], got[:3])
+        self.assertEqual('fastaq to_fasta -s ' + os.path.abspath(self.qry) + ' - | fastaq chunker --skip_all_Ns - query.split 100 1\n', got[3])
+        self.assertEqual('reference.fa', self.p.blast.reference)
+        self.assertIn('reference.*', self.p.files_to_delete)
+        os.unlink(expected_script)
+        os.unlink(test_script)
+
+        self.p._make_combine_script(script_name=test_script)
+        with open(test_script) as f:
+            got = f.readlines()
+        self.assertTrue(got[7].endswith('--release_cached_db --db_cache /cache x x\n'))
+        os.unlink(test_script)
+
+        # the cost of chunks is estimated from the original reference,
+        # because the cache only has the database files
+        self.p.balance_chunks = True
+        self.p.reference = os.path.abspath(self.ref)
+        self.p._make_setup_script(script_name=test_script)
+        with open(test_script) as f:
+            got = f.readlines()
+        self.assertTrue(got[-2].endswith('--chunk_query --blast_type blastn --split_bases 100 --split_bases_tolerance 1 ' + os.path.abspath(self.ref) + ' query.fa\n'))
+        os.unlink(test_script)
+
+
+    def test_make_setup_and_combine_scripts_dedup_query(self):
+        test_script = 'tmp.make_setup_script_test'
+        self.p.dedup_query = True
+        self.p._make_setup_script(script_name=test_script)
+        with open(test_script) as f:
+            got = [x.rstrip() for x in f]
+        expected = [
+            'fastaq to_fasta -s ' + os.path.abspath(self.qry) + ' query.fa',
+            'PYTHONPATH=' + os.path.abspath('.') + ':$PYTHONPATH',
+            os.path.abspath('scripts/farm_blast') + ' --test --remove_duplicate_queries x query.fa',
+            'fastaq chunker --skip_all_Ns query.dedup.fa query.split 100 1',
+            'touch 01.setup.sh.done',
+        ]
+        self.assertEqual(expected, got[3:])
+        os.unlink(test_script)
+
+        self.p._make_combine_script(script_name=test_script)
+        with open(test_script) as f:
+            got = [x.rstrip() for x in f]
+        self.assertTrue(got[3].endswith('--fix_coords_in_blast_output --dedup_query x x'))
+        os.unlink(test_script)
+
+
+    def test_make_setup_and_combine_scripts_batch(self):
+        query_list = 'tmp.pipeline_test.query_list'
+        with open(query_list, 'w') as f:
+            print(self.qry, self.ref, sep='\n', file=f)
+        options = pipeline.get_opts(args=[
+            '--no_bsub',
+            '--batch',
+            '--outdir', 'tmp.Farm_blast_test',
+            '--test',
+            self.ref,
+            query_list])
+        p = pipeline.Pipeline(options, os.path.abspath('scripts/farm_blast'))
+        self.assertEqual([os.path.abspath(self.qry), os.path.abspath(self.ref)], p.batch_queries)
+        test_script = 'tmp.make_setup_script_test'
+        p._make_setup_script(script_name=test_script)
+        with open(test_script) as f:
+            got = [x.rstrip() for x in f]
+        self.assertTrue(got[4].endswith('--make_batch_query x query.fa'))
+        self.assertEqual('fastaq chunker --skip_all_Ns query.fa query.split 500000 1000', got[5])
+
+        p._make_combine_script(script_name=test_script)
+        with open(test_script) as f:
+            got = [x.rstrip() for x in f]
+        self.assertTrue(got[3].endswith('--fix_coords_in_blast_output --batch x x'))
+        os.unlink(test_script)
+
+        options.act = True
+        with self.assertRaises(pipeline.Error):
+            pipeline.Pipeline(options, os.path.abspath('scripts/farm_blast'))
+        os.unlink(query_list)
+
+
+    def test_make_scripts_db_shards(self):
+        options = pipeline.get_opts(args=[
+            '--no_bsub',
+            '--db_shards', '3',
+            '--outdir', 'tmp.Farm_blast_test',
+            '--test',
+            self.ref,
+            self.qry])
+        p = pipeline.Pipeline(options, os.path.abspath('scripts/farm_blast'))
+        test_script = 'tmp.make_setup_script_test'
+        p._make_setup_script(script_name=test_script)
+        with open(test_script) as f:
+            got = [x.rstrip() for x in f]
+        self.assertEqual('fastaq to_fasta -s ' + self.ref + ' reference.fa', got[1])
+        self.assertTrue(got[3].endswith('--make_db_shards --db_shards 3 x x'))
+        self.assertEqual(['makeblastdb -dbtype nucl -in reference.shard.' + str(i) + '.fa' for i in [1, 2, 3]], got[4:7])
+        self.assertTrue(got[-2].endswith('--expand_query_chunks --db_shards 3 x x'))
+
+        p._make_array_task_script(script_name=test_script)
+        with open(test_script) as f:
+            got = [x.rstrip() for x in f]
+        self.assertEqual('shard=$(( (${1%%.*} - 1) % 3 + 1 ))', got[2])
+        self.assertEqual('blastn -task blastn -db reference.shard.$shard.fa -query query.split.$1 -out tmp.array.out.$1 -outfmt 6 -dbsize `cat reference.dbsize`', got[3])
+
+        p._make_combine_script(script_name=test_script)
+        with open(test_script) as f:
+            got = [x.rstrip() for x in f]
+        self.assertTrue(got[3].endswith('--fix_coords_in_blast_output --db_shards 3 x x'))
+        os.unlink(test_script)
+
+        options.act = True
+        with self.assertRaises(pipeline.Error):
+            pipeline.Pipeline(options, os.path.abspath('scripts/farm_blast'))
+
+
+    def test_make_setup_script_db_shards_target_walltime(self):
+        '''test calibration is run against one shard of the reference'''
+        options = pipeline.get_opts(args=[
+            '--no_bsub',
+            '--db_shards', '3',
+            '--target_walltime', '30',
+            '--blast_mem', '2',
+            '--outdir', 'tmp.Farm_blast_test',
+            '--test',
+            self.ref,
+            self.qry])
+        p = pipeline.Pipeline(options, os.path.abspath('scripts/farm_blast'))
+        test_script = 'tmp.make_setup_script_test'
+        p._make_setup_script(script_name=test_script)
+        with open(test_script) as f:
+            got = [x.rstrip() for x in f]
+        os.unlink(test_script)
+        self.assertEqual(['makeblastdb -dbtype nucl -in reference.shard.' + str(i) + '.fa' for i in [1, 2, 3]], got[4:7])
+        self.assertTrue(any(['--calibrate --target_walltime 30.0 --blast_type blastn --db_shards 3 reference.shard.1.fa query.fa`' in x for x in got]))
+
+
+    def test_db_shards_database_reference(self):
+        '''test --db_shards is refused when the reference is only a database'''
+        prefix = 'tmp.db_shards_db'
+        for extension in ['nhr', 'nin', 'nsq']:
+            with open(prefix + '.' + extension, 'w') as f:
+                print('x' * 999, file=f)
+        options = pipeline.get_opts(args=[
+            '--db_shards', '2',
+            '--outdir', 'tmp.Farm_blast_test',
+            '--test',
+            prefix,
+            self.qry])
+        with self.assertRaises(pipeline.Error):
+            pipeline.Pipeline(options, os.path.abspath('scripts/farm_blast'))
+        for extension in ['nhr', 'nin', 'nsq']:
+            os.unlink(prefix + '.' + extension)
+
+
+    def test_estimate_mem(self):
+        options = pipeline.get_opts(args=[
+            '--estimate_mem',
+            '--mem_history', 'tmp.pipeline_test.mem_history',
+            '--split_bases', '1000',
+            '--outdir', 'tmp.Farm_blast_test',
+            '--test',
+            self.ref,
+            self.qry])
+        p = pipeline.Pipeline(options, os.path.abspath('scripts/farm_blast'))
+        self.assertEqual(memory.MemoryModel().estimate(p.blast, 1000), p.array_mem)
+
+        test_script = 'tmp.make_combine_script_test'
+        p._make_combine_script(script_name=test_script)
+        with open(test_script) as f:
+            got = [x.rstrip() for x in f]
+        self.assertTrue(got[8].endswith('--record_memory --mem_history ' + os.path.abspath('tmp.pipeline_test.mem_history') + ' --split_bases 1000 --blast_mem ' + str(p.array_mem) + ' --blast_type blastn ' + self.ref + ' x'))
+        os.unlink(test_script)
+
+
     def test_make_setup_job(self):
         self.p._make_setup_job()
         # the bsub call has a check for home directory, so check everthing after this is ok
@@ -109,10 +347,126 @@ class TestPipeline(unittest.TestCase):
     def test_make_array_job(self):
         self.p._make_array_job()
         # the bsub call has a check for home directory, so check everthing after this is ok
-        expected = r'''-R "select[mem>500] rusage[mem=500]" -M500 -o tmp.array.o.%I -e tmp.array.e.%I -J "name.array[1-$n]%100" blastn -task blastn -db ''' + self.ref + ''' -query query.split.\$LSB_JOBINDEX -out tmp.array.out.\$LSB_JOBINDEX -outfmt 6'''
+        expected = r'''-R "select[mem>500] rusage[mem=500]" -M500 -o tmp.array.o.%I -e tmp.array.e.%I -J "name.array[1-$n]%100" bash 02.array_task.sh \$LSB_JOBINDEX'''
+        self.assertTrue(str(self.p.array_job).endswith(expected))
+        self.p.array_job.array_indices = [1, 2, 3, 5, 7, 8]
+        expected = r'''-J "name.array[1-3,5,7-8]%100" bash 02.array_task.sh \$LSB_JOBINDEX'''
         self.assertTrue(str(self.p.array_job).endswith(expected))
 
 
+    def test_threads(self):
+        options = pipeline.get_opts(args=[
+            '--threads', '4',
+            '--blast_mem', '2',
+            '--outdir', 'tmp.Farm_blast_test',
+            '--test',
+            self.ref,
+            self.qry])
+        p = pipeline.Pipeline(options, os.path.abspath('scripts/farm_blast'))
+        self.assertIsNone(p.plan)
+        self.assertTrue(p.blast.get_run_command().endswith('-outfmt 6 -num_threads 4'))
+        p._make_array_job()
+        self.assertEqual(4, p.array_job.threads)
+
+        options.threads = 'auto'
+        options.slots = 8
+        options.total_mem = 3
+        options.blast_mem = None
+        p = pipeline.Pipeline(options, os.path.abspath('scripts/farm_blast'))
+        self.assertEqual(p.plan['threads'], p.threads)
+        self.assertEqual(p.plan['split_bases'], p.split_bases)
+        self.assertEqual(p.plan['job_memory'], p.array_mem)
+
+        for threads in ['0', 'x']:
+            options.threads = threads
+            with self.assertRaises(pipeline.Error):
+                pipeline.Pipeline(options, os.path.abspath('scripts/farm_blast'))
+
+
+    def test_threads_target_walltime(self):
+        options = pipeline.get_opts(args=[
+            '--threads', '4',
+            '--target_walltime', '30',
+            '--outdir', 'tmp.Farm_blast_test',
+            '--test',
+            self.ref,
+            self.qry])
+        p = pipeline.Pipeline(options, os.path.abspath('scripts/farm_blast'))
+        test_script = 'tmp.make_setup_script_test'
+        p._make_setup_script(script_name=test_script)
+        with open(test_script) as f:
+            got = [x.rstrip() for x in f]
+        self.assertIn('--calibrate --target_walltime 30.0 --blast_type blastn --threads 4 reference.fa query.fa`', got[5])
+        os.unlink(test_script)
+        p._make_setup_job()
+        self.assertEqual(4, p.setup_job.threads)
+
+
+    def test_target_walltime_memory_options(self):
+        '''test options that choose memory from the chunk size are refused with --target_walltime'''
+        for extra in [['--estimate_mem'], ['--threads', 'auto']]:
+            options = pipeline.get_opts(args=extra + [
+                '--target_walltime', '30',
+                '--outdir', 'tmp.Farm_blast_test',
+                '--test',
+                self.ref,
+                self.qry])
+            with self.assertRaises(pipeline.Error):
+                pipeline.Pipeline(options, os.path.abspath('scripts/farm_blast'))
+            options.blast_mem = 2
+            p = pipeline.Pipeline(options, os.path.abspath('scripts/farm_blast'))
+            self.assertEqual(2, p.array_mem)
+
+
+    def test_threads_auto_database_reference(self):
+        '''test --threads auto when the reference is already a database, with no fasta file'''
+        prefix = 'tmp.threads_auto_db'
+        for extension in ['nhr', 'nin', 'nsq']:
+            with open(prefix + '.' + extension, 'w') as f:
+                print('x' * 999, file=f)
+        options = pipeline.get_opts(args=[
+            '--threads', 'auto',
+            '--slots', '8',
+            '--outdir', 'tmp.Farm_blast_test',
+            '--test',
+            prefix,
+            self.qry])
+        p = pipeline.Pipeline(options, os.path.abspath('scripts/farm_blast'))
+        self.assertEqual(p.plan['threads'], p.threads)
+        for extension in ['nhr', 'nin', 'nsq']:
+            os.unlink(prefix + '.' + extension)
+
+
+    def test_make_array_task_script(self):
+        test_script = 'tmp.make_array_task_script_test'
+        self.p._make_array_task_script(script_name=test_script)
+        with open(test_script) as f:
+            got = f.read()
+        expected = 'set -e\ntouch tmp.array.start.$1\nblastn -task blastn -db ' + self.ref + ' -query query.split.$1 -out tmp.array.out.$1 -outfmt 6\ntouch tmp.array.done.$1\n'
+        self.assertEqual(expected, got)
+        os.unlink(test_script)
+
+
+    def test_array_indices_string(self):
+        self.assertEqual('', pipeline.array_indices_string([]))
+        self.assertEqual('1', pipeline.array_indices_string([1]))
+        self.assertEqual('1-2,4,6-8', pipeline.array_indices_string([8, 1, 2, 4, 6, 7]))
+
+
+    def test_incomplete_array_indices(self):
+        tmpdir = 'tmp.incomplete_array_indices'
+        os.mkdir(tmpdir)
+        os.chdir(tmpdir)
+        for filename in ['query.split.1', 'query.split.2', 'query.split.3', 'query.split.coords',
+                         'tmp.array.out.1', 'tmp.array.done.1', 'tmp.array.out.2', 'tmp.array.done.3']:
+            open(filename, 'w').close()
+        self.assertEqual([2, 3], self.p.incomplete_array_indices())
+        open('tmp.array.out.3.gz', 'w').close()
+        self.assertEqual([2], self.p.incomplete_array_indices())
+        os.chdir(os.pardir)
+        shutil.rmtree(tmpdir)
+
+
     def test_make_start_array_script(self):
         expected_script = os.path.join(data_dir, 'pipeline_test.02.array.sh')
         test_script = 'tmp.make_start_array_script_test'
@@ -122,6 +476,229 @@ class TestPipeline(unittest.TestCase):
         os.unlink(test_script)
 
 
+    def test_make_start_array_and_watch_scripts_speculate(self):
+        options = pipeline.get_opts(args=[
+            '--speculate',
+            '--blast_mem', '2',
+            '--bsub_name_prefix', 'name',
+            '--outdir', 'tmp.Farm_blast_test',
+            '--test',
+            self.ref,
+            self.qry])
+        p = pipeline.Pipeline(options, os.path.abspath('scripts/farm_blast'))
+        self.assertIn('02.watch.id', p.files_to_delete)
+        test_script = 'tmp.make_start_array_script_test'
+        p.array_job = 'array_job'
+        p.watch_job = 'watch_job'
+        p._make_start_array_script(script_name=test_script)
+        with open(test_script) as f:
+            got = [x.rstrip() for x in f]
+        self.assertEqual("watch_job |  awk '{print substr($2,2,length($2)-2)}' > 02.watch.id", got[5])
+        self.assertEqual(['watch_id=`cat 02.watch.id`', 'bmod -w "done($watch_id)" $combine_id'], got[6:])
+
+        p._make_watch_script(script_name=test_script)
+        with open(test_script) as f:
+            got = [x.rstrip() for x in f]
+        self.assertTrue(got[2].endswith('--watch_stragglers --bsub_queue normal --blast_mem 2.0 --bsub_name_prefix name x x'))
+        os.unlink(test_script)
+
+        options.no_bsub = True
+        p = pipeline.Pipeline(options, os.path.abspath('scripts/farm_blast'))
+        self.assertFalse(p.speculate)
+
+
+    def test_async_driver(self):
+        options = pipeline.get_opts(args=[
+            '--async_driver',
+            '--outdir', 'tmp.Farm_blast_test',
+            '--test',
+            self.ref,
+            self.qry])
+        p = pipeline.Pipeline(options, os.path.abspath('scripts/farm_blast'))
+        self.assertTrue(p.async_driver)
+        self.assertNotIn('03.combine.sh.id', p.files_to_delete)
+
+        options.no_bsub = True
+        p = pipeline.Pipeline(options, os.path.abspath('scripts/farm_blast'))
+        self.assertFalse(p.async_driver)
+        self.assertIn('03.combine.sh.id', p.files_to_delete)
+
+
+    def test_work_queue(self):
+        options = pipeline.get_opts(args=[
+            '--work_queue', '10',
+            '--outdir', 'tmp.Farm_blast_test',
+            '--test',
+            self.ref,
+            self.qry])
+        p = pipeline.Pipeline(options, os.path.abspath('scripts/farm_blast'))
+        self.assertEqual(100000, p.split_bases)
+        self.assertIn('02.queue.db', p.files_to_delete)
+        self.assertEqual(3, p._array_elements(3))
+        self.assertEqual(10, p._array_elements(42))
+        p._make_array_job()
+        self.assertEqual('bash 02.queue_worker.sh', p.array_job.command)
+
+        test_script = 'tmp.make_start_array_script_test'
+        p.array_job = 'array_job'
+        p._make_start_array_script(script_name=test_script)
+        with open(test_script) as f:
+            got = [x.rstrip() for x in f]
+        self.assertEqual('n=$(( n < 10 ? n : 10 ))', got[2])
+        p._make_setup_script(script_name=test_script)
+        with open(test_script) as f:
+            got = [x.rstrip() for x in f]
+        self.assertTrue(got[-2].endswith('--make_work_queue x x'))
+        p._make_combine_script(script_name=test_script)
+        with open(test_script) as f:
+            got = [x.rstrip() for x in f]
+        self.assertTrue(any([x.endswith('--chunk_report --work_queue 10 x x') for x in got]))
+        os.unlink(test_script)
+
+        options.speculate = True
+        with self.assertRaises(pipeline.Error):
+            pipeline.Pipeline(options, os.path.abspath('scripts/farm_blast'))
+
+
+    def test_follow(self):
+        options = pipeline.get_opts(args=[
+            '--follow',
+            '--dedup_query',
+            '--min_bitscore', '50',
+            '--outdir', 'tmp.Farm_blast_test',
+            '--test',
+            self.ref,
+            self.qry])
+        p = pipeline.Pipeline(options, os.path.abspath('scripts/farm_blast'))
+        self.assertIn('02.follow.id', p.files_to_delete)
+        test_script = 'tmp.make_start_array_script_test'
+        p.array_job = 'array_job'
+        p.follow_job = 'follow_job'
+        p._make_start_array_script(script_name=test_script)
+        with open(test_script) as f:
+            got = [x.rstrip() for x in f]
+        self.assertEqual([
+            "follow_job |  awk '{print substr($2,2,length($2)-2)}' > 02.follow.id",
+            'follow_id=`cat 02.follow.id`',
+            'bmod -w "done($array_id) && done($follow_id)" $combine_id'
+        ], got[5:])
+
+        p._make_follow_script(script_name=test_script)
+        with open(test_script) as f:
+            got = [x.rstrip() for x in f]
+        self.assertTrue(got[2].endswith('--publish_chunks --min_bitscore 50.0 --dedup_query x x'))
+        os.unlink(test_script)
+
+        # the publisher needs the queue to find failed chunks
+        options.work_queue = 2
+        p = pipeline.Pipeline(options, os.path.abspath('scripts/farm_blast'))
+        self.assertEqual(['--publish_chunks', '--min_bitscore', '50.0', '--dedup_query', '--work_queue', '2'], p._follow_options_list())
+        options.work_queue = None
+
+        options.db_shards = 2
+        with self.assertRaises(pipeline.Error):
+            pipeline.Pipeline(options, os.path.abspath('scripts/farm_blast'))
+
+
+    def test_make_array_task_and_combine_scripts_sort_output(self):
+        options = pipeline.get_opts(args=[
+            '--no_bsub',
+            '--sort_output', 'query',
+            '--outdir', 'tmp.Farm_blast_test',
+            '--test',
+            self.ref,
+            self.qry])
+        p = pipeline.Pipeline(options, os.path.abspath('scripts/farm_blast'))
+        test_script = 'tmp.make_array_task_script_test'
+        p._make_array_task_script(script_name=test_script)
+        with open(test_script) as f:
+            got = [x.rstrip() for x in f]
+        self.assertEqual(6, len(got))
+        self.assertTrue(got[4].endswith('--sort_output query --sort_chunk $1 x x'))
+        self.assertEqual('touch tmp.array.done.$1', got[5])
+
+        p._make_combine_script(script_name=test_script)
+        with open(test_script) as f:
+            got = [x.rstrip() for x in f]
+        self.assertTrue(got[3].endswith('--sort_output query --merge_sorted x x'))
+        self.assertFalse(any(['--fix_coords_in_blast_output' in x for x in got]))
+        os.unlink(test_script)
+
+
+    def test_make_array_task_and_combine_scripts_filters(self):
+        options = pipeline.get_opts(args=[
+            '--no_bsub',
+            '--top_hits', '2',
+            '--min_pident', '90.5',
+            '--outdir', 'tmp.Farm_blast_test',
+            '--test',
+            self.ref,
+            self.qry])
+        p = pipeline.Pipeline(options, os.path.abspath('scripts/farm_blast'))
+        test_script = 'tmp.make_array_task_script_test'
+        p._make_array_task_script(script_name=test_script)
+        with open(test_script) as f:
+            got = [x.rstrip() for x in f]
+        self.assertEqual(6, len(got))
+        self.assertTrue(got[4].endswith('--top_hits 2 --min_pident 90.5 --filter_chunk $1 x x'))
+
+        p._make_combine_script(script_name=test_script)
+        with open(test_script) as f:
+            got = [x.rstrip() for x in f]
+        self.assertTrue(got[3].endswith('--fix_coords_in_blast_output --top_hits 2 --min_pident 90.5 x x'))
+        os.unlink(test_script)
+
+        options.columnar = True
+        p = pipeline.Pipeline(options, os.path.abspath('scripts/farm_blast'))
+        p._make_combine_script(script_name=test_script)
+        with open(test_script) as f:
+            got = [x.rstrip() for x in f]
+        self.assertTrue(got[3].endswith('--fix_coords_in_blast_output --top_hits 2 --min_pident 90.5 --columnar x x'))
+        os.unlink(test_script)
+
+        options.top_hsps = 0
+        with self.assertRaises(pipeline.Error):
+            pipeline.Pipeline(options, os.path.abspath('scripts/farm_blast'))
+
+
+    def test_make_array_task_and_combine_scripts_fix_in_tasks(self):
+        options = pipeline.get_opts(args=[
+            '--no_bsub',
+            '--fix_in_tasks',
+            '--min_pident', '90.5',
+            '--outdir', 'tmp.Farm_blast_test',
+            '--test',
+            self.ref,
+            self.qry])
+        p = pipeline.Pipeline(options, os.path.abspath('scripts/farm_blast'))
+        test_script = 'tmp.make_array_task_script_test'
+        p._make_array_task_script(script_name=test_script)
+        with open(test_script) as f:
+            got = [x.rstrip() for x in f]
+        self.assertEqual(6, len(got))
+        self.assertTrue(got[4].endswith('--min_pident 90.5 --postprocess_chunk $1 x x'))
+
+        p._make_combine_script(script_name=test_script)
+        with open(test_script) as f:
+            got = [x.rstrip() for x in f]
+        self.assertTrue(got[3].endswith('--concat_chunks x x'))
+        self.assertFalse(any(['--fix_coords_in_blast_output' in x for x in got]))
+        os.unlink(test_script)
+
+        p._make_setup_script(script_name=test_script)
+        with open(test_script) as f:
+            got = [x.rstrip() for x in f]
+        self.assertTrue(got[-2].endswith('--index_chunk_coords x x'))
+        os.unlink(test_script)
+
+        for option, value in [('columnar', True), ('dedup_query', True), ('follow', True), ('sort_output', 'query'), ('top_hits', 2), ('db_shards', 2)]:
+            original = getattr(options, option)
+            setattr(options, option, value)
+            with self.assertRaises(pipeline.Error):
+                pipeline.Pipeline(options, os.path.abspath('scripts/farm_blast'))
+            setattr(options, option, original)
+
+
     def test_make_combine_job(self):
         self.p._make_combine_job()
         # the bsub call has a check for home directory, so check everthing after this is ok
@@ -136,10 +713,11 @@ class TestPipeline(unittest.TestCase):
         expected = [
             'cat tmp.array.e.* > 02.array.e',
             'cat tmp.array.o.* > 02.array.o',
-            'cat tmp.array.out.* | gzip -9 -c > blast.out.tmp.gz',
             'PYTHONPATH=',
-            '--fix_coords_in_blast_output x x',
-            'rm tmp.array.* query.split.* blast.out.tmp.gz 02.array.id 03.combine.sh.id',
+            '--test --fix_coords_in_blast_output x x',
+            'PYTHONPATH=',
+            '--test --chunk_report x x',
+            'rm tmp.array.* query.split.* 01.setup.sh.done 02.array.id 03.combine.sh.id',
             'touch FINISHED'
         ]
 
@@ -154,11 +732,13 @@ class TestPipeline(unittest.TestCase):
         # the script has the absolute path to farm_blast in it. We don't know
         # where that will be, so ignore that part
         self.assertEqual(len(got), len(expected))
-        self.assertTrue(got[3].startswith('PYTHONPATH'))
-        self.assertTrue('farm_blast' in got[4])
-        got[4] = got[4].split(None,1)[1]
-        self.assertListEqual(got[:2], expected[:2])
-        self.assertListEqual(got[5:], expected[5:])
+        self.assertTrue(got[2].startswith('PYTHONPATH'))
+        for i in [3, 5]:
+            self.assertTrue(got[i - 1].startswith('PYTHONPATH'))
+            self.assertTrue('farm_blast' in got[i])
+            got[i - 1] = 'PYTHONPATH='
+            got[i] = got[i].split(None,1)[1]
+        self.assertListEqual(got, expected)
         os.unlink(test_script)
 
     @nottest
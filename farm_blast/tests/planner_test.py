@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+
+import os
+import unittest
+from farm_blast import planner
+
+
+class TestPlanner(unittest.TestCase):
+    def test_speedup(self):
+        '''Test speedup from threads'''
+        self.assertEqual(1, planner.speedup(1))
+        self.assertLess(planner.speedup(4), 4)
+        self.assertGreater(planner.speedup(4), planner.speedup(2))
+
+
+    def test_query_size(self):
+        '''Test query_size scales gzipped files'''
+        for filename in ['tmp.planner_test.fa', 'tmp.planner_test.fa.gz']:
+            with open(filename, 'w') as f:
+                print('x' * 99, file=f)
+        self.assertEqual(100, planner.query_size('tmp.planner_test.fa'))
+        self.assertEqual(100 * planner.gzip_ratio, planner.query_size('tmp.planner_test.fa.gz'))
+        os.unlink('tmp.planner_test.fa')
+        os.unlink('tmp.planner_test.fa.gz')
+
+
+    def test_plan_enough_memory(self):
+        '''Test plan uses one thread per job when memory does not limit the number of jobs'''
+        got = planner.plan(10000000, 1000000, 250000, 'blastn', 100)
+        self.assertEqual(1, got['threads'])
+        self.assertEqual(100, got['parallel_jobs'])
+        self.assertEqual(100000, got['split_bases'])
+        self.assertEqual(100, got['chunks'])
+
+
+    def test_plan_memory_limited(self):
+        '''Test plan uses more threads per job when memory limits the number of jobs, because threads share the database'''
+        database_size = 10 * 1000 * 1000 * 1000
+        got = planner.plan(1000000000, 4 * database_size, database_size, 'blastn', 100, total_memory=400)
+        self.assertGreater(got['threads'], 1)
+        self.assertLessEqual(got['parallel_jobs'] * got['threads'], 100)
+        self.assertLessEqual(got['parallel_jobs'] * got['job_memory'], 400)
+
+
+    def test_plan_fixed_split_bases(self):
+        '''Test plan with split_bases given only chooses threads'''
+        got = planner.plan(10000000, 1000000, 250000, 'blastn', 8, total_memory=16, split_bases=500000)
+        self.assertEqual(500000, got['split_bases'])
+        self.assertEqual(20, got['chunks'])
+
+
+    def test_plan_errors(self):
+        '''Test plan errors'''
+        with self.assertRaises(planner.Error):
+            planner.plan(1000, 1000, 1000, 'blastn', 0)
+        with self.assertRaises(planner.Error):
+            planner.plan(1000, 1000, 1000, 'oops', 10)
+        with self.assertRaises(planner.Error):
+            planner.plan(1000, 1000, 1000000000, 'blastn', 10, total_memory=0.1)
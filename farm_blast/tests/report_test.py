@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+
+import sys
+import os
+import json
+import shutil
+import unittest
+from farm_blast import report
+
+modules_dir = os.path.dirname(os.path.abspath(report.__file__))
+data_dir = os.path.join(modules_dir, 'tests', 'data')
+
+class TestReport(unittest.TestCase):
+    def setUp(self):
+        self.original_dir = os.getcwd()
+        self.tmp_dir = os.path.abspath('tmp.report_test')
+        os.mkdir(self.tmp_dir)
+        lsf_files = {
+            1: 'utils_test_parse_lsf_report.o',
+            2: 'utils_test_parse_lsf_report.o',
+            3: 'utils_test_parse_lsf_report.memlimit.o',
+        }
+        os.chdir(self.tmp_dir)
+
+        for i in range(1, 5):
+            with open('query.split.' + str(i), 'w') as f:
+                for j in range(i):
+                    print('>seq' + str(j), 'A' * 100, sep='\n', file=f)
+            with open('tmp.array.out.' + str(i), 'w') as f:
+                for j in range(2 * i):
+                    print('seq', 'ref', sep='\t', file=f)
+            if i in lsf_files:
+                shutil.copy(os.path.join(data_dir, lsf_files[i]), 'tmp.array.o.' + str(i))
+            else:
+                with open('tmp.array.o.' + str(i), 'w') as f:
+                    pass
+            if i != 3:
+                with open('tmp.array.done.' + str(i), 'w') as f:
+                    pass
+
+        # chunk 4 has no LSF report, so its run time comes from the marker files
+        with open('tmp.array.start.4', 'w') as f:
+            pass
+        os.utime('tmp.array.start.4', (1000, 1000))
+        os.utime('tmp.array.done.4', (1400, 1400))
+        with open('query.split.coords', 'w') as f:
+            pass
+
+
+    def tearDown(self):
+        os.chdir(self.original_dir)
+        shutil.rmtree(self.tmp_dir)
+
+
+    def test_count_lines(self):
+        '''Test count_lines'''
+        self.assertEqual(6, report.count_lines('tmp.array.out.3'))
+
+
+    def test_chunk_report(self):
+        '''Test chunk_report'''
+        summary = report.chunk_report('report')
+        expected_summary = {
+            'chunks': 4,
+            'sequences': 10,
+            'bases': 1000,
+            'hits': 20,
+            'failed_chunks': [3],
+            'median_run_time': 100,
+            'max_run_time': 400,
+            'total_run_time': 612,
+            'bases_per_second': round(1000 / 612, 3),
+            'median_max_memory': 1500,
+            'max_memory': 1500,
+            'stragglers': [4],
+            'memory_outliers': [3],
+        }
+        self.assertDictEqual(expected_summary, summary)
+
+        with open('report.tsv') as f:
+            lines = [x.rstrip('\n').split('\t') for x in f]
+        self.assertEqual('#' + '\t'.join(report.columns), '\t'.join(lines[0]))
+        self.assertEqual(['1', '1', '100', '2', '100.0', '95.2', '1500.0', '1.0', '1', '0', '0'], lines[1])
+        self.assertEqual(['3', '3', '300', '6', '12.0', '10.0', '502.0', '25.0', '0', '0', '1'], lines[3])
+        self.assertEqual(['4', '4', '400', '8', '400.0', '.', '.', '1.0', '1', '1', '0'], lines[4])
+
+        with open('report.json') as f:
+            got = json.load(f)
+        self.assertDictEqual(expected_summary, got['summary'])
+        self.assertEqual(4, len(got['chunks']))
+
+
+    def test_chunk_report_work_queue(self):
+        '''Test chunk_report does not use LSF reports of queue workers'''
+        summary = report.chunk_report('report', work_queue=True)
+        self.assertEqual([3], summary['failed_chunks'])
+        self.assertEqual(None, summary['max_memory'])
+        self.assertEqual([], summary['memory_outliers'])
+        self.assertEqual(400, summary['max_run_time'])
+        with open('report.tsv') as f:
+            lines = [x.rstrip('\n').split('\t') for x in f]
+        self.assertEqual(['1', '1', '100', '2', '.', '.', '.', '.', '1', '0', '0'], lines[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+
+import os
+import shutil
+import unittest
+from pyfastaq import sequences
+from farm_blast import shards
+
+
+class TestShards(unittest.TestCase):
+    def test_make_shards(self):
+        '''Test make_shards splits reference into shards of about equal size'''
+        reference = 'tmp.shards_test.ref.fa'
+        prefix = 'tmp.shards_test.shard'
+        lengths = {'seq1': 10, 'seq2': 50, 'seq3': 30, 'seq4': 25, 'seq5': 5}
+        with open(reference, 'w') as f:
+            for name in sorted(lengths):
+                print('>' + name, 'A' * lengths[name], sep='\n', file=f)
+
+        self.assertEqual(120, shards.make_shards(reference, 2, prefix=prefix))
+        got = []
+        for i in [1, 2]:
+            got.append(sorted([seq.id for seq in sequences.file_reader(shards.shard_filename(i, prefix=prefix))]))
+            os.unlink(shards.shard_filename(i, prefix=prefix))
+        self.assertEqual([['seq1', 'seq2'], ['seq3', 'seq4', 'seq5']], got)
+
+        with self.assertRaises(shards.Error):
+            shards.make_shards(reference, 6, prefix=prefix)
+        for i in range(1, 7):
+            if os.path.exists(shards.shard_filename(i, prefix=prefix)):
+                os.unlink(shards.shard_filename(i, prefix=prefix))
+        os.unlink(reference)
+
+
+    def test_expand_query_chunks(self):
+        '''Test expand_query_chunks makes one query file per chunk and shard'''
+        tmp_dir = 'tmp.shards_test.dir'
+        os.mkdir(tmp_dir)
+        original_dir = os.getcwd()
+        os.chdir(tmp_dir)
+        for i in [1, 2]:
+            with open('query.split.' + str(i), 'w') as f:
+                print('>chunk' + str(i), 'ACGT', sep='\n', file=f)
+        open('query.split.coords', 'w').close()
+
+        self.assertEqual(6, shards.expand_query_chunks(3))
+        self.assertEqual(['query.chunk.1', 'query.chunk.2'], sorted([x for x in os.listdir('.') if x.startswith('query.chunk')]))
+        for i in range(1, 7):
+            with open('query.split.' + str(i)) as f:
+                self.assertEqual('>chunk' + str((i - 1) // 3 + 1) + '\n', f.readline())
+        self.assertTrue(os.path.exists('query.split.coords'))
+        self.assertEqual(5, shards.array_index(2, 2, 3))
+        os.chdir(original_dir)
+        shutil.rmtree(tmp_dir)
+
+
+    def test_merge_shard_outputs(self):
+        '''Test blast output of one query chunk against several shards is merged'''
+        query_file = 'tmp.shards_test.query.fa'
+        blast_files = ['tmp.shards_test.out.1', 'tmp.shards_test.out.2']
+        with open(query_file, 'w') as f:
+            print('>q1', 'ACGT', '>q2 description', 'ACGT', '>q3', 'ACGT', sep='\n', file=f)
+        shard1 = [
+            'q1\tr1\t100.00\t10\t0\t0\t1\t10\t1\t10\t1e-5\t20',
+            'q1\tr1\t100.00\t10\t0\t0\t21\t30\t1\t10\t1e-3\t15',
+            'q2\tr2\t100.00\t10\t0\t0\t1\t10\t1\t10\t1e-5\t20',
+        ]
+        shard2 = [
+            'q1\tr4\t100.00\t10\t0\t0\t1\t10\t1\t10\t1e-9\t30',
+            'q2\tr3\t100.00\t10\t0\t0\t1\t10\t1\t10\t1e-5\t20',
+            'q3\tr4\t100.00\t10\t0\t0\t1\t10\t1\t10 \t1e-9\t30',
+        ]
+        for filename, lines in zip(blast_files, [shard1, shard2]):
+            with open(filename, 'w') as f:
+                print('# header line', *lines, sep='\n', file=f)
+
+        expected = [shard2[0], shard1[0], shard1[1], shard1[2], shard2[1], shard2[2].replace(' ', '')]
+        self.assertEqual(expected, list(shards.merge_shard_outputs(blast_files, query_file)))
+        for filename in blast_files + [query_file]:
+            os.unlink(filename)
+
+
+    def test_merged_chunks(self):
+        '''Test merged output of each query chunk, and missing output reported'''
+        original_dir = os.getcwd()
+        tmp_dir = 'tmp.shards_test.merged_chunks'
+        os.mkdir(tmp_dir)
+        os.chdir(tmp_dir)
+        hits = {}
+        for chunk, query in [(1, 'q1'), (2, 'q2')]:
+            for shard in [1, 2]:
+                index = shards.array_index(chunk, shard, 2)
+                with open('query.split.' + str(index), 'w') as f:
+                    print('>' + query, 'ACGT', sep='\n', file=f)
+                hits[index] = '\t'.join([query, 'r' + str(index), '100.00', '10', '0', '0', '1', '10', '1', '10', '1e-' + str(index), '20'])
+                with open('tmp.array.out.' + str(index), 'w') as f:
+                    print(hits[index], file=f)
+
+        got = [f.readlines() for f in shards.merged_chunks(2)]
+        self.assertEqual([[hits[2] + '\n', hits[1] + '\n'], [hits[4] + '\n', hits[3] + '\n']], got)
+        chunk = shards.merged_chunks(2)[0]
+        self.assertEqual([hits[2] + '\n'], chunk.readlines(1))
+        chunk.close()
+
+        with self.assertRaises(shards.Error):
+            shards.merged_chunks(3)
+        os.unlink('tmp.array.out.3')
+        with self.assertRaises(shards.Error) as context:
+            shards.merged_chunks(2)
+        self.assertIn('array elements: 3', str(context.exception))
+        os.chdir(original_dir)
+        shutil.rmtree(tmp_dir)
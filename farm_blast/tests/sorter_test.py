@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+
+import sys
+import os
+import random
+import shutil
+import unittest
+from farm_blast import sorter
+
+modules_dir = os.path.dirname(os.path.abspath(sorter.__file__))
+data_dir = os.path.join(modules_dir, 'tests', 'data')
+
+
+def blast_line(query, ref, qstart, sstart):
+    return '\t'.join([query, ref, '99.00', '10', '0', '0', str(qstart), str(qstart + 9), str(sstart), str(sstart + 9), '1e-5', '20']) + '\n'
+
+
+def random_lines(seed, number):
+    rand = random.Random(seed)
+    return [blast_line('q' + str(rand.randint(1, 5)), 'r' + str(rand.randint(1, 3)), rand.randint(1, 100), rand.randint(1, 1000)) for i in range(number)]
+
+
+class TestSorter(unittest.TestCase):
+    def test_sort_keys(self):
+        '''Test the sort keys'''
+        line = blast_line('q1', 'r1', 42, 100)
+        self.assertEqual('q1', sorter.sort_keys['query'](line))
+        self.assertEqual(('q1', 'r1'), sorter.sort_keys['query_ref'](line))
+        self.assertEqual(('q1', 'r1', 42, 51, 100, 109), sorter.sort_keys['query_ref_coords'](line))
+        with self.assertRaises(sorter.Error):
+            sorter.get_key('oops')
+
+
+    def test_merge_sorted_files(self):
+        '''Test merging sorted files, in several rounds if there are too many to merge at once'''
+        infiles = ['tmp.sorter_test.merge.' + str(i) for i in range(5)]
+        all_lines = []
+        for i, filename in enumerate(infiles):
+            lines = sorted(random_lines(i, 20), key=sorter.sort_keys['query'])
+            all_lines.extend(lines)
+            with open(filename, 'w') as f:
+                f.write(''.join(lines))
+
+        outfile = 'tmp.sorter_test.merge.out'
+        for fan_in in [2, 3, 100]:
+            sorter.merge_sorted_files(infiles, outfile, 'query', fan_in=fan_in)
+            with open(outfile) as f:
+                # python's sort is stable, so lines with the same query stay in file order
+                self.assertEqual(sorted(all_lines, key=sorter.sort_keys['query']), f.readlines())
+            os.unlink(outfile)
+            self.assertEqual([], [x for x in os.listdir('.') if x.startswith(outfile)])
+
+        with self.assertRaises(sorter.Error):
+            sorter.merge_sorted_files(infiles, outfile, 'query', fan_in=1)
+
+        for filename in infiles:
+            os.unlink(filename)
+
+
+    def test_sort_blast_file(self):
+        '''Test sorting a file in runs, fixing coords first'''
+        infile = 'tmp.sorter_test.sort.in'
+        outfile = 'tmp.sorter_test.sort.out'
+        lines = random_lines(42, 100)
+        with open(infile, 'w') as f:
+            print('# header line', file=f)
+            f.write(''.join(lines))
+
+        coords_offset = {'q1': ('q1_original', 1000)}
+        expected = []
+        for line in lines:
+            fields = line.split('\t')
+            if fields[0] == 'q1':
+                fields[0] = 'q1_original'
+                fields[6] = str(int(fields[6]) + 1000)
+                fields[7] = str(int(fields[7]) + 1000)
+            expected.append('\t'.join(fields))
+        expected.sort(key=sorter.sort_keys['query_ref_coords'])
+
+        for max_lines in [7, 1000]:
+            sorter.sort_blast_file(infile, outfile, 'query_ref_coords', coords_offset=coords_offset, max_lines=max_lines)
+            with open(outfile) as f:
+                self.assertEqual(expected, f.readlines())
+            os.unlink(outfile)
+            self.assertEqual([], [x for x in os.listdir('.') if x.startswith(outfile)])
+
+        os.unlink(infile)
+
+
+    def test_sort_chunk_and_merge_chunks(self):
+        '''Test sorting the output of each array element, then merging them'''
+        original_dir = os.getcwd()
+        tmp_dir = 'tmp.sorter_test'
+        os.mkdir(tmp_dir)
+        os.chdir(tmp_dir)
+
+        with open('query.split.coords', 'w') as f:
+            print('q3:1-100', 'q3', 0, sep='\t', file=f)
+            print('q3:101-200', 'q3', 100, sep='\t', file=f)
+        with open('query.split.1', 'w') as f:
+            print('>q3:101-200', 'A', '>q1', 'A', sep='\n', file=f)
+        with open('query.split.2', 'w') as f:
+            print('>q2', 'A', '>q3:1-100', 'A', sep='\n', file=f)
+        with open('tmp.array.out.1', 'w') as f:
+            f.write(blast_line('q3:101-200', 'r1', 5, 1) + blast_line('q1', 'r1', 1, 1))
+        with open('tmp.array.out.2', 'w') as f:
+            f.write(blast_line('q2', 'r1', 3, 1) + blast_line('q3:1-100', 'r1', 50, 1))
+
+        sorter.sort_chunk(1, 'query_ref_coords')
+        self.assertTrue(os.path.exists('tmp.array.sorted.1'))
+        self.assertFalse(os.path.exists('tmp.array.sorted.2'))
+        sorter.merge_chunks('query_ref_coords', 'out')
+        with open('out') as f:
+            got = [x.split('\t')[0] + ':' + x.split('\t')[6] for x in f]
+        self.assertEqual(['q1:1', 'q2:3', 'q3:50', 'q3:105'], got)
+
+        os.chdir(original_dir)
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+
+import sys
+import os
+import shutil
+import unittest
+from farm_blast import straggler
+
+modules_dir = os.path.dirname(os.path.abspath(straggler.__file__))
+data_dir = os.path.join(modules_dir, 'tests', 'data')
+
+
+class FakeRunner:
+    def __init__(self):
+        self.calls = []
+
+    def run(self, index, pieces):
+        self.calls.append(('run', index, pieces))
+
+    def kill(self, index):
+        self.calls.append(('kill', index))
+
+    def kill_speculative(self, index):
+        self.calls.append(('kill_speculative', index))
+
+
+def touch(filename, mtime):
+    with open(filename, 'w'):
+        pass
+    os.utime(filename, (mtime, mtime))
+
+
+class TestStraggler(unittest.TestCase):
+    def setUp(self):
+        self.original_dir = os.getcwd()
+        self.tmp_dir = os.path.abspath('tmp.straggler_test')
+        os.mkdir(self.tmp_dir)
+        os.chdir(self.tmp_dir)
+
+        # elements 1-3 took 10 seconds each. Element 4 is still running
+        for i in range(1, 5):
+            with open('query.split.' + str(i), 'w') as f:
+                for j in range(5):
+                    print('>seq' + str(j), 'A' * 10 * (j + 1), sep='\n', file=f)
+            touch('tmp.array.start.' + str(i), 1000)
+            if i < 4:
+                touch('tmp.array.done.' + str(i), 1010)
+
+        with open('tmp.array.out.4', 'w') as f:
+            print('seq0\tref\t1', file=f)
+            print('seq0\tref\t2', file=f)
+            print('seq1\tref\t1', file=f)
+            print('seq1\tre', end='', file=f)
+
+
+    def tearDown(self):
+        os.chdir(self.original_dir)
+        shutil.rmtree(self.tmp_dir)
+
+
+    def test_finished_queries(self):
+        '''Test finished_queries'''
+        self.assertEqual(({'seq0'}, 22), straggler.finished_queries('tmp.array.out.4'))
+        self.assertEqual((set(), 0), straggler.finished_queries('tmp.array.start.4'))
+
+
+    def test_split_unfinished_queries(self):
+        '''Test split_unfinished_queries'''
+        self.assertEqual(2, straggler.split_unfinished_queries('query.split.1', {'seq0', 'seq1'}, lambda x: 'tmp.split.' + str(x), 2))
+        with open('tmp.split.1') as f:
+            self.assertEqual('>seq2\n' + 'A' * 30 + '\n>seq3\n' + 'A' * 40 + '\n', f.read())
+        with open('tmp.split.2') as f:
+            self.assertEqual('>seq4\n' + 'A' * 50 + '\n', f.read())
+        self.assertEqual(1, straggler.split_unfinished_queries('query.split.1', {'seq0', 'seq1', 'seq2', 'seq3'}, lambda x: 'tmp.split.' + str(x), 2))
+        self.assertEqual(0, straggler.split_unfinished_queries('query.split.1', {'seq' + str(x) for x in range(5)}, lambda x: 'tmp.split.' + str(x), 2))
+
+
+    def test_stragglers(self):
+        '''Test stragglers found'''
+        watcher = straggler.Watcher(FakeRunner(), sub_chunks=2)
+        self.assertEqual(4, watcher.chunks)
+        self.assertEqual([], watcher.stragglers(1000 + straggler.min_straggler_seconds))
+        self.assertEqual([4], watcher.stragglers(1001 + straggler.min_straggler_seconds))
+        os.unlink('tmp.array.done.3')
+        self.assertEqual([], watcher.stragglers(2000))
+
+
+    def test_speculative_run_wins(self):
+        '''Test output of speculative runs used when they finish first'''
+        runner = FakeRunner()
+        watcher = straggler.Watcher(runner, sub_chunks=2)
+        self.assertFalse(watcher.step(now=1050))
+        self.assertEqual([], runner.calls)
+        self.assertFalse(watcher.step(now=2000))
+        self.assertEqual([('run', 4, 2)], runner.calls)
+        with open('query.split.4.spec.1') as f:
+            self.assertEqual('>seq1\n' + 'A' * 20 + '\n>seq2\n' + 'A' * 30 + '\n>seq3\n' + 'A' * 40 + '\n', f.read())
+        self.assertTrue(os.path.exists('query.split.4.spec.2'))
+
+        # a straggler is only speculated once
+        self.assertFalse(watcher.step(now=3000))
+        self.assertEqual([('run', 4, 2)], runner.calls)
+
+        for i in [1, 2]:
+            with open('tmp.array.out.4.spec.' + str(i), 'w') as f:
+                print('spec' + str(i) + '\tref\t1', file=f)
+            touch('tmp.array.done.4.spec.' + str(i), 3000)
+
+        self.assertTrue(watcher.step(now=3001))
+        self.assertEqual([('run', 4, 2), ('kill', 4)], runner.calls)
+        self.assertTrue(os.path.exists('tmp.array.done.4'))
+        with open('tmp.array.out.4') as f:
+            self.assertEqual('seq0\tref\t1\nseq0\tref\t2\nspec1\tref\t1\nspec2\tref\t1\n', f.read())
+
+
+    def test_original_run_wins(self):
+        '''Test speculative runs killed when the original finishes first'''
+        runner = FakeRunner()
+        watcher = straggler.Watcher(runner, sub_chunks=2)
+        self.assertFalse(watcher.step(now=2000))
+        touch('tmp.array.done.4', 2001)
+        self.assertTrue(watcher.step(now=2002))
+        self.assertEqual([('run', 4, 2), ('kill_speculative', 4)], runner.calls)
+
+
+    def test_speculative_run_fails(self):
+        '''Test original run kept when a speculative run fails'''
+        runner = FakeRunner()
+        watcher = straggler.Watcher(runner, sub_chunks=2)
+        self.assertFalse(watcher.step(now=2000))
+        shutil.copy(os.path.join(data_dir, 'utils_test_parse_lsf_report.memlimit.o'), 'tmp.array.o.4.spec.1')
+        self.assertFalse(watcher.step(now=2001))
+        self.assertEqual([('run', 4, 2), ('kill_speculative', 4)], runner.calls)
+        self.assertEqual({}, watcher.speculating)
+
+
+    def test_element_fails(self):
+        '''Test Error raised when an element fails'''
+        watcher = straggler.Watcher(FakeRunner())
+        shutil.copy(os.path.join(data_dir, 'utils_test_parse_lsf_report.memlimit.o'), 'tmp.array.o.4')
+        with self.assertRaises(straggler.Error):
+            watcher.step(now=1001)
+
+
+if __name__ == '__main__':
+    unittest.main()
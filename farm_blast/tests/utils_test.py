@@ -2,12 +2,14 @@
 
 import sys
 import os
+import shutil
+import gzip
 import filecmp
 import unittest
 
 from nose.tools import nottest
 
-from farm_blast import utils
+from farm_blast import bgzf, utils, offsets
 
 
 modules_dir = os.path.dirname(os.path.abspath(utils.__file__))
@@ -26,6 +28,20 @@ class TestUtils(unittest.TestCase):
         d = utils.offset_coords_file_to_dict(os.path.join(data_dir, 'utils_test_coords_offset.tsv'))
         self.assertDictEqual(d, correct_coords)
 
+    def test_fix_blast_lines(self):
+        '''Test batch of blast lines fixed correctly'''
+        coords_offset = {'seq2': ('ref1', 10)}
+        lines = [
+            '# header line\n',
+            'seq1\tr1\t100\t10\t0\t0\t1\t10\t1\t10\t0.1\t10\n',
+            'seq2\t r1\t100\t10\t0\t0\t1\t10\t1\t10\t0.1\t10\n',
+        ]
+        expected = 'seq1\tr1\t100\t10\t0\t0\t1\t10\t1\t10\t0.1\t10\n' \
+                   'ref1\tr1\t100\t10\t0\t0\t11\t20\t1\t10\t0.1\t10\n'
+        self.assertEqual(expected, utils.fix_blast_lines(lines, coords_offset))
+        self.assertEqual('', utils.fix_blast_lines(lines[:1], coords_offset))
+
+
     @nottest
     def test_fix_blast_coords(self):
         '''Test blast coords fixed correctly'''
@@ -36,5 +52,142 @@ class TestUtils(unittest.TestCase):
         self.assertTrue(filecmp.cmp(os.path.join(data_dir, 'utils_test_fix_blast_coords.blast.fixed'), outfile))
         os.unlink(outfile)
 
+    def test_fix_blast_coords_compact_offsets(self):
+        '''Test blast coords fixed correctly using an offsets index for a big coords file'''
+        blast_file = os.path.join(data_dir, 'utils_test_fix_blast_coords.blast')
+        coords_file = 'tmp.fix_blast_coords.coords'
+        shutil.copy(os.path.join(data_dir, 'utils_test_coords_offset.tsv'), coords_file)
+        outfile = 'tmp.fix_blast_coords.out'
+        original_min_size = utils.compact_offsets_min_size
+        utils.compact_offsets_min_size = 0
+        self.assertIsInstance(utils.load_offsets(coords_file), offsets.OffsetsIndex)
+        utils.fix_blast_coords(blast_file, coords_file, outfile)
+        utils.compact_offsets_min_size = original_min_size
+        self.assertTrue(filecmp.cmp(os.path.join(data_dir, 'utils_test_fix_blast_coords.blast.fixed'), outfile))
+        os.unlink(outfile)
+        os.unlink(coords_file)
+        os.unlink(coords_file + '.index')
+
+    def test_array_output_files(self):
+        '''Test array output files found and sorted by index'''
+        prefix = 'tmp.array_output_files_test'
+        for suffix in ['1', '2', '10', 'e.1', '3.done']:
+            open(prefix + '.' + suffix, 'w').close()
+
+        expected = [prefix + '.' + x for x in ['1', '2', '10']]
+        self.assertListEqual(expected, utils.array_output_files(prefix))
+
+        for suffix in ['1', '2', '10', 'e.1', '3.done']:
+            os.unlink(prefix + '.' + suffix)
+
+
+    def test_fix_blast_coords_list_of_files(self):
+        '''Test blast coords fixed correctly when streaming several files into one'''
+        blast_file = os.path.join(data_dir, 'utils_test_fix_blast_coords.blast')
+        coords_file = os.path.join(data_dir, 'utils_test_coords_offset.tsv')
+        outfile = 'tmp.fix_blast_coords.out'
+        utils.fix_blast_coords([blast_file, blast_file], coords_file, outfile)
+        with open(os.path.join(data_dir, 'utils_test_fix_blast_coords.blast.fixed')) as f:
+            expected = f.read()
+        with open(outfile) as f:
+            self.assertEqual(expected * 2, f.read())
+        os.unlink(outfile)
+
+
+    def test_fix_blast_coords_with_stages(self):
+        '''Test fixed lines passed through stages before being written'''
+        class Buffer:
+            def __init__(self):
+                self.lines = []
+            def process(self, lines):
+                self.lines.extend(lines)
+                return []
+            def finish(self):
+                lines = self.lines
+                self.lines = []
+                return lines
+
+        class Count:
+            def __init__(self):
+                self.count = 0
+            def process(self, lines):
+                return [x + '\t' + str(self.count + i) for i, x in enumerate(lines)]
+            def finish(self):
+                return ['finished']
+
+        blast_file = os.path.join(data_dir, 'utils_test_fix_blast_coords.blast')
+        coords_file = os.path.join(data_dir, 'utils_test_coords_offset.tsv')
+        outfile = 'tmp.fix_blast_coords.out'
+        utils.fix_blast_coords(blast_file, coords_file, outfile, stages=[Buffer(), Count()])
+        with open(os.path.join(data_dir, 'utils_test_fix_blast_coords.blast.fixed')) as f:
+            expected = [x.rstrip() + '\t' + str(i) for i, x in enumerate(f)] + ['finished']
+        with open(outfile) as f:
+            self.assertEqual(expected, [x.rstrip() for x in f])
+        os.unlink(outfile)
+
+
+    def test_fix_chunk_coords(self):
+        '''Test coords fixed in the output of one chunk, written as a gzip member with an index'''
+        blast_file = os.path.join(data_dir, 'utils_test_fix_blast_coords.blast')
+        coords_offset = utils.offset_coords_file_to_dict(os.path.join(data_dir, 'utils_test_coords_offset.tsv'))
+        outfile = 'tmp.fix_chunk_coords.out.gz'
+        index_file = bgzf.index_filename(outfile)
+        utils.fix_chunk_coords(blast_file, coords_offset, outfile, index_file=index_file)
+        with open(os.path.join(data_dir, 'utils_test_fix_blast_coords.blast.fixed')) as f:
+            expected = f.read()
+        with gzip.open(outfile, 'rt') as f:
+            self.assertEqual(expected, f.read())
+        with open(outfile, 'rb') as f:
+            self.assertFalse(f.read().endswith(bgzf.eof_block))
+        reader = bgzf.Reader(outfile)
+        self.assertEqual(4, len(reader.hits('ref1')))
+        reader.close()
+        for filename in [outfile, index_file]:
+            os.unlink(filename)
+
+
+    def test_index_chunk_coords(self):
+        '''Test each chunk reads only its own lines of the coords file'''
+        original_dir = os.getcwd()
+        tmp_dir = 'tmp.index_chunk_coords_test'
+        os.mkdir(tmp_dir)
+        os.chdir(tmp_dir)
+        chunks = [['a.1', 'a.2'], ['a.3', 'b'], ['c'], ['d.1']]
+        for i, names in enumerate(chunks):
+            with open('query.split.' + str(i + 1), 'w') as f:
+                for name in names:
+                    print('>' + name + ' description', 'ACGT', sep='\n', file=f)
+        with open('query.split.coords', 'w') as f:
+            print('a.1\ta\t0', 'a.2\ta\t10', 'a.3\ta\t20', 'd.1\td\t0', sep='\n', file=f)
+
+        self.assertEqual({'a.3': ('a', 20)}, utils.chunk_coords_offset(2))
+        utils.index_chunk_coords()
+        with open('query.split.coords.chunks') as f:
+            self.assertEqual(['1\t0\t17', '2\t17\t26', '3\t26\t26', '4\t26\t34'], [x.rstrip() for x in f])
+        self.assertEqual({'a.1': ('a', 0), 'a.2': ('a', 10)}, utils.chunk_coords_offset(1))
+        self.assertEqual({'a.3': ('a', 20)}, utils.chunk_coords_offset(2))
+        self.assertEqual({}, utils.chunk_coords_offset(3))
+        self.assertEqual({'d.1': ('d', 0)}, utils.chunk_coords_offset(4))
+
+        # coords not in the same order as the chunks
+        with open('query.split.coords', 'w') as f:
+            print('d.1\td\t0', 'a.1\ta\t0', sep='\n', file=f)
+        with self.assertRaises(utils.Error):
+            utils.index_chunk_coords()
+        self.assertFalse(os.path.exists('query.split.coords.chunks'))
+        os.chdir(original_dir)
+        shutil.rmtree(tmp_dir)
+
+
+    def test_parse_lsf_report(self):
+        '''Test LSF resource usage summary parsed'''
+        expected = {'cpu_time': 95.2, 'run_time': 100, 'max_memory': 1500, 'successful': True, 'memlimit': False}
+        self.assertDictEqual(expected, utils.parse_lsf_report(os.path.join(data_dir, 'utils_test_parse_lsf_report.o')))
+        expected = {'cpu_time': 10, 'run_time': 12, 'max_memory': 502, 'successful': False, 'memlimit': True}
+        self.assertDictEqual(expected, utils.parse_lsf_report(os.path.join(data_dir, 'utils_test_parse_lsf_report.memlimit.o')))
+        expected = {'cpu_time': None, 'run_time': None, 'max_memory': None, 'successful': None, 'memlimit': False}
+        self.assertDictEqual(expected, utils.parse_lsf_report(os.path.join(data_dir, 'utils_test_coords_offset.tsv')))
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+
+import os
+import shutil
+import unittest
+from farm_blast import work_queue
+
+
+class TestWorkQueue(unittest.TestCase):
+    def setUp(self):
+        self.original_dir = os.getcwd()
+        self.tmp_dir = os.path.abspath('tmp.work_queue_test')
+        os.mkdir(self.tmp_dir)
+        os.chdir(self.tmp_dir)
+        for filename in ['query.split.1', 'query.split.2', 'query.split.3', 'query.split.coords', 'tmp.array.done.2']:
+            with open(filename, 'w'):
+                pass
+
+
+    def tearDown(self):
+        os.chdir(self.original_dir)
+        shutil.rmtree(self.tmp_dir)
+
+
+    def test_make_queue(self):
+        '''test make_queue'''
+        self.assertEqual(2, work_queue.make_queue())
+        queue = work_queue.Queue()
+        self.assertEqual({'todo': 2, 'running': 0, 'done': 0, 'failed': 0}, queue.counts())
+        queue.close()
+
+        with self.assertRaises(work_queue.Error):
+            work_queue.Queue('notafile')
+
+
+    def test_claim_and_finish(self):
+        '''test claim and finish'''
+        work_queue.make_queue()
+        queue = work_queue.Queue()
+        self.assertEqual(1, queue.claim('w1'))
+        self.assertEqual(3, queue.claim('w2'))
+        self.assertEqual(None, queue.claim('w3'))
+        self.assertEqual({'todo': 0, 'running': 2, 'done': 0, 'failed': 0}, queue.counts())
+        queue.finish(1, 'w1', True)
+        queue.finish(3, 'w2', False)
+        self.assertEqual({'todo': 1, 'running': 0, 'done': 1, 'failed': 0}, queue.counts())
+        self.assertEqual(3, queue.claim('w1'))
+        queue.close()
+
+
+    def test_lease_expires(self):
+        '''test unit of a dead worker is given to another worker'''
+        work_queue.make_queue()
+        queue = work_queue.Queue(lease_seconds=10)
+        self.assertEqual(1, queue.claim('w1', now=100))
+        self.assertEqual(3, queue.claim('w2', now=100))
+        self.assertTrue(queue.renew(1, 'w1', now=105))
+        self.assertEqual(None, queue.claim('w3', now=108))
+        self.assertEqual(3, queue.claim('w3', now=111))
+        self.assertFalse(queue.renew(3, 'w2', now=111))
+        self.assertTrue(queue.renew(3, 'w3', now=111))
+
+        # finishing a unit that has been given to another worker does nothing
+        queue.finish(3, 'w2', True)
+        self.assertEqual({'todo': 0, 'running': 2, 'done': 0, 'failed': 0}, queue.counts())
+        queue.close()
+
+
+    def test_max_attempts(self):
+        '''test unit is marked failed after max_attempts'''
+        work_queue.make_queue()
+        queue = work_queue.Queue(lease_seconds=10, max_attempts=2)
+        self.assertEqual(1, queue.claim('w1', now=100))
+        queue.finish(1, 'w1', False)
+        self.assertEqual(1, queue.claim('w1', now=100))
+        queue.finish(1, 'w1', False)
+        self.assertEqual(3, queue.claim('w1', now=100))
+        queue.finish(3, 'w1', True)
+        self.assertEqual(None, queue.claim('w2', now=200))
+        self.assertEqual({'todo': 0, 'running': 0, 'done': 1, 'failed': 1}, queue.counts())
+
+        # a unit lost by dead workers max_attempts times is also marked failed
+        work_queue.make_queue()
+        queue.close()
+        queue = work_queue.Queue(lease_seconds=10, max_attempts=2)
+        self.assertEqual(1, queue.claim('w1', now=100))
+        self.assertEqual(1, queue.claim('w2', now=111))
+        self.assertEqual(3, queue.claim('w3', now=122))
+        self.assertEqual({'todo': 0, 'running': 1, 'done': 0, 'failed': 1}, queue.counts())
+        queue.close()
+
+
+    def test_state(self):
+        '''test state of units, with expired last attempts counted as failed'''
+        work_queue.make_queue()
+        queue = work_queue.Queue(lease_seconds=10, max_attempts=2)
+        self.assertEqual('todo', queue.state(1))
+        self.assertEqual(None, queue.state(2))
+        self.assertEqual(1, queue.claim('w1', now=100))
+        self.assertEqual('running', queue.state(1, now=105))
+        self.assertEqual('running', queue.state(1, now=111))
+        self.assertEqual(1, queue.claim('w2', now=111))
+        self.assertEqual('running', queue.state(1, now=115))
+        self.assertEqual('failed', queue.state(1, now=122))
+        queue.finish(3, 'w1', True)
+        self.assertEqual('todo', queue.state(3))
+        queue.close()
+
+
+    def test_worker(self):
+        '''test Worker runs all the units'''
+        work_queue.make_queue()
+        queue = work_queue.Queue()
+        worker = work_queue.Worker(queue, 'touch tmp.array.done.INDEX', name='w1', poll_seconds=0)
+        self.assertEqual(2, worker.run())
+        for i in range(1, 4):
+            self.assertTrue(os.path.exists('tmp.array.done.' + str(i)))
+        self.assertEqual({'todo': 0, 'running': 0, 'done': 2, 'failed': 0}, queue.counts())
+        queue.close()
+
+        os.unlink('tmp.array.done.1')
+        work_queue.make_queue()
+        queue = work_queue.Queue()
+        worker = work_queue.Worker(queue, 'false', name='w1', poll_seconds=0)
+        self.assertEqual(0, worker.run())
+        self.assertEqual({'todo': 0, 'running': 0, 'done': 0, 'failed': 1}, queue.counts())
+        queue.close()
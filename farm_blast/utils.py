@@ -1,15 +1,32 @@
 from pyfastaq import utils
+import os
+import re
 import sys
+import glob
+from farm_blast import bgzf, offsets
 
 class Error (Exception): pass
 
 
-def offset_coords_file_to_dict(filename):
+# Size hint (in characters) passed to readlines() when reading blast output,
+# so that lines are processed and written in large batches
+fix_coords_read_size = 4 * 1024 * 1024
+
+# Coords files at least this big (in bytes) are loaded into an
+# offsets.OffsetsIndex instead of a dict, to save memory
+compact_offsets_min_size = 50 * 1000 * 1000
+
+
+def offset_coords_file_to_dict(filename, wanted=None):
+    '''Returns dict of sequence name -> (original name, offset). If wanted
+       is given, only sequences whose names are in wanted are included'''
     f = utils.open_file_read(filename)
     offsets = {}
 
     for line in f:
         (seq, ref, offset) = line.rstrip().split('\t')
+        if wanted is not None and seq not in wanted:
+            continue
         assert seq not in offsets
         offsets[seq] = (ref, int(offset))
 
@@ -17,11 +34,28 @@ def offset_coords_file_to_dict(filename):
     return offsets
 
 
-def fix_blast_coords(blast_file, coords_file, outfile):
-    coords_offset = offset_coords_file_to_dict(coords_file)
-    fin = utils.open_file_read(blast_file)
-    fout = utils.open_file_write(outfile)
-    for line in fin:
+def load_offsets(coords_file):
+    '''Returns the offsets in coords_file. If the file is small, this is
+       a dict made by offset_coords_file_to_dict. Otherwise it is an
+       offsets.OffsetsIndex, whose index file is coords_file.index'''
+    if os.path.getsize(coords_file) < compact_offsets_min_size:
+        return offset_coords_file_to_dict(coords_file)
+
+    index_file = coords_file + '.index'
+    offsets.make_index(coords_file, index_file)
+    return offsets.OffsetsIndex(index_file)
+
+
+def fix_blast_line_list(lines, coords_offset):
+    '''Takes a list of lines of tabulated blast output and a dict made by
+       offset_coords_file_to_dict (or anything else returned by
+       load_offsets). Returns a list of the fixed lines, without newline
+       characters'''
+    fixed = []
+    append = fixed.append
+    get_offset = coords_offset.get
+
+    for line in lines:
         # blastn sticks a bunch of header lines in the tabulated
         # output file. Need to ignore them
         if '\t' not in line:
@@ -31,17 +65,237 @@ def fix_blast_coords(blast_file, coords_file, outfile):
         # have a space character following a tab character, so
         # split on whitespace. This is OK because the pipeline has already
         # removed whitespace from sequence names
-        data = line.rstrip().split()
-        if data[0] in coords_offset:
-            data[6] = str(int(data[6]) + coords_offset[data[0]][1])
-            data[7] = str(int(data[7]) + coords_offset[data[0]][1])
-            data[0] = coords_offset[data[0]][0]
+        data = line.split()
+        if not data:
+            continue
+
+        offset = get_offset(data[0])
+        if offset is not None:
+            data[6] = str(int(data[6]) + offset[1])
+            data[7] = str(int(data[7]) + offset[1])
+            data[0] = offset[0]
 
         # always reconstruct the line, because of spaces bug mentioned above
-        line = '\t'.join(data)
+        append('\t'.join(data))
+
+    return fixed
+
+
+def lines_to_string(lines):
+    '''Returns the lines joined into one string, each one terminated with a newline'''
+    if len(lines) == 0:
+        return ''
+    return '\n'.join(lines) + '\n'
+
+
+def fix_blast_lines(lines, coords_offset):
+    '''Takes a list of lines of tabulated blast output and a dict made by
+       offset_coords_file_to_dict. Returns a single string of the fixed lines,
+       each one terminated with a newline'''
+    return lines_to_string(fix_blast_line_list(lines, coords_offset))
+
+
+def _run_stages(lines, stages):
+    '''Passes the list of lines through each stage in turn'''
+    for stage in stages:
+        lines = stage.process(lines)
+    return lines
+
+
+def _lsf_memory_to_mb(value, units):
+    multipliers = {'KB': 0.001, 'MB': 1, 'GB': 1000, 'TB': 1000000}
+    return float(value) * multipliers.get(units.upper(), 1)
+
+
+def parse_lsf_report(filename):
+    '''Parses the resource usage summary that LSF writes at the end of a
+       job's stdout file. Returns a dict with keys cpu_time and run_time
+       (in seconds), max_memory (in MB), successful (True/False) and
+       memlimit (True if LSF killed the job for using too much memory).
+       Values that are not in the file are None'''
+    report = {
+        'cpu_time': None,
+        'run_time': None,
+        'max_memory': None,
+        'successful': None,
+        'memlimit': False,
+    }
+
+    f = utils.open_file_read(filename)
+    for line in f:
+        line = line.strip()
+        if line.startswith('Successfully completed.'):
+            report['successful'] = True
+        elif line.startswith('Exited with') or line.startswith('TERM_'):
+            report['successful'] = False
+            if line.startswith('TERM_MEMLIMIT'):
+                report['memlimit'] = True
+        elif ':' in line:
+            key, value = [x.strip() for x in line.split(':', 1)]
+            fields = value.split()
+            if len(fields) == 0 or fields[0] == '-':
+                continue
+            try:
+                number = float(fields[0])
+            except ValueError:
+                continue
+
+            if key == 'CPU time':
+                report['cpu_time'] = number
+            elif key == 'Run time':
+                report['run_time'] = number
+            elif key == 'Max Memory':
+                report['max_memory'] = _lsf_memory_to_mb(number, fields[1] if len(fields) > 1 else 'MB')
+
+    utils.close(f)
+    return report
 
-        print(line.rstrip(),file=fout)
 
-    utils.close(fin)
+def array_output_files(prefix):
+    '''Returns list of files called prefix.N, where N is an integer, sorted by N'''
+    regex = re.compile(re.escape(prefix) + r'\.([0-9]+)$')
+    files = []
+    for filename in glob.glob(prefix + '.*'):
+        m = regex.match(filename)
+        if m is not None:
+            files.append((int(m.group(1)), filename))
+
+    return [x[1] for x in sorted(files)]
+
+
+def open_output_file(outfile, index_file=None, eof=True):
+    '''Opens outfile for writing. If index_file is given, the output is
+       block gzipped, and an index of where each query is written to
+       index_file (see bgzf.Writer, which is also where eof is used)'''
+    if index_file is None:
+        return utils.open_file_write(outfile)
+    return bgzf.Writer(outfile, index_file=index_file, eof=eof)
+
+
+def fix_blast_coords(blast_files, coords_file, outfile, stages=None, index_file=None):
+    '''Fixes coords in blast_files, which can be one filename or a list
+       (or other iterable) of filenames or open file-like objects. All the
+       fixed lines are written to outfile, so passing a list streams all
+       the files into one output file.
+       See open_output_file for index_file.
+       stages is an optional list of objects that further process the
+       fixed lines before they are written. Each one must have a method
+       process(lines), which takes a list of lines and returns a list of
+       lines, and a method finish(), which returns a list of any lines it
+       has not returned yet'''
+    coords_offset = load_offsets(coords_file)
+    fout = open_output_file(outfile, index_file=index_file)
+    _fix_blast_files(blast_files, coords_offset, fout, stages)
     utils.close(fout)
+    if isinstance(coords_offset, offsets.OffsetsIndex):
+        coords_offset.close()
+
+
+def _fix_blast_files(blast_files, coords_offset, fout, stages=None):
+    '''Writes the fixed lines of blast_files to the open file fout. See
+       fix_blast_coords'''
+    if isinstance(blast_files, str):
+        blast_files = [blast_files]
+    if stages is None:
+        stages = []
 
+    for blast_file in blast_files:
+        fin = utils.open_file_read(blast_file) if isinstance(blast_file, str) else blast_file
+
+        while True:
+            lines = fin.readlines(fix_coords_read_size)
+            if not lines:
+                break
+            fixed = fix_blast_line_list(lines, coords_offset)
+            fout.write(lines_to_string(_run_stages(fixed, stages)))
+
+        utils.close(fin)
+
+    # finish each stage in turn, so that each one has had all of its input
+    # before it is finished
+    for i, stage in enumerate(stages):
+        fout.write(lines_to_string(_run_stages(stage.finish(), stages[i + 1:])))
+
+
+def query_names(query_file):
+    '''Returns set of the names of the sequences in a FASTA file, up to
+       the first whitespace'''
+    names = set()
+    f = utils.open_file_read(query_file)
+    for line in f:
+        if line.startswith('>'):
+            names.add(line[1:].split()[0])
+    utils.close(f)
+    return names
+
+
+def index_chunk_coords(prefix='query.split'):
+    '''Writes prefix.coords.chunks, which has the range of bytes of
+       prefix.coords that has the lines of each query file prefix.N, on
+       lines "N<TAB>start<TAB>end". The pieces of split sequences are in
+       the same order in prefix.coords as in the query files, so the lines
+       of each file are next to each other. Query files that are links to
+       the same file (see shards.expand_query_chunks) get the same range.
+       Must be run from inside the output directory'''
+    ranges = {}
+    position = 0
+    f_coords = open(prefix + '.coords', 'rb')
+    line = f_coords.readline()
+    f_out = utils.open_file_write(prefix + '.coords.chunks')
+
+    for query_file in array_output_files(prefix):
+        real_file = os.path.realpath(query_file)
+        if real_file not in ranges:
+            names = query_names(query_file)
+            start = position
+            while line and line.split(b'\t')[0].decode() in names:
+                position += len(line)
+                line = f_coords.readline()
+            ranges[real_file] = (start, position)
+        print(query_file.split('.')[-1], *ranges[real_file], sep='\t', file=f_out)
+
+    f_coords.close()
+    utils.close(f_out)
+    if line:
+        os.unlink(prefix + '.coords.chunks')
+        raise Error('Sequence in ' + prefix + '.coords is not in the expected query file: ' + line.decode().rstrip())
+
+
+def chunk_coords_offset(index, prefix='query.split'):
+    '''Returns dict like offset_coords_file_to_dict, of only the sequences
+       in the query file prefix.index. If index is in prefix.coords.chunks
+       (see index_chunk_coords), then only that range of prefix.coords is
+       read. Otherwise the whole of prefix.coords is read.
+       Must be run from inside the output directory'''
+    index = str(index)
+    chunk_range = None
+    if os.path.exists(prefix + '.coords.chunks'):
+        with open(prefix + '.coords.chunks') as f:
+            for line in f:
+                fields = line.rstrip().split('\t')
+                if fields[0] == index:
+                    chunk_range = (int(fields[1]), int(fields[2]))
+                    break
+
+    if chunk_range is None:
+        return offset_coords_file_to_dict(prefix + '.coords', wanted=query_names(prefix + '.' + index))
+
+    offsets = {}
+    with open(prefix + '.coords', 'rb') as f:
+        f.seek(chunk_range[0])
+        for line in f.read(chunk_range[1] - chunk_range[0]).decode().splitlines():
+            (seq, ref, offset) = line.split('\t')
+            offsets[seq] = (ref, int(offset))
+    return offsets
+
+
+def fix_chunk_coords(blast_file, coords_offset, outfile, stages=None, index_file=None):
+    '''Fixes coords in blast_file, which is the output of blasting one
+       chunk of the query, using coords_offset (see chunk_coords_offset),
+       and writes the result to outfile. If index_file is given, outfile is
+       block gzipped without an end of file block, so that the outputs of
+       all the chunks can be joined with bgzf.concatenate. See
+       fix_blast_coords for stages'''
+    fout = open_output_file(outfile, index_file=index_file, eof=False)
+    _fix_blast_files(blast_file, coords_offset, fout, stages)
+    utils.close(fout)
@@ -0,0 +1,211 @@
+import os
+import time
+import signal
+import socket
+import contextlib
+import sqlite3
+import subprocess
+from farm_blast import utils
+
+class Error (Exception): pass
+
+
+queue_file = '02.queue.db'
+
+# Default split_bases when using a work queue. Small units mean that fast
+# workers take more of them, so no worker is left with a big chunk at the end
+split_bases = 100000
+
+# A worker must renew the lease on its unit within this many seconds, or
+# the unit is given to another worker
+lease_seconds = 600
+
+# Number of times a unit is tried before giving up on it
+max_attempts = 3
+
+# How often in seconds a worker with nothing to do checks the queue again,
+# while other workers still have units that might need to be run again
+poll_seconds = 30
+
+# How long in seconds to wait for another worker to release the lock on
+# the queue
+lock_timeout = 120
+
+
+def make_queue(filename=queue_file, prefix='query.split', done_prefix='tmp.array.done'):
+    '''Makes a new queue in the SQLite database filename, with one unit for
+       each file prefix.N, except those that already have a file
+       done_prefix.N. Any existing queue is replaced. Returns the number
+       of units in the queue'''
+    units = []
+    for chunk_file in utils.array_output_files(prefix):
+        unit = int(chunk_file.split('.')[-1])
+        if not os.path.exists(done_prefix + '.' + str(unit)):
+            units.append(unit)
+
+    if os.path.exists(filename):
+        os.unlink(filename)
+
+    conn = sqlite3.connect(filename)
+    with conn:
+        conn.execute('''CREATE TABLE units (
+                          unit INTEGER PRIMARY KEY,
+                          state TEXT NOT NULL,
+                          worker TEXT,
+                          lease_expires REAL,
+                          attempts INTEGER NOT NULL)''')
+        conn.executemany("INSERT INTO units VALUES (?, 'todo', NULL, NULL, 0)", [(x,) for x in units])
+    conn.close()
+    return len(units)
+
+
+class Queue:
+    def __init__(self, filename=queue_file, lease_seconds=lease_seconds, max_attempts=max_attempts):
+        '''Queue of work units made by make_queue, shared by workers on any
+           number of machines. Each unit is claimed by one worker at a time,
+           with a lease that the worker must keep renewing. Units whose
+           lease has expired (because the worker died) are given to the next
+           worker that asks for one. A unit that failed or was lost
+           max_attempts times is marked failed'''
+        if not os.path.exists(filename):
+            raise Error('Work queue file "' + filename + '" not found')
+        self.filename = filename
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        # autocommit, so that transactions are only the ones started below
+        self.conn = sqlite3.connect(filename, timeout=lock_timeout, isolation_level=None)
+
+
+    @contextlib.contextmanager
+    def _locked(self):
+        '''Runs the statements in the with block in one transaction, which
+           holds the write lock on the queue from the start'''
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield self.conn
+            self.conn.execute('COMMIT')
+        except:
+            self.conn.execute('ROLLBACK')
+            raise
+
+
+    def claim(self, worker, now=None):
+        '''Returns the number of the next unit for worker to run, or None if
+           there are no units waiting to run'''
+        now = time.time() if now is None else now
+        with self._locked() as conn:
+            conn.execute('''UPDATE units SET state = 'failed', worker = NULL
+                            WHERE state = 'running' AND lease_expires < ? AND attempts >= ?''',
+                         (now, self.max_attempts))
+            row = conn.execute('''SELECT unit FROM units
+                                  WHERE state = 'todo' OR (state = 'running' AND lease_expires < ?)
+                                  ORDER BY unit LIMIT 1''', (now,)).fetchone()
+            if row is None:
+                return None
+            conn.execute('''UPDATE units SET state = 'running', worker = ?, lease_expires = ?,
+                            attempts = attempts + 1 WHERE unit = ?''',
+                         (worker, now + self.lease_seconds, row[0]))
+        return row[0]
+
+
+    def renew(self, unit, worker, now=None):
+        '''Extends the lease of worker on unit. Returns False if worker does
+           not have the unit any more'''
+        now = time.time() if now is None else now
+        with self._locked() as conn:
+            cursor = conn.execute('''UPDATE units SET lease_expires = ?
+                                     WHERE unit = ? AND worker = ? AND state = 'running' ''',
+                                  (now + self.lease_seconds, unit, worker))
+        return cursor.rowcount == 1
+
+
+    def finish(self, unit, worker, success):
+        '''Records that worker finished unit. If it was not successful, the
+           unit goes back in the queue, or is marked failed after
+           max_attempts tries'''
+        with self._locked() as conn:
+            conn.execute('''UPDATE units SET
+                              state = CASE WHEN ? THEN 'done' WHEN attempts >= ? THEN 'failed' ELSE 'todo' END,
+                              worker = NULL, lease_expires = NULL
+                            WHERE unit = ? AND worker = ? AND state = 'running' ''',
+                         (success, self.max_attempts, unit, worker))
+
+
+    def state(self, unit, now=None):
+        '''Returns the state of unit ('todo', 'running', 'done' or 'failed'),
+           or None if it is not in the queue. A running unit whose lease has
+           expired after its last attempt counts as failed, because no
+           worker will take it again'''
+        now = time.time() if now is None else now
+        row = self.conn.execute('SELECT state, lease_expires, attempts FROM units WHERE unit = ?', (unit,)).fetchone()
+        if row is None:
+            return None
+        state, lease_expires, attempts = row
+        if state == 'running' and lease_expires < now and attempts >= self.max_attempts:
+            return 'failed'
+        return state
+
+
+    def counts(self):
+        '''Returns dict of state -> number of units in that state'''
+        counts = {'todo': 0, 'running': 0, 'done': 0, 'failed': 0}
+        for state, count in self.conn.execute('SELECT state, COUNT(*) FROM units GROUP BY state'):
+            counts[state] = count
+        return counts
+
+
+    def close(self):
+        self.conn.close()
+
+
+def worker_name():
+    return socket.gethostname() + ':' + str(os.getpid()) + ':' + os.environ.get('LSB_JOBINDEX', '0')
+
+
+class Worker:
+    def __init__(self, queue, command, name=None, poll_seconds=poll_seconds):
+        '''Takes units from queue and runs them until there are none left.
+           command is the shell command to run a unit, with the unit
+           number in place of INDEX'''
+        self.queue = queue
+        self.command = command
+        self.name = worker_name() if name is None else name
+        self.poll_seconds = poll_seconds
+        self.renew_seconds = max(1, queue.lease_seconds // 10)
+
+
+    def run_unit(self, unit):
+        '''Runs unit, renewing its lease until it finishes. Returns True if
+           it finished successfully. If the lease is lost, the unit is
+           killed and False is returned'''
+        # in its own process group, so that blast is killed along with the shell
+        proc = subprocess.Popen(self.command.replace('INDEX', str(unit)), shell=True, start_new_session=True)
+        while True:
+            try:
+                return proc.wait(timeout=self.renew_seconds) == 0
+            except subprocess.TimeoutExpired:
+                if not self.queue.renew(unit, self.name):
+                    os.killpg(proc.pid, signal.SIGKILL)
+                    proc.wait()
+                    return False
+
+
+    def run(self):
+        '''Runs units until none are waiting or running. Returns the number
+           of units that this worker finished successfully'''
+        finished = 0
+        while True:
+            unit = self.queue.claim(self.name)
+            if unit is None:
+                # units held by other workers may come back if they die
+                if self.queue.counts()['running'] == 0:
+                    break
+                time.sleep(self.poll_seconds)
+                continue
+
+            success = self.run_unit(unit)
+            self.queue.finish(unit, self.name, success)
+            if success:
+                finished += 1
+
+        return finished